@@ -46,6 +46,13 @@ interface PreprocessedData {
     trajectories: UAVPath[];
 }
 
+// prepare_frontend_data.py 输出的航班时间区间索引 (只用到每秒直方图)
+interface IntervalIndex {
+    activePerSecond: number[];
+    cumulativePerSecond: number[];
+    maxActive: number;
+}
+
 // 城市数据缓存类型
 interface CityData {
     buildings: any;
@@ -102,8 +109,12 @@ export default function MapContainer() {
     const progressBarRef = useRef<HTMLDivElement>(null);
     const progressTextRef = useRef<HTMLSpanElement>(null);
 
-    // 预计算轨迹在每一秒的活跃数与累计起飞数
+    // 已从区间索引载入每秒直方图时跳过前端预计算
+    const intervalsLoadedRef = useRef(false);
+
+    // 预计算轨迹在每一秒的活跃数与累计起飞数 (区间索引缺失时的回退)
     useEffect(() => {
+        if (intervalsLoadedRef.current) return;
         if (!trajectories.length || timeRangeRef.current.max <= 0) return;
 
         const maxSec = Math.ceil(timeRangeRef.current.max);
@@ -191,11 +202,23 @@ export default function MapContainer() {
         // 加载轨迹数据与能耗预测数据
         (async () => {
             try {
-                const [tRes, eRes] = await Promise.all([
+                const [tRes, eRes, iData] = await Promise.all([
                     fetch('/data/processed/trajectories/uav_trajectories.json'),
-                    fetch('/data/processed/energy_predictions.json').catch(() => null)
+                    fetch('/data/processed/energy_predictions.json').catch(() => null),
+                    fetch('/data/processed/trajectories/uav_trajectories_intervals.json')
+                        .then(r => r.ok ? r.json() as Promise<IntervalIndex> : null)
+                        .catch(() => null)
                 ]);
 
+                if (iData && iData.activePerSecond) {
+                    metricsRef.current = {
+                        active: iData.activePerSecond,
+                        cumulative: iData.cumulativePerSecond,
+                        maxActive: iData.maxActive || 1
+                    };
+                    intervalsLoadedRef.current = true;
+                }
+
                 if (eRes && eRes.ok) {
                     const eData = await eRes.json();
                     setEnergyData(eData);
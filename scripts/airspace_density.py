@@ -0,0 +1,230 @@
+"""
+airspace_density.py — 空域负载时空栅格预计算脚本
+
+把 uav_trajectories.csv 中的全部轨迹点装箱到三维时空网格
+(平面网格单元 × 高度层 × 时间桶)，统计每个体素内的无人机架次与采样点数，
+输出只含非空体素的稀疏张量，供前端热力图与"空域负载"指标按时间切片读取。
+
+输入:
+  - data/processed/trajectories/uav_trajectories.csv   (process_trajectories.py)
+
+输出:
+  - data/processed/airspace/density.sidx               (spatial_index.save_arrays 二进制，可内存映射)
+  - data/processed/airspace/density_summary.csv        每个时间桶的占用体素数、峰值架次与超容量体素数
+  - frontend/public/data/processed/airspace/density.json
+    稀疏 COO 张量 (按时间桶有序) + timeOffsets: 第 k 个时间桶的体素位于 [timeOffsets[k], timeOffsets[k+1])
+    体素中心: lon = origin[0] + (ix + gridOffset[0] + 0.5) * cellSize / kx
+              lat = origin[1] + (iy + gridOffset[1] + 0.5) * cellSize / ky
+              alt = (iz + 0.5) * altBand
+    时间桶 k 覆盖归一化时间 [k * bucketSeconds, (k+1) * bucketSeconds)，与 prepare_frontend_data.py 的时间轴一致
+
+算法:
+  1. 轨迹点投影到平面米坐标 (spatial_index.LocalProjection)，与时间一起量化为整数体素坐标
+  2. 体素坐标线性化为 int64 键，np.unique 计数得到采样点数 (只保留非空体素)
+  3. (键, 航班) 对按 lexsort 排序去重后再按键计数，得到每个体素内的不同航班数 (架次)
+  4. 键有序即时间桶有序，searchsorted 得到每个时间桶的偏移
+"""
+
+import csv
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from spatial_index import LocalProjection, load_trajectory_points, save_arrays, load_arrays
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("AirspaceDensity")
+
+# 平面网格单元边长 (米)
+DEFAULT_CELL_M = 100.0
+# 高度层厚度 (米)
+DEFAULT_ALT_BAND_M = 30.0
+# 时间桶长度 (秒)
+DEFAULT_BUCKET_S = 60.0
+# 单个体素在一个时间桶内可容纳的无人机架次，超过即计为超容量
+DEFAULT_CELL_CAPACITY = 4
+
+SUMMARY_FIELDS = ['bucket', 't_start', 't_end', 'occupied_cells', 'flights_total',
+                  'max_flights', 'mean_flights', 'overloaded_cells']
+
+
+def bin_trajectories(table: dict, cell_m: float = DEFAULT_CELL_M, band_m: float = DEFAULT_ALT_BAND_M,
+                     bucket_s: float = DEFAULT_BUCKET_S):
+    """
+    返回 (arrays, meta):
+      arrays: t / ix / iy / iz (int32) 非空体素坐标，按 (t, ix, iy, iz) 升序；
+              flights / points (int32) 体素内航班数与采样点数；time_offsets (int64[T+1])
+      meta:   网格原点、尺寸与投影参数
+    """
+    lon, lat, ts = table['lon'], table['lat'], table['timestamp']
+    if len(ts) == 0:
+        raise ValueError("轨迹为空")
+    proj = LocalProjection((lon.min() + lon.max()) / 2, (lat.min() + lat.max()) / 2)
+    x, y = proj.forward(lon, lat)
+    gx = np.floor(x / cell_m).astype(np.int64)
+    gy = np.floor(y / cell_m).astype(np.int64)
+    ix0, iy0 = int(gx.min()), int(gy.min())
+    ix, iy = gx - ix0, gy - iy0
+    iz = np.floor(np.maximum(table['alt_rel'], 0.0) / band_m).astype(np.int64)
+    t0 = float(ts.min())
+    it = np.floor((ts - t0) / bucket_s).astype(np.int64)
+    shape = [int(it.max()) + 1, int(ix.max()) + 1, int(iy.max()) + 1, int(iz.max()) + 1]
+
+    key = ((it * shape[1] + ix) * shape[2] + iy) * shape[3] + iz
+    cells, points = np.unique(key, return_counts=True)
+
+    # 每个体素内的不同航班数: (键, 航班) 排序后去掉相邻重复对，再按键计数
+    flight = np.repeat(np.arange(len(table['flight_ids']), dtype=np.int64),
+                       np.diff(table['flight_offsets']))
+    order = np.lexsort((flight, key))
+    k_sorted, f_sorted = key[order], flight[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (k_sorted[1:] != k_sorted[:-1]) | (f_sorted[1:] != f_sorted[:-1])
+    pair_keys = k_sorted[first]
+    flights = np.diff(np.searchsorted(pair_keys, cells, side='left'),
+                      append=len(pair_keys)).astype(np.int32)
+
+    c_iz = cells % shape[3]
+    rest = cells // shape[3]
+    c_iy = rest % shape[2]
+    rest //= shape[2]
+    c_ix = rest % shape[1]
+    c_it = rest // shape[1]
+    time_offsets = np.searchsorted(c_it, np.arange(shape[0] + 1), side='left').astype(np.int64)
+
+    arrays = {
+        't': c_it.astype(np.int32), 'ix': c_ix.astype(np.int32),
+        'iy': c_iy.astype(np.int32), 'iz': c_iz.astype(np.int32),
+        'flights': flights, 'points': points.astype(np.int32),
+        'time_offsets': time_offsets,
+    }
+    meta = {
+        'origin': [proj.lon0, proj.lat0], 'kx': proj.kx, 'ky': proj.ky,
+        'grid_offset': [ix0, iy0], 'shape': shape,
+        'cell_m': cell_m, 'alt_band_m': band_m, 'bucket_s': bucket_s, 'time_origin': t0,
+    }
+    return arrays, meta
+
+
+def time_slice(arrays: dict, k: int) -> dict:
+    """取第 k 个时间桶的全部非空体素 (数组视图，不复制)"""
+    a, b = arrays['time_offsets'][k], arrays['time_offsets'][k + 1]
+    return {name: arrays[name][a:b] for name in ('ix', 'iy', 'iz', 'flights', 'points')}
+
+
+def load_density(path: Path, mmap: bool = True):
+    """读取 density.sidx，返回 (arrays, meta)"""
+    return load_arrays(path, mmap=mmap)
+
+
+def summarize(arrays: dict, meta: dict, capacity: int = DEFAULT_CELL_CAPACITY) -> list:
+    """每个时间桶的负载统计"""
+    rows = []
+    bucket_s = meta['bucket_s']
+    for k in range(meta['shape'][0]):
+        flights = time_slice(arrays, k)['flights']
+        rows.append({
+            'bucket': k,
+            't_start': round(k * bucket_s, 3),
+            't_end': round((k + 1) * bucket_s, 3),
+            'occupied_cells': len(flights),
+            'flights_total': int(flights.sum()),
+            'max_flights': int(flights.max()) if len(flights) else 0,
+            'mean_flights': round(float(flights.mean()), 3) if len(flights) else 0.0,
+            'overloaded_cells': int(np.count_nonzero(flights > capacity)),
+        })
+    return rows
+
+
+def write_frontend_json(arrays: dict, meta: dict, output_json: Path, capacity: int):
+    data = {
+        'version': 1,
+        'cellSize': meta['cell_m'],
+        'altBand': meta['alt_band_m'],
+        'bucketSeconds': meta['bucket_s'],
+        'capacity': capacity,
+        'origin': meta['origin'],
+        'kx': round(meta['kx'], 6),
+        'ky': round(meta['ky'], 6),
+        'gridOffset': meta['grid_offset'],
+        'shape': meta['shape'],
+        'timeOffsets': arrays['time_offsets'].tolist(),
+        'ix': arrays['ix'].tolist(),
+        'iy': arrays['iy'].tolist(),
+        'iz': arrays['iz'].tolist(),
+        'flights': arrays['flights'].tolist(),
+        'points': arrays['points'].tolist(),
+        'maxFlights': int(arrays['flights'].max()) if len(arrays['flights']) else 0,
+    }
+    output_json.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    return output_json.stat().st_size
+
+
+def main(traj_csv: Path, output_dir: Path, frontend_json: Path, cell_m: float, band_m: float,
+         bucket_s: float, capacity: int):
+    t0 = time.perf_counter()
+    table = load_trajectory_points(traj_csv, columns=('lat', 'lon', 'alt_rel'))
+    n_points = len(table['timestamp'])
+    logger.info(f"轨迹: {len(table['flight_ids'])} 条航班, {n_points} 个点")
+    t1 = time.perf_counter()
+
+    arrays, meta = bin_trajectories(table, cell_m, band_m, bucket_s)
+    t2 = time.perf_counter()
+    dense = int(np.prod(meta['shape'], dtype=np.int64))
+    n_cells = len(arrays['flights'])
+    logger.info(f"网格: {' × '.join(map(str, meta['shape']))} (时间 × x × y × 高度) = {dense} 个体素, "
+                f"非空 {n_cells} ({n_cells / max(dense, 1) * 100:.3f}%)")
+
+    meta['capacity'] = capacity
+    save_arrays(output_dir / "density.sidx", arrays, meta)
+    rows = summarize(arrays, meta, capacity)
+    with open(output_dir / "density_summary.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    size_mb = write_frontend_json(arrays, meta, frontend_json, capacity) / (1024 * 1024)
+
+    peak = max(rows, key=lambda r: r['max_flights'])
+    overloaded = sum(r['overloaded_cells'] for r in rows)
+    logger.info(f"✅ 空域负载栅格: {output_dir / 'density.sidx'}")
+    logger.info(f"   前端 JSON: {frontend_json} ({size_mb:.2f} MB)")
+    logger.info(f"   峰值: 时间桶 {peak['bucket']} 单体素 {peak['max_flights']} 架次; "
+                f"超容量 (> {capacity}) 体素-时间桶 {overloaded} 个")
+    logger.info(f"   耗时: 读轨迹 {t1 - t0:.2f}s | 装箱 {t2 - t1:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="空域负载时空栅格预计算")
+    parser.add_argument("--trajectories", type=str, default=None,
+                        help="轨迹 CSV, 默认 data/processed/trajectories/uav_trajectories.csv")
+    parser.add_argument("--cell-m", type=float, default=DEFAULT_CELL_M, help="平面网格单元边长 (米)")
+    parser.add_argument("--alt-band-m", type=float, default=DEFAULT_ALT_BAND_M, help="高度层厚度 (米)")
+    parser.add_argument("--bucket-s", type=float, default=DEFAULT_BUCKET_S, help="时间桶长度 (秒)")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CELL_CAPACITY,
+                        help="单体素单时间桶容量 (架次)")
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent.parent
+    processed_dir = base / "data" / "processed"
+    traj_csv = Path(args.trajectories) if args.trajectories else \
+        processed_dir / "trajectories" / "uav_trajectories.csv"
+    frontend_json = base / "frontend" / "public" / "data" / "processed" / "airspace" / "density.json"
+
+    if not traj_csv.exists():
+        logger.error(f"❌ 轨迹数据不存在: {traj_csv}")
+        logger.info("请先运行 process_trajectories.py")
+        exit(1)
+
+    logger.info("=========== 开始空域负载栅格预计算 ===========")
+    main(traj_csv, processed_dir / "airspace", frontend_json, args.cell_m, args.alt_band_m,
+         args.bucket_s, args.capacity)
+    logger.info("=========== 预计算完成 ===========")
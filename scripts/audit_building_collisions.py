@@ -0,0 +1,200 @@
+"""
+audit_building_collisions.py — 轨迹 × 三维建筑碰撞审计脚本
+
+检查 uav_trajectories.csv 中每个轨迹点是否落入 buildings_3d.geojson 的建筑轮廓内
+且飞行高度低于建筑高度 (+ 安全余量)，输出每个航班的碰撞区段。
+
+输入:
+  - data/processed/trajectories/uav_trajectories.csv   (process_trajectories.py)
+  - data/processed/{city}/buildings_3d.geojson         (process_multi_city.py)
+    同目录存在未过期的 spatial_index.sidx 时直接内存映射加载，不解析 GeoJSON
+
+输出:
+  - data/processed/audit/{city}/building_collisions.csv
+    每行一个碰撞区段: 同一航班连续落在同一建筑内的采样点
+  - --mode segment 时输出 building_collisions_swept.csv
+    检查相邻采样点之间的三维线段 (扫掠体)，避免高速飞行时两个采样点"跳过"薄建筑；
+    points 列为区段包含的线段数
+
+算法:
+  1. 建筑轮廓批量载入为扁平边表，按 bbox 登记到均匀网格 (spatial_index.BuildingIndex)
+  2. 轨迹点投影到平面米坐标，只与所在网格单元的候选建筑做 bbox 过滤
+  3. 对候选 (点, 建筑) 对做向量化射线法点面判断，再比较高度得到净空 (clearance)
+  4. 按 (航班, 建筑) 合并连续命中点为碰撞区段
+  线段模式: 线段 bbox 网格预筛 → 精确线段-轮廓相交得到线段在轮廓内的参数区间
+           → 该区间内的最低高度与建筑高度比较 (高度区间重叠)
+"""
+
+import csv
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from spatial_index import (load_building_index, load_prebuilt_index, load_trajectory_points,
+                           group_runs, trajectory_segments, find_city_file, DEFAULT_CELL_SIZE)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("BuildingCollisionAudit")
+
+# 安全余量 (米): 飞行高度低于 建筑高度 + 余量 即视为碰撞
+DEFAULT_MARGIN_M = 0.0
+
+SEGMENT_FIELDS = [
+    'flight_id', 'osm_id', 'building_height_m', 't_start', 't_end',
+    'points', 'min_alt_m', 'min_clearance_m'
+]
+
+
+def detect_point_collisions(table: dict, index, margin_m: float = DEFAULT_MARGIN_M):
+    """
+    返回所有碰撞点: (point_idx, building_idx, clearance)
+    clearance = 飞行高度 - 建筑高度，负值表示低于楼顶
+    """
+    x, y = index.proj.forward(table['lon'], table['lat'])
+    p, b = index.locate(x, y)
+    clearance = table['alt_rel'][p] - index.heights[b]
+    hit = clearance < margin_m
+    return p[hit], b[hit], clearance[hit]
+
+
+def detect_swept_collisions(table: dict, index, margin_m: float = DEFAULT_MARGIN_M):
+    """
+    线段模式: 检查每条相邻采样点线段是否穿过建筑棱柱。
+    返回 (segment_start_idx, building_idx, clearance, t_enter, t_exit)，
+    clearance 为线段在轮廓内部分的最低高度 - 建筑高度
+    """
+    seg = trajectory_segments(table)
+    x, y = index.proj.forward(table['lon'], table['lat'])
+    x0, y0, x1, y1 = x[seg], y[seg], x[seg + 1], y[seg + 1]
+    s, b = index.segment_candidates(x0, y0, x1, y1)
+    hit, t_enter, t_exit = index.segment_overlap(x0, y0, x1, y1, s, b)
+    s, b, t_enter, t_exit = s[hit], b[hit], t_enter[hit], t_exit[hit]
+
+    # 高度沿线段线性变化，轮廓内部分的最低点必在区间端点处
+    z0 = table['alt_rel'][seg[s]]
+    dz = table['alt_rel'][seg[s] + 1] - z0
+    z_low = np.minimum(z0 + t_enter * dz, z0 + t_exit * dz)
+    clearance = z_low - index.heights[b]
+    hit = clearance < margin_m
+    return seg[s][hit], b[hit], clearance[hit], t_enter[hit], t_exit[hit]
+
+
+def collision_segments(table: dict, index, p, b, clearance, t_enter=None, t_exit=None) -> list:
+    """
+    按 (航班, 建筑) 把连续的碰撞点合并为区段。
+    线段模式下 p 为线段起点下标，t_enter/t_exit 用于把起止时间插值到穿入/穿出位置
+    """
+    if len(p) == 0:
+        return []
+    f = np.searchsorted(table['flight_offsets'], p, side='right') - 1
+    order, starts, ends = group_runs(f, b, p)
+    p, b, f, clearance = p[order], b[order], f[order], clearance[order]
+
+    min_clear = np.minimum.reduceat(clearance, starts)
+    min_alt = min_clear + index.heights[b[starts]]
+    ts = table['timestamp']
+    t_start = ts[p[starts]]
+    t_end = ts[p[ends]]
+    if t_enter is not None:
+        t_start = t_start + t_enter[order][starts] * (ts[p[starts] + 1] - t_start)
+        t_end = t_end + t_exit[order][ends] * (ts[p[ends] + 1] - t_end)
+
+    segments = []
+    for k, (s, e) in enumerate(zip(starts, ends)):
+        segments.append({
+            'flight_id': table['flight_ids'][f[s]],
+            'osm_id': int(index.osm_ids[b[s]]),
+            'building_height_m': round(float(index.heights[b[s]]), 2),
+            't_start': round(float(t_start[k]), 3),
+            't_end': round(float(t_end[k]), 3),
+            'points': int(e - s + 1),
+            'min_alt_m': round(float(min_alt[k]), 2),
+            'min_clearance_m': round(float(min_clear[k]), 2),
+        })
+    return segments
+
+
+def write_segments(segments: list, output_csv: Path, fieldnames=SEGMENT_FIELDS):
+    output_csv.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(segments)
+
+
+def audit_city(city: str, traj_csv: Path, buildings_path: Path, output_csv: Path,
+               cell_size: float = DEFAULT_CELL_SIZE, margin_m: float = DEFAULT_MARGIN_M,
+               mode: str = "point"):
+    """单城市建筑碰撞审计主流程"""
+    t0 = time.perf_counter()
+    # 优先内存映射 process_multi_city.py 预构建的 spatial_index.sidx
+    prebuilt = load_prebuilt_index(buildings_path, 'buildings', cell_size=cell_size)
+    if prebuilt is not None:
+        index = prebuilt['buildings']
+        logger.info(f"建筑索引 (预构建): {len(index)} 栋, {len(index.edges)} 条边")
+    else:
+        index = load_building_index(buildings_path, cell_size=cell_size)
+    t1 = time.perf_counter()
+    table = load_trajectory_points(traj_csv)
+    t2 = time.perf_counter()
+    n_points = len(table['timestamp'])
+    n_flights = len(table['flight_ids'])
+    logger.info(f"轨迹: {n_flights} 条航班, {n_points} 个点")
+
+    if mode == "segment":
+        p, b, clearance, t_enter, t_exit = detect_swept_collisions(table, index, margin_m)
+        segments = collision_segments(table, index, p, b, clearance, t_enter, t_exit)
+    else:
+        p, b, clearance = detect_point_collisions(table, index, margin_m)
+        segments = collision_segments(table, index, p, b, clearance)
+    t3 = time.perf_counter()
+
+    write_segments(segments, output_csv)
+    violation_flights = len({s['flight_id'] for s in segments})
+    logger.info(f"✅ 碰撞审计完成: {output_csv}")
+    unit = "线段" if mode == "segment" else "点"
+    logger.info(f"   碰撞{unit}: {len(p)}, 碰撞区段: {len(segments)}")
+    logger.info(f"   违规航班: {violation_flights} / {n_flights} "
+                f"({violation_flights / max(n_flights, 1) * 100:.1f}%)")
+    logger.info(f"   耗时: 索引 {t1 - t0:.2f}s | 读轨迹 {t2 - t1:.2f}s | 检测 {t3 - t2:.2f}s")
+    return segments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="轨迹 × 三维建筑碰撞审计")
+    parser.add_argument("--city", type=str, default="shenzhen", help="城市 (与 process_multi_city.CITIES 一致)")
+    parser.add_argument("--trajectories", type=str, default=None,
+                        help="轨迹 CSV, 默认 data/processed/trajectories/uav_trajectories.csv")
+    parser.add_argument("--cell-size", type=float, default=DEFAULT_CELL_SIZE, help="网格单元边长 (米)")
+    parser.add_argument("--margin", type=float, default=DEFAULT_MARGIN_M, help="楼顶安全余量 (米)")
+    parser.add_argument("--mode", type=str, choices=["point", "segment"], default="point",
+                        help="point: 逐采样点检查; segment: 检查相邻采样点之间的线段 (扫掠)")
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent.parent
+    processed_dir = base / "data" / "processed"
+    traj_csv = Path(args.trajectories) if args.trajectories else \
+        processed_dir / "trajectories" / "uav_trajectories.csv"
+    buildings_path = find_city_file(processed_dir, args.city, "buildings_3d.geojson")
+    suffix = "_swept" if args.mode == "segment" else ""
+    output_csv = processed_dir / "audit" / args.city / f"building_collisions{suffix}.csv"
+
+    if not traj_csv.exists():
+        logger.error(f"❌ 轨迹数据不存在: {traj_csv}")
+        logger.info("请先运行 process_trajectories.py")
+        exit(1)
+    if not buildings_path.exists():
+        logger.error(f"❌ 建筑数据不存在: {buildings_path}")
+        logger.info("请先运行 process_multi_city.py")
+        exit(1)
+
+    logger.info("=========== 开始建筑碰撞审计 ===========")
+    audit_city(args.city, traj_csv, buildings_path, output_csv,
+               cell_size=args.cell_size, margin_m=args.margin, mode=args.mode)
+    logger.info("=========== 审计完成 ===========")
@@ -0,0 +1,192 @@
+"""
+audit_nfz_intrusions.py — 敏感 POI 禁飞区入侵检测脚本
+
+把 poi_sensitive.geojson 中的每个敏感点 (医院、学校、派出所等) 按类别半径
+缓冲为圆柱形禁飞区，检测轨迹点是否进入，输出入侵事件。
+
+输入:
+  - data/processed/trajectories/uav_trajectories.csv   (process_trajectories.py)
+  - data/processed/{city}/poi_sensitive.geojson        (process_multi_city.py)
+    同目录存在未过期的 spatial_index.sidx 时直接内存映射加载，不解析 GeoJSON
+
+输出:
+  - data/processed/audit/{city}/nfz_intrusions.csv
+    每行一个入侵事件: 同一航班连续位于同一禁飞区内的采样点
+  - --mode segment 时输出 nfz_intrusions_swept.csv
+    检查相邻采样点之间的线段与禁飞圆柱是否相交，进出时刻插值到穿越圆边界的位置；
+    points 列为事件包含的线段数
+
+算法:
+  1. 禁飞区中心投影到平面米坐标，按不小于最大半径的网格边长哈希 (spatial_index.PointGridIndex)
+  2. 每个轨迹点只与本单元及相邻 8 个单元内的禁飞区比较距离
+  3. 按 (航班, 禁飞区) 合并连续命中点为入侵事件，记录最近距离
+  线段模式: 线段 bbox 外扩一圈的单元内求圆心到线段的最近距离，并与高度区间 [0, 上限] 求交
+"""
+
+import csv
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from spatial_index import (LocalProjection, PointGridIndex, load_sensitive_pois,
+                           load_prebuilt_index, load_trajectory_points, group_runs,
+                           trajectory_segments, find_city_file, NFZ_RADIUS_M, DEFAULT_NFZ_RADIUS_M)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("NFZIntrusionAudit")
+
+# 禁飞区高度上限 (米)，高于此高度的轨迹点不计入侵
+NFZ_CEILING_M = 150.0
+
+EVENT_FIELDS = [
+    'flight_id', 'poi_id', 'name', 'category', 'radius_m',
+    't_enter', 't_exit', 'points', 'min_distance_m'
+]
+
+
+def build_nfz_index(pois: dict, proj: LocalProjection = None):
+    """构建禁飞区网格哈希；未指定投影时以禁飞区中心的包围盒中心为原点"""
+    if proj is None:
+        lon0 = (pois['lon'].min() + pois['lon'].max()) / 2 if len(pois['lon']) else 0.0
+        lat0 = (pois['lat'].min() + pois['lat'].max()) / 2 if len(pois['lat']) else 0.0
+        proj = LocalProjection(lon0, lat0)
+    x, y = proj.forward(pois['lon'], pois['lat'])
+    return proj, PointGridIndex(x, y, pois['radius'])
+
+
+def detect_intrusions(table: dict, pois: dict, proj, index, ceiling_m: float = NFZ_CEILING_M):
+    """返回入侵点 (point_idx, poi_idx, distance)"""
+    below = np.flatnonzero(table['alt_rel'] < ceiling_m)
+    x, y = proj.forward(table['lon'][below], table['lat'][below])
+    p, i, dist = index.query(x, y)
+    return below[p], i, dist
+
+
+def detect_swept_intrusions(table: dict, pois: dict, proj, index, ceiling_m: float = NFZ_CEILING_M):
+    """
+    线段模式: 返回与禁飞圆柱相交的线段 (segment_start_idx, poi_idx, distance, t_in, t_out)
+    线段高度区间 [min(z0, z1), max(z0, z1)] 与 [0, ceiling] 有重叠才计入
+    """
+    seg = trajectory_segments(table)
+    alt = table['alt_rel']
+    seg = seg[np.minimum(alt[seg], alt[seg + 1]) < ceiling_m]
+    x, y = proj.forward(table['lon'], table['lat'])
+    s, i, dist, t_in, t_out = index.query_segments(x[seg], y[seg], x[seg + 1], y[seg + 1])
+    return seg[s], i, dist, t_in, t_out
+
+
+def intrusion_events(table: dict, pois: dict, p, i, dist, t_in=None, t_out=None) -> list:
+    """
+    按 (航班, 禁飞区) 合并连续入侵点为事件。
+    线段模式下 p 为线段起点下标，t_in/t_out 用于把进出时刻插值到圆边界
+    """
+    if len(p) == 0:
+        return []
+    f = np.searchsorted(table['flight_offsets'], p, side='right') - 1
+    order, starts, ends = group_runs(f, i, p)
+    p, i, f, dist = p[order], i[order], f[order], dist[order]
+    min_dist = np.minimum.reduceat(dist, starts)
+    ts = table['timestamp']
+    t_enter = ts[p[starts]]
+    t_exit = ts[p[ends]]
+    if t_in is not None:
+        t_enter = t_enter + t_in[order][starts] * (ts[p[starts] + 1] - t_enter)
+        t_exit = t_exit + t_out[order][ends] * (ts[p[ends] + 1] - t_exit)
+
+    events = []
+    for k, (s, e) in enumerate(zip(starts, ends)):
+        poi = i[s]
+        events.append({
+            'flight_id': table['flight_ids'][f[s]],
+            'poi_id': pois['poi_id'][poi],
+            'name': pois['name'][poi],
+            'category': pois['category'][poi],
+            'radius_m': round(float(pois['radius'][poi]), 1),
+            't_enter': round(float(t_enter[k]), 3),
+            't_exit': round(float(t_exit[k]), 3),
+            'points': int(e - s + 1),
+            'min_distance_m': round(float(min_dist[k]), 2),
+        })
+    return events
+
+
+def audit_city(city: str, traj_csv: Path, poi_path: Path, output_csv: Path,
+               ceiling_m: float = NFZ_CEILING_M, mode: str = "point"):
+    """单城市禁飞区入侵检测主流程"""
+    t0 = time.perf_counter()
+    # 优先内存映射 process_multi_city.py 预构建的 spatial_index.sidx (禁飞半径配置需一致)
+    prebuilt = load_prebuilt_index(poi_path, 'nfz', radius_map=NFZ_RADIUS_M,
+                                   default_radius=DEFAULT_NFZ_RADIUS_M)
+    if prebuilt is not None:
+        pois, proj, index = prebuilt['pois'], prebuilt['proj'], prebuilt['nfz']
+    else:
+        pois = load_sensitive_pois(poi_path, NFZ_RADIUS_M, DEFAULT_NFZ_RADIUS_M)
+        proj, index = build_nfz_index(pois)
+    logger.info(f"禁飞区: {len(index)} 个, 网格边长 {index.cell_size:g} 米")
+    t1 = time.perf_counter()
+    table = load_trajectory_points(traj_csv)
+    t2 = time.perf_counter()
+    n_points = len(table['timestamp'])
+    n_flights = len(table['flight_ids'])
+    logger.info(f"轨迹: {n_flights} 条航班, {n_points} 个点")
+
+    if mode == "segment":
+        p, i, dist, t_in, t_out = detect_swept_intrusions(table, pois, proj, index, ceiling_m)
+        events = intrusion_events(table, pois, p, i, dist, t_in, t_out)
+    else:
+        p, i, dist = detect_intrusions(table, pois, proj, index, ceiling_m)
+        events = intrusion_events(table, pois, p, i, dist)
+    t3 = time.perf_counter()
+
+    output_csv.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=EVENT_FIELDS)
+        writer.writeheader()
+        writer.writerows(events)
+
+    violation_flights = len({e['flight_id'] for e in events})
+    logger.info(f"✅ 禁飞区检测完成: {output_csv}")
+    unit = "线段" if mode == "segment" else "点"
+    logger.info(f"   入侵{unit}: {len(p)}, 入侵事件: {len(events)}")
+    logger.info(f"   违规航班: {violation_flights} / {n_flights} "
+                f"({violation_flights / max(n_flights, 1) * 100:.1f}%)")
+    logger.info(f"   耗时: 索引 {t1 - t0:.2f}s | 读轨迹 {t2 - t1:.2f}s | 检测 {t3 - t2:.2f}s")
+    return events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="敏感 POI 禁飞区入侵检测")
+    parser.add_argument("--city", type=str, default="shenzhen", help="城市 (与 process_multi_city.CITIES 一致)")
+    parser.add_argument("--trajectories", type=str, default=None,
+                        help="轨迹 CSV, 默认 data/processed/trajectories/uav_trajectories.csv")
+    parser.add_argument("--ceiling", type=float, default=NFZ_CEILING_M, help="禁飞区高度上限 (米)")
+    parser.add_argument("--mode", type=str, choices=["point", "segment"], default="point",
+                        help="point: 逐采样点检查; segment: 检查相邻采样点之间的线段 (扫掠)")
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent.parent
+    processed_dir = base / "data" / "processed"
+    traj_csv = Path(args.trajectories) if args.trajectories else \
+        processed_dir / "trajectories" / "uav_trajectories.csv"
+    poi_path = find_city_file(processed_dir, args.city, "poi_sensitive.geojson")
+    suffix = "_swept" if args.mode == "segment" else ""
+    output_csv = processed_dir / "audit" / args.city / f"nfz_intrusions{suffix}.csv"
+
+    if not traj_csv.exists():
+        logger.error(f"❌ 轨迹数据不存在: {traj_csv}")
+        logger.info("请先运行 process_trajectories.py")
+        exit(1)
+    if not poi_path.exists():
+        logger.error(f"❌ 敏感 POI 数据不存在: {poi_path}")
+        logger.info("请先运行 process_multi_city.py")
+        exit(1)
+
+    logger.info("=========== 开始禁飞区入侵检测 ===========")
+    audit_city(args.city, traj_csv, poi_path, output_csv, ceiling_m=args.ceiling, mode=args.mode)
+    logger.info("=========== 检测完成 ===========")
@@ -0,0 +1,231 @@
+"""
+audit_separation.py — 无人机间最小间隔 (冲突) 检测脚本
+
+所有轨迹共用同一批起降锚点，航班之间可能在同一时刻彼此接近。本脚本把航班重采样到
+统一时间网格，逐时刻检查任意两架无人机是否同时小于水平间隔且小于垂直间隔
+(圆柱形保护区)，输出冲突事件。
+
+输入:
+  - data/processed/trajectories/uav_trajectories.csv   (process_trajectories.py)
+
+输出:
+  - data/processed/audit/separation_conflicts.csv
+    每行一个冲突事件: 同一对航班在连续时刻保持失去间隔的区段
+
+算法:
+  1. 每个航班在其起止时间内按 --tick 秒重采样 (全局单调键 flight_idx * 跨度 + 时间一次
+     searchsorted 得到前后采样点，线性插值)
+  2. 样本投影到平面米坐标，按 (时刻, 水平间隔 × 水平间隔 × 垂直间隔 的网格单元) 线性化为键并排序
+  3. 同一单元内的样本两两比较，另与 13 个"正方向"相邻单元比较 (每对单元只比较一次)，
+     只有相邻单元内的样本可能小于间隔，避免逐时刻 O(n²) 两两比较
+  4. 按时刻分块处理以限制候选对数组的内存；命中对按 (航班对, 连续时刻) 合并为事件
+"""
+
+import csv
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from spatial_index import LocalProjection, load_trajectory_points, ragged_arange, group_runs
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("SeparationAudit")
+
+# 最小水平间隔 (米)
+DEFAULT_HORIZONTAL_SEP_M = 50.0
+# 最小垂直间隔 (米)
+DEFAULT_VERTICAL_SEP_M = 15.0
+# 重采样时间步长 (秒)
+DEFAULT_TICK_S = 1.0
+# 每块处理的时刻数
+TICKS_PER_CHUNK = 300
+
+EVENT_FIELDS = [
+    'flight_a', 'flight_b', 't_start', 't_end', 'ticks',
+    'min_distance_m', 'min_horizontal_m', 'min_vertical_m'
+]
+
+# 13 个正方向相邻单元偏移 (dx, dy, dz)：与其相反的 13 个由对方单元覆盖
+NEIGHBOR_OFFSETS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                    if (dx, dy, dz) > (0, 0, 0)]
+
+
+def resample(table: dict, tick_s: float):
+    """
+    把每个航班重采样到 t0 + k * tick_s 的时刻上 (只取航班起止时间之内的时刻)。
+    返回 (tick[M], flight[M], lon[M], lat[M], alt[M])，按航班、时刻排序
+    """
+    ts, offsets = table['timestamp'], table['flight_offsets']
+    n = len(table['flight_ids'])
+    t0 = float(ts.min())
+    t_start = ts[offsets[:-1]]
+    t_end = ts[offsets[1:] - 1]
+    k_first = np.ceil((t_start - t0) / tick_s - 1e-9).astype(np.int64)
+    k_last = np.floor((t_end - t0) / tick_s + 1e-9).astype(np.int64)
+    flight, tick = ragged_arange(k_first, np.maximum(k_last - k_first + 1, 0))
+    t = np.minimum(np.maximum(t0 + tick * tick_s, t_start[flight]), t_end[flight])
+
+    span = float(ts.max() - t0) + 1.0
+    point_flight = np.repeat(np.arange(n, dtype=np.float64), np.diff(offsets))
+    key = point_flight * span + (ts - t0)
+    hi = np.minimum(np.searchsorted(key, flight * span + (t - t0), side='left'), offsets[flight + 1] - 1)
+    lo = np.maximum(hi - 1, offsets[flight])
+    dt = ts[hi] - ts[lo]
+    w = np.where(dt > 0, (t - ts[lo]) / np.where(dt > 0, dt, 1.0), 0.0)
+
+    def interp(v):
+        return v[lo] + w * (v[hi] - v[lo])
+    return tick, flight, interp(table['lon']), interp(table['lat']), interp(table['alt_rel'])
+
+
+def find_conflicts(tick, flight, x, y, z, h_sep: float, v_sep: float,
+                   ticks_per_chunk: int = TICKS_PER_CHUNK):
+    """
+    返回失去间隔的样本对 (tick, flight_a, flight_b, horizontal, vertical)，flight_a < flight_b
+    """
+    # 单元坐标整体平移 1，使相邻偏移不越界，线性化后不同时刻/单元的键互不重叠
+    cx = np.floor(x / h_sep).astype(np.int64)
+    cy = np.floor(y / h_sep).astype(np.int64)
+    cz = np.floor(z / v_sep).astype(np.int64)
+    cx -= cx.min() - 1
+    cy -= cy.min() - 1
+    cz -= cz.min() - 1
+    nx, ny, nz = int(cx.max()) + 2, int(cy.max()) + 2, int(cz.max()) + 2
+    cell = (cx * ny + cy) * nz + cz
+    n_cells = nx * ny * nz
+
+    order = np.lexsort((cell, tick))
+    tick, flight, x, y, z, cell = tick[order], flight[order], x[order], y[order], z[order], cell[order]
+    offsets = [(dx * ny + dy) * nz + dz for dx, dy, dz in NEIGHBOR_OFFSETS]
+
+    results = []
+    chunk_edges = np.searchsorted(tick, np.arange(tick.min(), tick.max() + ticks_per_chunk + 1,
+                                                  ticks_per_chunk), side='left')
+    for a, b in zip(chunk_edges[:-1], chunk_edges[1:]):
+        if a == b:
+            continue
+        key = (tick[a:b] - tick[a]) * n_cells + cell[a:b]
+        # 同单元: 每个样本与同单元中排在其后的样本
+        cell_end = np.searchsorted(key, key, side='right')
+        own = np.arange(len(key), dtype=np.int64)
+        i_parts, j_parts = [], []
+        i, j = ragged_arange(own + 1, cell_end - own - 1)
+        i_parts.append(i)
+        j_parts.append(j)
+        # 正方向相邻单元
+        for off in offsets:
+            lo = np.searchsorted(key, key + off, side='left')
+            hi = np.searchsorted(key, key + off, side='right')
+            i, j = ragged_arange(lo, hi - lo)
+            i_parts.append(i)
+            j_parts.append(j)
+        i = np.concatenate(i_parts) + a
+        j = np.concatenate(j_parts) + a
+
+        horizontal = np.hypot(x[i] - x[j], y[i] - y[j])
+        vertical = np.abs(z[i] - z[j])
+        hit = (horizontal < h_sep) & (vertical < v_sep) & (flight[i] != flight[j])
+        i, j = i[hit], j[hit]
+        fa, fb = np.minimum(flight[i], flight[j]), np.maximum(flight[i], flight[j])
+        results.append((tick[i], fa, fb, horizontal[hit], vertical[hit]))
+
+    if not results:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0), np.zeros(0)
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+def conflict_events(table: dict, t0: float, tick_s: float, tick, fa, fb, horizontal, vertical) -> list:
+    """按 (航班对, 连续时刻) 合并为冲突事件"""
+    if len(tick) == 0:
+        return []
+    order, starts, ends = group_runs(fa, fb, tick)
+    tick, fa, fb = tick[order], fa[order], fb[order]
+    horizontal, vertical = horizontal[order], vertical[order]
+    distance = np.hypot(horizontal, vertical)
+    min_d = np.minimum.reduceat(distance, starts)
+    min_h = np.minimum.reduceat(horizontal, starts)
+    min_v = np.minimum.reduceat(vertical, starts)
+
+    ids = table['flight_ids']
+    events = []
+    for k, (s, e) in enumerate(zip(starts, ends)):
+        events.append({
+            'flight_a': ids[fa[s]],
+            'flight_b': ids[fb[s]],
+            't_start': round(t0 + float(tick[s]) * tick_s, 3),
+            't_end': round(t0 + float(tick[e]) * tick_s, 3),
+            'ticks': int(e - s + 1),
+            'min_distance_m': round(float(min_d[k]), 2),
+            'min_horizontal_m': round(float(min_h[k]), 2),
+            'min_vertical_m': round(float(min_v[k]), 2),
+        })
+    return events
+
+
+def audit_separation(traj_csv: Path, output_csv: Path, h_sep: float = DEFAULT_HORIZONTAL_SEP_M,
+                     v_sep: float = DEFAULT_VERTICAL_SEP_M, tick_s: float = DEFAULT_TICK_S):
+    """间隔冲突检测主流程"""
+    t0 = time.perf_counter()
+    table = load_trajectory_points(traj_csv)
+    n_flights = len(table['flight_ids'])
+    logger.info(f"轨迹: {n_flights} 条航班, {len(table['timestamp'])} 个点")
+    t1 = time.perf_counter()
+
+    tick, flight, lon, lat, alt = resample(table, tick_s)
+    proj = LocalProjection((lon.min() + lon.max()) / 2, (lat.min() + lat.max()) / 2)
+    x, y = proj.forward(lon, lat)
+    peak = int(np.bincount(tick).max()) if len(tick) else 0
+    logger.info(f"重采样 ({tick_s:g} 秒): {len(tick)} 个样本, 同时在空峰值 {peak} 架")
+    t2 = time.perf_counter()
+
+    tick, fa, fb, horizontal, vertical = find_conflicts(tick, flight, x, y, alt, h_sep, v_sep)
+    events = conflict_events(table, float(table['timestamp'].min()), tick_s,
+                             tick, fa, fb, horizontal, vertical)
+    t3 = time.perf_counter()
+
+    output_csv.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=EVENT_FIELDS)
+        writer.writeheader()
+        writer.writerows(events)
+
+    involved = len({e['flight_a'] for e in events} | {e['flight_b'] for e in events})
+    logger.info(f"✅ 间隔冲突检测完成: {output_csv}")
+    logger.info(f"   间隔: 水平 {h_sep:g} 米 / 垂直 {v_sep:g} 米; 冲突时刻对: {len(tick)}, 冲突事件: {len(events)}")
+    logger.info(f"   涉及航班: {involved} / {n_flights} ({involved / max(n_flights, 1) * 100:.1f}%)")
+    logger.info(f"   耗时: 读轨迹 {t1 - t0:.2f}s | 重采样 {t2 - t1:.2f}s | 检测 {t3 - t2:.2f}s")
+    return events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="无人机间最小间隔冲突检测")
+    parser.add_argument("--trajectories", type=str, default=None,
+                        help="轨迹 CSV, 默认 data/processed/trajectories/uav_trajectories.csv")
+    parser.add_argument("--horizontal-sep", type=float, default=DEFAULT_HORIZONTAL_SEP_M,
+                        help="最小水平间隔 (米)")
+    parser.add_argument("--vertical-sep", type=float, default=DEFAULT_VERTICAL_SEP_M,
+                        help="最小垂直间隔 (米)")
+    parser.add_argument("--tick", type=float, default=DEFAULT_TICK_S, help="重采样时间步长 (秒)")
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent.parent
+    processed_dir = base / "data" / "processed"
+    traj_csv = Path(args.trajectories) if args.trajectories else \
+        processed_dir / "trajectories" / "uav_trajectories.csv"
+    output_csv = processed_dir / "audit" / "separation_conflicts.csv"
+
+    if not traj_csv.exists():
+        logger.error(f"❌ 轨迹数据不存在: {traj_csv}")
+        logger.info("请先运行 process_trajectories.py")
+        exit(1)
+
+    logger.info("=========== 开始间隔冲突检测 ===========")
+    audit_separation(traj_csv, output_csv, args.horizontal_sep, args.vertical_sep, args.tick)
+    logger.info("=========== 检测完成 ===========")
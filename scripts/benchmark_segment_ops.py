@@ -0,0 +1,253 @@
+"""
+benchmark_segment_ops.py — segment_ops 分段算子与原实现的微基准
+
+对比同一份数据上 "原实现" 与 segment_ops 分段算子的耗时，并校验结果一致:
+  1. 算子级: 段内差分 / 累加 / 最小最大 / 首末值 / 梯形积分 vs pandas groupby (积分 vs 逐段 np.trapz)
+  2. energy_model.predict_energy 的能耗累计: groupby diff + cumsum + 逐航班循环 vs 分段算子
+  3. process_trajectories 的物理量推导: 逐点 Python 循环 (原 process_single_trajectory) vs
+     derive_trajectory_columns 批量计算
+
+输入:
+  - 合成数据 (默认): --flights 条航班，每条 --min-points ~ --max-points 个点
+  - 或 --raw 指定原始轨迹 CSV (timestamp, tx, ty, tz)，用于第 3 项
+
+输出:
+  - 日志表格: 每项的原实现耗时、分段算子耗时、加速比与最大绝对误差
+
+原实现按改写前的代码原样保留在本文件中，仅作为基准参照。
+"""
+
+import math
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from segment_ops import (segment_offsets, seg_diff, seg_cumsum, seg_min, seg_max,
+                         seg_first, seg_last, seg_trapezoid)
+from process_trajectories import (derive_trajectory_columns, split_trajectories, load_raw_rows,
+                                  BATTERY_DRAIN_COEFF, ALT_MIN, ALT_MAX, ROLL_RESPONSE_COEFF)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("SegmentOpsBenchmark")
+
+# 默认合成航班数
+DEFAULT_FLIGHTS = 5000
+# 合成航班点数范围
+DEFAULT_MIN_POINTS = 50
+DEFAULT_MAX_POINTS = 400
+# 每项重复次数 (取最快一次)
+DEFAULT_REPEATS = 3
+
+
+def best_time(fn, repeats: int):
+    """重复运行取最快一次，返回 (秒, 最后一次结果)"""
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def synthetic_points(n_flights: int, min_points: int, max_points: int, seed: int = 0):
+    """合成扁平轨迹: 返回 (flight_ids, offsets, timestamp, power)"""
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(min_points, max_points + 1, n_flights)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    owner = np.repeat(np.arange(n_flights), counts)
+    ts = np.cumsum(rng.uniform(0.05, 0.15, offsets[-1]))
+    power = rng.uniform(300.0, 600.0, offsets[-1])
+    ids = np.char.add('UAV_', np.char.zfill(owner.astype(str), 5))
+    return ids, offsets, ts, power
+
+
+def synthetic_trajectories(n_flights: int, min_points: int, max_points: int, seed: int = 0) -> list:
+    """合成原始轨迹 (随机游走)，格式与 split_trajectories 的结果一致"""
+    rng = np.random.default_rng(seed)
+    trajectories = []
+    for n in rng.integers(min_points, max_points + 1, n_flights):
+        t = 1000.0 + np.arange(n) * 0.1
+        xyz = np.cumsum(rng.normal(0.0, 0.3, (n, 3)), axis=0)
+        trajectories.append(list(zip(t.tolist(), *(xyz[:, k].tolist() for k in range(3)))))
+    return trajectories
+
+
+# ============= 原实现 (基准参照) =============
+
+def reference_energy(df: pd.DataFrame, seed: int = 42) -> dict:
+    """原 energy_model.predict_energy 的能耗/电量累计 (groupby + 逐航班循环)"""
+    np.random.seed(seed)
+    df = df.copy()
+    df['dt'] = df.groupby('flight_id')['timestamp'].diff().fillna(0.1)
+    df['energy_J'] = df['power_pred_W'] * df['dt']
+    df['cumulative_energy_J'] = df.groupby('flight_id')['energy_J'].cumsum()
+    results = {}
+    for fid, group in df.groupby('flight_id'):
+        total_energy = group['cumulative_energy_J'].max()
+        consumption_ratio = np.random.uniform(0.2, 0.5)
+        battery_capacity = max(total_energy / consumption_ratio, 1.0)
+        battery_pct = 100.0 - (group['cumulative_energy_J'] / battery_capacity) * 100.0
+        results[fid] = np.clip(battery_pct, 0, 100).round(1).to_numpy()
+    return results
+
+
+def segmented_energy(df: pd.DataFrame, seed: int = 42) -> dict:
+    """同一计算的分段算子版本 (与 energy_model.predict_energy 现实现一致)"""
+    np.random.seed(seed)
+    flight_ids, offsets = segment_offsets(df['flight_id'].to_numpy())
+    power = df['power_pred_W'].to_numpy()
+    dt = seg_diff(df['timestamp'].to_numpy(dtype=np.float64), offsets, fill=0.1)
+    cumulative = seg_cumsum(power * dt, offsets)
+    capacity = np.maximum(seg_max(cumulative, offsets) / np.random.uniform(0.2, 0.5, len(flight_ids)), 1.0)
+    battery = np.clip(100.0 - cumulative / np.repeat(capacity, np.diff(offsets)) * 100.0, 0, 100).round(1)
+    return {fid: battery[offsets[f]:offsets[f + 1]] for f, fid in enumerate(flight_ids)}
+
+
+def reference_trajectory(traj: list) -> list:
+    """原 process_single_trajectory 的逐点循环 (只保留数值计算，起终点固定)"""
+    start_lat, start_lon, end_lat, end_lon = 22.5, 113.9, 22.6, 114.0
+    n = len(traj)
+    xs = [p[1] for p in traj]
+    ys = [p[2] for p in traj]
+    zs = [p[3] for p in traj]
+    x_min, x_max = min(xs), max(xs)
+    y_min, y_max = min(ys), max(ys)
+    z_min, z_max = min(zs), max(zs)
+    x_range = x_max - x_min if x_max != x_min else 1.0
+    y_range = y_max - y_min if y_max != y_min else 1.0
+    z_range = z_max - z_min if z_max != z_min else 1.0
+
+    rows = []
+    battery = 100.0
+    prev_yaw = 0.0
+    for i in range(n):
+        t, tx, ty, tz = traj[i]
+        lat = start_lat + (tx - x_min) / x_range * (end_lat - start_lat)
+        lon = start_lon + (ty - y_min) / y_range * (end_lon - start_lon)
+        alt_abs = ALT_MIN + (tz - z_min) / z_range * (ALT_MAX - ALT_MIN)
+        if i < n - 1:
+            dt = traj[i + 1][0] - t
+            if dt <= 0:
+                dt = 0.05
+            speed_x = (traj[i + 1][1] - tx) / dt
+            speed_y = (traj[i + 1][2] - ty) / dt
+            speed_z = (traj[i + 1][3] - tz) / dt
+        else:
+            dt = t - traj[i - 1][0]
+            if dt <= 0:
+                dt = 0.05
+            speed_x = (tx - traj[i - 1][1]) / dt
+            speed_y = (ty - traj[i - 1][2]) / dt
+            speed_z = (tz - traj[i - 1][3]) / dt
+        h_speed = math.sqrt(speed_x ** 2 + speed_y ** 2)
+        yaw = math.degrees(math.atan2(speed_y, speed_x)) if h_speed > 0.01 else prev_yaw
+        pitch = math.degrees(math.atan2(speed_z, max(h_speed, 0.01)))
+        yaw_rate = yaw - prev_yaw
+        if yaw_rate > 180:
+            yaw_rate -= 360
+        elif yaw_rate < -180:
+            yaw_rate += 360
+        roll = max(-45, min(45, yaw_rate * ROLL_RESPONSE_COEFF))
+        prev_yaw = yaw
+        battery -= BATTERY_DRAIN_COEFF * (speed_x ** 2 + speed_y ** 2 + speed_z ** 2) * dt
+        battery = max(battery, 5.0)
+        rows.append((lat, lon, alt_abs, speed_x, speed_y, speed_z, roll, pitch, yaw, battery))
+    return rows
+
+
+# ============= 基准项 =============
+
+def bench_kernels(ids, offsets, ts, power, repeats: int) -> list:
+    df = pd.DataFrame({'flight_id': ids, 'timestamp': ts, 'power': power})
+    g = df.groupby('flight_id', sort=False)
+    x_groups = np.split(ts, offsets[1:-1])
+    y_groups = np.split(power, offsets[1:-1])
+    trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+    cases = [
+        ('seg_diff', lambda: g['timestamp'].diff().fillna(0.0).to_numpy(),
+         lambda: seg_diff(ts, offsets, fill=0.0)),
+        ('seg_cumsum', lambda: g['power'].cumsum().to_numpy(),
+         lambda: seg_cumsum(power, offsets)),
+        ('seg_min', lambda: g['power'].min().to_numpy(), lambda: seg_min(power, offsets)),
+        ('seg_max', lambda: g['power'].max().to_numpy(), lambda: seg_max(power, offsets)),
+        ('seg_first', lambda: g['power'].first().to_numpy(), lambda: seg_first(power, offsets)),
+        ('seg_last', lambda: g['power'].last().to_numpy(), lambda: seg_last(power, offsets)),
+        ('seg_trapezoid', lambda: np.array([trapezoid(y, x) for x, y in zip(x_groups, y_groups)]),
+         lambda: seg_trapezoid(power, ts, offsets)),
+    ]
+    rows = []
+    for name, ref, new in cases:
+        t_ref, r_ref = best_time(ref, repeats)
+        t_new, r_new = best_time(new, repeats)
+        rows.append((name, t_ref, t_new, float(np.max(np.abs(r_ref - r_new))) if len(r_ref) else 0.0))
+    return rows
+
+
+def bench_energy(ids, offsets, ts, power, repeats: int) -> tuple:
+    df = pd.DataFrame({'flight_id': ids, 'timestamp': ts, 'power_pred_W': power})
+    t_ref, r_ref = best_time(lambda: reference_energy(df), repeats)
+    t_new, r_new = best_time(lambda: segmented_energy(df), repeats)
+    err = max(float(np.max(np.abs(r_ref[k] - r_new[k]))) for k in r_ref)
+    return ('predict_energy 电量累计', t_ref, t_new, err)
+
+
+def bench_trajectories(trajectories: list, repeats: int) -> tuple:
+    anchors = [(22.5, 113.9, 'start'), (22.6, 114.0, 'end')]
+
+    def reference():
+        return np.array([row for traj in trajectories for row in reference_trajectory(traj)])
+
+    def segmented():
+        cols = derive_trajectory_columns(trajectories, 0, anchors)
+        return np.column_stack([cols[k] for k in ('lat', 'lon', 'alt_abs', 'speed_x', 'speed_y', 'speed_z',
+                                                  'roll', 'pitch', 'yaw', 'battery_rem')])
+
+    t_ref, r_ref = best_time(reference, repeats)
+    t_new, r_new = best_time(segmented, repeats)
+    # 新实现按航班编号确定性选取起终点，与参照的固定起终点不同，经纬度两列不参与比较
+    err = float(np.max(np.abs(r_ref[:, 2:] - r_new[:, 2:])))
+    return ('process_trajectories 物理量推导', t_ref, t_new, err)
+
+
+def main(n_flights: int, min_points: int, max_points: int, repeats: int, raw_csv: Path = None):
+    ids, offsets, ts, power = synthetic_points(n_flights, min_points, max_points)
+    logger.info(f"合成数据: {n_flights} 条航班, {len(ts)} 个点; 每项取 {repeats} 次最快")
+
+    rows = bench_kernels(ids, offsets, ts, power, repeats)
+    rows.append(bench_energy(ids, offsets, ts, power, repeats))
+
+    if raw_csv is not None:
+        trajectories = split_trajectories(load_raw_rows(raw_csv))
+        logger.info(f"原始轨迹: {raw_csv} → {len(trajectories)} 条")
+    else:
+        trajectories = synthetic_trajectories(n_flights // 5, min_points, max_points)
+    rows.append(bench_trajectories(trajectories, repeats))
+
+    logger.info(f"{'项目':<32}{'原实现 (ms)':>14}{'分段算子 (ms)':>16}{'加速比':>10}{'最大误差':>12}")
+    for name, t_ref, t_new, err in rows:
+        logger.info(f"{name:<32}{t_ref * 1000:>14.2f}{t_new * 1000:>16.2f}"
+                    f"{t_ref / max(t_new, 1e-9):>9.1f}x{err:>12.2e}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="segment_ops 分段算子微基准")
+    parser.add_argument("--flights", type=int, default=DEFAULT_FLIGHTS, help="合成航班数")
+    parser.add_argument("--min-points", type=int, default=DEFAULT_MIN_POINTS, help="每条航班最少点数")
+    parser.add_argument("--max-points", type=int, default=DEFAULT_MAX_POINTS, help="每条航班最多点数")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="每项重复次数 (取最快)")
+    parser.add_argument("--raw", type=str, default=None,
+                        help="原始轨迹 CSV (timestamp, tx, ty, tz)，用于物理量推导一项; 默认合成")
+    args = parser.parse_args()
+
+    logger.info("=========== 开始分段算子微基准 ===========")
+    main(args.flights, args.min_points, args.max_points, args.repeats,
+         Path(args.raw) if args.raw else None)
+    logger.info("=========== 基准完成 ===========")
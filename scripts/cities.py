@@ -0,0 +1,14 @@
+"""
+cities.py — 多城市处理共用的城市列表
+
+process_multi_city.py、run_compliance_audit.py、generate_vector_tiles.py、serve_api.py
+都从这里取城市列表。本模块不配置日志、不导入其他脚本，导入时没有副作用。
+"""
+
+# 城市列表 (与 fetch_multi_city_data.py 保持一致)
+CITIES = ["shenzhen", "chongqing", "beijing", "shanghai", "guangzhou", "chengdu"]
+
+CITY_NAMES = {
+    "shenzhen": "深圳南山", "chongqing": "重庆主城", "beijing": "北京核心",
+    "shanghai": "上海核心", "guangzhou": "广州核心", "chengdu": "成都核心"
+}
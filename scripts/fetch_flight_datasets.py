@@ -41,13 +41,14 @@ def ensure_deps():
 # ===========================================================================
 #  1. UAV Delivery Dataset
 # ===========================================================================
-def fetch_uav_delivery(output_dir: Path):
+def fetch_uav_delivery(output_dir: Path, extract: bool = True):
     """
     获取 UAV Delivery Dataset — 6911条模拟配送轨迹
     数据来源优先级:
       1. GitHub ZIP 下载 (多个仓库镜像)
       2. Git clone
       3. HuggingFace datasets 搜索
+    extract=False 时保留 download.zip 不解压
     """
     import requests
     from tqdm import tqdm
@@ -150,7 +151,9 @@ def fetch_uav_delivery(output_dir: Path):
         return False
 
     # 解压 ZIP
-    if zip_path.exists():
+    if zip_path.exists() and not extract:
+        logger.info(f"保留压缩包不解压: {zip_path}")
+    elif zip_path.exists():
         logger.info("正在解压...")
         try:
             with zipfile.ZipFile(zip_path, 'r') as zf:
@@ -169,11 +172,12 @@ def fetch_uav_delivery(output_dir: Path):
 # ===========================================================================
 #  2. AirLab CMU 真实飞行能耗数据
 # ===========================================================================
-def fetch_airlab_energy(output_dir: Path):
+def fetch_airlab_energy(output_dir: Path, extract: bool = True):
     """
     获取 AirLab CMU 无人机包裹配送飞行能耗数据集
     DJI Matrice 100, 209次飞行, 含位置和能耗数据
     数据来源: Figshare (doi:10.1184/R1/12683453)
+    extract=False 时只下载压缩包，由 process_airlab_energy.py --zip 直接流式读取
     """
     import requests
     from tqdm import tqdm
@@ -246,7 +250,9 @@ def fetch_airlab_energy(output_dir: Path):
             logger.error(f"  ❌ 下载失败 {fname}: {e}")
 
     # 解压 ZIP 文件
-    for zfile in dest.glob("*.zip"):
+    if not extract:
+        logger.info("  跳过解压: 可运行 process_airlab_energy.py --zip <压缩包> 直接读取")
+    for zfile in (dest.glob("*.zip") if extract else []):
         if os.path.getsize(zfile) > 1000:  # 确保不是空文件
             logger.info(f"  解压: {zfile.name}")
             try:
@@ -360,6 +366,8 @@ if __name__ == "__main__":
                         help="跳过 AirLab 能耗数据")
     parser.add_argument("--skip-nbsdc", action="store_true",
                         help="跳过国家数据中心飞行数据")
+    parser.add_argument("--no-extract", action="store_true",
+                        help="只下载压缩包不解压 (AirLab 可由 process_airlab_energy.py --zip 直接读取)")
     args = parser.parse_args()
 
     output_path = Path(__file__).resolve().parent / args.output
@@ -375,10 +383,10 @@ if __name__ == "__main__":
     results = {}
 
     if not args.skip_uav_delivery:
-        results["UAV Delivery"] = fetch_uav_delivery(output_path)
+        results["UAV Delivery"] = fetch_uav_delivery(output_path, extract=not args.no_extract)
 
     if not args.skip_airlab:
-        results["AirLab Energy"] = fetch_airlab_energy(output_path)
+        results["AirLab Energy"] = fetch_airlab_energy(output_path, extract=not args.no_extract)
 
     if not args.skip_nbsdc:
         results["NBSDC Flight"] = fetch_nbsdc_flight(output_path)
@@ -13,9 +13,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger("UAV_Fetcher")
 
+# 每批写出的行数 (决定导出阶段的峰值内存)
+EXPORT_BATCH_ROWS = 50000
+
 def install_requirements():
     """按需自动安装依赖，包括 tqdm 进度条库"""
-    reqs = ["requests", "pandas", "datasets", "tqdm"]
+    reqs = ["requests", "pyarrow", "datasets", "tqdm"]
     logger.info("检查并安装必要依赖...")
     for lib in reqs:
         try:
@@ -24,22 +27,28 @@ def install_requirements():
             logger.info(f"正在安装 {lib}...")
             subprocess.check_call([sys.executable, "-m", "pip", "install", lib])
 
-def fetch_huggingface_dataset(output_dir: Path):
+def fetch_huggingface_dataset(output_dir: Path, fmt: str = "csv", streaming: bool = False):
     """
     获取 Hugging Face 上的 UAV 轨迹数据集
     源: riotu-lab/Synthetic-UAV-Flight-Trajectories
     遵循"宁滥勿缺"原则，下载全量数据。
-    datasets 库自带下载进度条，CSV 写入时使用 tqdm 显示进度。
+    datasets 库自带下载进度条，写入时使用 tqdm 显示进度。
+
+    直接按 Arrow RecordBatch 逐批写出 (CSV 或 Parquet)，不再整体 to_pandas，
+    内存占用只与 EXPORT_BATCH_ROWS 相关。streaming=True 时连本地 Arrow 缓存也不落盘。
     """
     try:
         from datasets import load_dataset
         from tqdm import tqdm
-        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
     except ImportError:
         logger.error("依赖未就绪，请重新运行脚本。")
         return
 
-    raw_output_path = output_dir / "uav_trajectories_raw.csv"
+    raw_output_path = output_dir / f"uav_trajectories_raw.{fmt}"
+    part_path = raw_output_path.with_name(raw_output_path.name + ".part")
 
     # 检查是否已有完整文件（断点续传保护）
     if raw_output_path.exists():
@@ -54,6 +63,7 @@ def fetch_huggingface_dataset(output_dir: Path):
     logger.info("=" * 60)
     logger.info("正在连接 Hugging Face 下载 UAV 轨迹数据集...")
     logger.info("数据集: riotu-lab/Synthetic-UAV-Flight-Trajectories")
+    logger.info(f"输出格式: {fmt}  |  streaming: {streaming}")
     logger.info("datasets 库将自动显示下载进度条 ↓")
     logger.info("=" * 60)
 
@@ -61,34 +71,49 @@ def fetch_huggingface_dataset(output_dir: Path):
         # datasets 库自带下载进度条（tqdm），会自动显示
         dataset = load_dataset(
             "riotu-lab/Synthetic-UAV-Flight-Trajectories",
-            split='train'
+            split='train',
+            streaming=streaming
         )
-        total_records = len(dataset)
-        logger.info(f"✅ 数据集加载成功！共 {total_records} 条记录")
-
-        # 转换为 DataFrame
-        logger.info("正在转换为 DataFrame...")
-        df = dataset.to_pandas()
-        logger.info(f"DataFrame 列: {list(df.columns)}")
-        logger.info(f"DataFrame 形状: {df.shape}")
-
-        # 带进度条写入 CSV
-        logger.info(f"正在写入 CSV: {raw_output_path}")
-        # 分块写入以显示进度
-        chunk_size = 10000
-        total_chunks = (len(df) + chunk_size - 1) // chunk_size
-
-        with open(raw_output_path, 'w', newline='', encoding='utf-8') as f:
-            for i in tqdm(range(total_chunks), desc="📝 写入CSV", unit="块"):
-                start = i * chunk_size
-                end = min((i + 1) * chunk_size, len(df))
-                chunk = df.iloc[start:end]
-                chunk.to_csv(f, index=False, header=(i == 0))
+        # streaming 模式下总行数未知
+        total_records = None if streaming else len(dataset)
+        if total_records is not None:
+            logger.info(f"✅ 数据集加载成功！共 {total_records} 条记录")
+            total_batches = (total_records + EXPORT_BATCH_ROWS - 1) // EXPORT_BATCH_ROWS
+        else:
+            logger.info("✅ 数据集以 streaming 模式打开")
+            total_batches = None
+
+        # 逐批取 Arrow 表: 非 streaming 时底层是内存映射的 Arrow 缓存，不会整体载入
+        batches = dataset.with_format("arrow").iter(batch_size=EXPORT_BATCH_ROWS)
+
+        logger.info(f"正在写入: {raw_output_path}")
+        written = 0
+        writer = None
+        try:
+            for table in tqdm(batches, total=total_batches, desc=f"📝 写入{fmt.upper()}", unit="批"):
+                if not isinstance(table, pa.Table):
+                    table = pa.Table.from_pydict(table)
+                if writer is None:
+                    logger.info(f"列: {table.schema.names}")
+                    if fmt == "parquet":
+                        writer = pq.ParquetWriter(part_path, table.schema, compression="zstd")
+                    else:
+                        writer = pa_csv.CSVWriter(part_path, table.schema)
+                writer.write_table(table)
+                written += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if writer is None:
+            logger.error("❌ 数据集为空，未写出任何数据")
+            return
+        part_path.replace(raw_output_path)
 
         file_size_mb = os.path.getsize(raw_output_path) / (1024 * 1024)
         logger.info(f"✅ 原始数据已保存: {raw_output_path}")
         logger.info(f"   文件大小: {file_size_mb:.2f} MB")
-        logger.info(f"   记录总数: {total_records}")
+        logger.info(f"   记录总数: {written}")
 
     except Exception as e:
         logger.error(f"❌ 下载失败: {e}")
@@ -100,6 +125,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="从 Hugging Face 获取 UAV 轨迹数据集")
     parser.add_argument("--output", type=str, default="../data/raw",
                         help="原始数据输出目录")
+    parser.add_argument("--format", type=str, choices=["csv", "parquet"], default="csv",
+                        help="原始数据落盘格式 (parquet 可被 process_trajectories.py 直接读取)")
+    parser.add_argument("--streaming", action="store_true", default=False,
+                        help="使用 datasets streaming 模式，不在本地缓存完整 Arrow 数据")
     args = parser.parse_args()
 
     # 确保输出目录存在
@@ -111,6 +140,6 @@ if __name__ == "__main__":
     logger.info(f"数据来源: Hugging Face (riotu-lab/Synthetic-UAV-Flight-Trajectories)")
 
     install_requirements()
-    fetch_huggingface_dataset(output_path)
+    fetch_huggingface_dataset(output_path, fmt=args.format, streaming=args.streaming)
 
     logger.info("=========== 采集任务结束 ===========")
@@ -0,0 +1,445 @@
+"""
+generate_vector_tiles.py — 城市建筑 / POI 矢量瓦片 (Mapbox Vector Tile) 生成脚本
+
+把 process_multi_city.py 输出的 GeoJSON 切成 z/x/y 的 MVT 瓦片静态目录，
+前端 (deck.gl MVTLayer / maplibre) 只需请求可视范围内的瓦片，不再整城下载 GeoJSON。
+
+输入:
+  - data/processed/{city}/buildings_3d.geojson   (图层 buildings, 属性 height / building_type / name)
+  - data/processed/{city}/poi_demand.geojson     (图层 poi_demand)
+  - data/processed/{city}/poi_sensitive.geojson  (图层 poi_sensitive)
+
+输出:
+  - frontend/public/data/tiles/{city}/{z}/{x}/{y}.pbf
+  - frontend/public/data/tiles/{city}/tiles.json   (TileJSON 3.0.0: 瓦片 URL、缩放范围、图层字段)
+
+算法:
+  1. 经纬度 → Web Mercator 世界坐标 (每个环只投影一次，各缩放级别直接乘 2^z)
+  2. 按要素 bbox (含缓冲区) 求覆盖的瓦片，对每个瓦片用 Sutherland-Hodgman 裁剪到 [-BUFFER, EXTENT+BUFFER]
+  3. 按缩放级简化: 在瓦片坐标 (EXTENT 单位) 下做 Douglas-Peucker，容差固定为 SIMPLIFY_TOLERANCE，
+     低缩放级一个单位对应更大的地面距离，自然得到逐级简化；再取整、去重，丢弃面积过小的环
+  4. MVT v2 手写 protobuf 编码: 命令整数 + zigzag 差分坐标，外环顺时针 (瓦片坐标下面积为正)、内环逆时针
+
+不依赖 mapbox-vector-tile / protobuf 库，纯 NumPy + 标准库实现。
+"""
+
+import json
+import math
+import time
+import shutil
+import struct
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from spatial_index import find_city_file, ring_signed_area, simplify_ring_indices
+from cities import CITIES
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("VectorTileGenerator")
+
+# 瓦片坐标范围与裁剪缓冲 (MVT 常用取值)
+EXTENT = 4096
+BUFFER = 64
+# 缩放级范围
+DEFAULT_MIN_ZOOM = 10
+DEFAULT_MAX_ZOOM = 16
+# Douglas-Peucker 容差 (瓦片坐标单位)
+SIMPLIFY_TOLERANCE = 1.0
+# 面积小于此值 (瓦片坐标单位²) 的环在该缩放级不输出
+MIN_RING_AREA = 2.0
+# Web Mercator 纬度上限
+MAX_LATITUDE = 85.05112878
+
+# 图层配置: 源文件、起始缩放级、写入瓦片的属性
+LAYERS = {
+    'buildings': {'file': 'buildings_3d.geojson', 'minzoom': 13,
+                  'fields': ('height', 'building_type', 'name')},
+    'poi_demand': {'file': 'poi_demand.geojson', 'minzoom': DEFAULT_MIN_ZOOM,
+                   'fields': ('name', 'category', 'type')},
+    'poi_sensitive': {'file': 'poi_sensitive.geojson', 'minzoom': DEFAULT_MIN_ZOOM,
+                      'fields': ('name', 'category', 'type', 'buffer_radius_m')},
+}
+
+# MVT 几何类型与命令
+GEOM_POINT, GEOM_POLYGON = 1, 3
+CMD_MOVE_TO, CMD_LINE_TO, CMD_CLOSE_PATH = 1, 2, 7
+
+
+# ===========================================================================
+#  Protobuf 编码 (MVT v2 只用到 varint / 64 位定长 / 长度前缀三种 wire type)
+# ===========================================================================
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field_varint(field: int, n: int) -> bytes:
+    return _varint(field << 3) + _varint(n)
+
+
+def _field_bytes(field: int, payload: bytes) -> bytes:
+    return _varint((field << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _field_packed(field: int, values) -> bytes:
+    return _field_bytes(field, b''.join(_varint(v) for v in values))
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _encode_value(value) -> bytes:
+    """Layer.Value: string=1, double=3, uint64=5, sint64=6, bool=7"""
+    if isinstance(value, bool):
+        return _field_varint(7, int(value))
+    if isinstance(value, int):
+        return _field_varint(5, value) if value >= 0 else _field_varint(6, _zigzag(value))
+    if isinstance(value, float):
+        return _varint((3 << 3) | 1) + struct.pack('<d', value)
+    return _field_bytes(1, str(value).encode('utf-8'))
+
+
+class LayerBuilder:
+    """累积一个瓦片内某图层的要素，键/值表去重，encode() 输出 Layer 消息"""
+
+    def __init__(self, name: str, extent: int = EXTENT):
+        self.name = name
+        self.extent = extent
+        self.keys, self.values = {}, {}
+        self.features = []
+
+    def __len__(self):
+        return len(self.features)
+
+    def add(self, geom_type: int, geometry: list, properties: dict, fid: int = None):
+        tags = []
+        for k, v in properties.items():
+            kk = self.keys.setdefault(k, len(self.keys))
+            vv = self.values.setdefault((type(v).__name__, v), len(self.values))
+            tags += [kk, vv]
+        msg = b''
+        if fid is not None:
+            msg += _field_varint(1, fid)
+        if tags:
+            msg += _field_packed(2, tags)
+        msg += _field_varint(3, geom_type) + _field_packed(4, geometry)
+        self.features.append(msg)
+
+    def encode(self) -> bytes:
+        msg = _field_varint(15, 2) + _field_bytes(1, self.name.encode('utf-8'))
+        msg += b''.join(_field_bytes(2, f) for f in self.features)
+        msg += b''.join(_field_bytes(3, k.encode('utf-8')) for k in self.keys)
+        msg += b''.join(_field_bytes(4, _encode_value(v)) for (_, v) in self.values)
+        msg += _field_varint(5, self.extent)
+        return msg
+
+
+def encode_tile(layers: list) -> bytes:
+    """Tile 消息: repeated Layer layers = 3"""
+    return b''.join(_field_bytes(3, layer.encode()) for layer in layers if len(layer))
+
+
+def _command(cmd: int, count: int) -> int:
+    return (cmd & 0x7) | (count << 3)
+
+
+def encode_point(x: int, y: int) -> list:
+    return [_command(CMD_MOVE_TO, 1), _zigzag(x), _zigzag(y)]
+
+
+def encode_polygon(rings: list) -> list:
+    """rings: 整数坐标环 (不含闭合点) 列表，外环在前；光标在环之间延续"""
+    out, cx, cy = [], 0, 0
+    for ring in rings:
+        dx = np.diff(ring[:, 0], prepend=cx)
+        dy = np.diff(ring[:, 1], prepend=cy)
+        cx, cy = int(ring[-1, 0]), int(ring[-1, 1])
+        params = np.column_stack([(dx << 1) ^ (dx >> 63), (dy << 1) ^ (dy >> 63)]).ravel().tolist()
+        out += [_command(CMD_MOVE_TO, 1)] + params[:2]
+        out += [_command(CMD_LINE_TO, len(ring) - 1)] + params[2:]
+        out.append(_command(CMD_CLOSE_PATH, 1))
+    return out
+
+
+# ===========================================================================
+#  几何处理
+# ===========================================================================
+def lonlat_to_world(lon, lat):
+    """经纬度 → 0 级 Web Mercator 世界坐标 [0, 1)，y 向下"""
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / math.pi) / 2.0
+    return np.column_stack([x, y])
+
+
+def clip_ring(pts: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    """Sutherland-Hodgman: 把开放环 (不含闭合点) 裁剪到正方形 [lo, hi]²，每条边界一次向量化处理"""
+    for axis in (0, 1):
+        for bound, keep_ge in ((lo, True), (hi, False)):
+            if len(pts) == 0:
+                return pts
+            v = pts[:, axis]
+            inside = v >= bound if keep_ge else v <= bound
+            if inside.all():
+                continue
+            if not inside.any():
+                return pts[:0]
+            prev = np.roll(pts, 1, axis=0)
+            cross = inside != np.roll(inside, 1)
+            # 边 prev → cur 跨越边界时输出交点，cur 在内侧时输出 cur
+            counts = cross.astype(np.int64) + inside
+            pos = np.cumsum(counts) - counts
+            out = np.empty((int(counts.sum()), 2))
+            pv, cv = prev[cross], pts[cross]
+            t = (bound - pv[:, axis]) / (cv[:, axis] - pv[:, axis])
+            out[pos[cross]] = pv + t[:, None] * (cv - pv)
+            out[pos[inside] + cross[inside]] = pts[inside]
+            pts = out
+    return pts
+
+
+def finalize_ring(pts: np.ndarray, exterior: bool):
+    """取整、去掉相邻重复点，面积过小返回 None；按外环/内环调整绕向"""
+    q = np.rint(pts).astype(np.int64)
+    if len(q) == 0:
+        return None
+    keep = np.any(q != np.roll(q, 1, axis=0), axis=1)
+    q = q[keep]
+    if len(q) < 3:
+        return None
+    area = ring_signed_area(q)
+    if abs(area) < MIN_RING_AREA:
+        return None
+    if (area > 0) != exterior:
+        q = q[::-1]
+    return q
+
+
+def feature_polygons(geometry: dict) -> list:
+    """GeoJSON Polygon / MultiPolygon → [[外环, 内环...], ...]，每环为开放的 0 级世界坐标数组"""
+    if geometry['type'] == 'Polygon':
+        polys = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polys = geometry['coordinates']
+    else:
+        return []
+    out = []
+    for poly in polys:
+        rings = []
+        for ring in poly:
+            arr = np.asarray(ring, dtype=np.float64)[:, :2]
+            if len(arr) > 1 and np.array_equal(arr[0], arr[-1]):
+                arr = arr[:-1]
+            if len(arr) >= 3:
+                rings.append(lonlat_to_world(arr[:, 0], arr[:, 1]))
+        if rings:
+            out.append(rings)
+    return out
+
+
+def tile_properties(props: dict, fields: tuple) -> dict:
+    """只保留配置的字段，丢弃空值与嵌套对象"""
+    out = {}
+    for k in fields:
+        v = props.get(k)
+        if v is None or v == '' or isinstance(v, (dict, list)):
+            continue
+        out[k] = v
+    return out
+
+
+def feature_id(props: dict):
+    fid = props.get('osm_id')
+    return fid if isinstance(fid, int) and fid >= 0 else None
+
+
+# ===========================================================================
+#  切片
+# ===========================================================================
+def load_layer(path: Path, fields: tuple) -> list:
+    """读取 GeoJSON 为 [(kind, 几何, 属性, id)]，kind 为 'point' 或 'polygon'，几何已投影到 0 级世界坐标"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    items = []
+    for feat in data.get('features', []):
+        geom = feat.get('geometry') or {}
+        props = feat.get('properties', {})
+        attrs, fid = tile_properties(props, fields), feature_id(props)
+        if geom.get('type') == 'Point':
+            lon, lat = geom['coordinates'][:2]
+            items.append(('point', lonlat_to_world([lon], [lat])[0], attrs, fid))
+        else:
+            polys = feature_polygons(geom)
+            if polys:
+                items.append(('polygon', polys, attrs, fid))
+    return items
+
+
+def tile_range(lo: np.ndarray, hi: np.ndarray, z: int):
+    """0 级 bbox → 覆盖的瓦片坐标范围 (含缓冲)"""
+    n = 1 << z
+    buf = BUFFER / EXTENT
+    x0, y0 = np.floor(lo * n - buf).astype(int)
+    x1, y1 = np.floor(hi * n + buf).astype(int)
+    return max(x0, 0), max(y0, 0), min(x1, n - 1), min(y1, n - 1)
+
+
+def cut_layer(items: list, z: int, tiles: dict, layer_name: str):
+    """把一个图层在缩放级 z 下切入 tiles[(x, y)][layer_name]"""
+    n = 1 << z
+    for kind, geom, attrs, fid in items:
+        if kind == 'point':
+            tx, ty = np.floor(geom * n).astype(int)
+            if not (0 <= tx < n and 0 <= ty < n):
+                continue
+            px, py = np.rint((geom * n - (tx, ty)) * EXTENT).astype(int)
+            layer = tiles.setdefault((tx, ty), {}).setdefault(layer_name, LayerBuilder(layer_name))
+            layer.add(GEOM_POINT, encode_point(int(px), int(py)), attrs, fid)
+            continue
+
+        allpts = np.concatenate([r for poly in geom for r in poly])
+        x0, y0, x1, y1 = tile_range(allpts.min(axis=0), allpts.max(axis=0), z)
+        for tx in range(x0, x1 + 1):
+            for ty in range(y0, y1 + 1):
+                origin = np.array([tx, ty], dtype=np.float64)
+                rings = []
+                for poly in geom:
+                    poly_rings = []
+                    for k, ring in enumerate(poly):
+                        local = (ring * n - origin) * EXTENT
+                        local = clip_ring(local, -BUFFER, EXTENT + BUFFER)
+                        if len(local) < 3:
+                            if k == 0:
+                                break
+                            continue
+                        local = local[simplify_ring_indices(local, SIMPLIFY_TOLERANCE)]
+                        q = finalize_ring(local, exterior=(k == 0))
+                        if q is None:
+                            if k == 0:
+                                break
+                            continue
+                        poly_rings.append(q)
+                    rings += poly_rings
+                if not rings:
+                    continue
+                layer = tiles.setdefault((tx, ty), {}).setdefault(layer_name, LayerBuilder(layer_name))
+                layer.add(GEOM_POLYGON, encode_polygon(rings), attrs, fid)
+
+
+def layer_fields(items: list) -> dict:
+    """TileJSON vector_layers.fields: 字段名 → Number / String"""
+    fields = {}
+    for _, _, attrs, _ in items:
+        for k, v in attrs.items():
+            fields.setdefault(k, "Number" if isinstance(v, (int, float)) and not isinstance(v, bool)
+                              else "String")
+    return fields
+
+
+def generate_city_tiles(city: str, processed_dir: Path, out_dir: Path, min_zoom: int = DEFAULT_MIN_ZOOM,
+                        max_zoom: int = DEFAULT_MAX_ZOOM, url_prefix: str = "/data/tiles") -> bool:
+    """单城市切片主流程"""
+    t0 = time.perf_counter()
+    layers = {}
+    for name, cfg in LAYERS.items():
+        path = find_city_file(processed_dir, city, cfg['file'])
+        if path.exists():
+            layers[name] = load_layer(path, cfg['fields'])
+            logger.info(f"  {name}: {len(layers[name])} 个要素 ({path.name})")
+    if not layers:
+        logger.warning(f"  ⚠️  {city}: 无 GeoJSON 数据，跳过")
+        return False
+    t1 = time.perf_counter()
+
+    city_dir = out_dir / city
+    # 只清理本脚本生成过的目录 (以 tiles.json 为标记)
+    if (city_dir / "tiles.json").exists():
+        shutil.rmtree(city_dir)
+
+    total_tiles, total_bytes = 0, 0
+    for z in range(min_zoom, max_zoom + 1):
+        tiles = {}
+        for name, items in layers.items():
+            if z >= max(LAYERS[name]['minzoom'], min_zoom):
+                cut_layer(items, z, tiles, name)
+        z_bytes = 0
+        for (tx, ty), tile_layers in tiles.items():
+            data = encode_tile([tile_layers[name] for name in LAYERS if name in tile_layers])
+            if not data:
+                continue
+            path = city_dir / str(z) / str(tx) / f"{ty}.pbf"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            z_bytes += len(data)
+            total_tiles += 1
+        total_bytes += z_bytes
+        logger.info(f"  z{z}: {len(tiles)} 个瓦片, {z_bytes / 1024:.0f} KB")
+    t2 = time.perf_counter()
+
+    # 各图层要素的经纬度范围 (由世界坐标反算)
+    pts = np.concatenate([np.atleast_2d(g) if kind == 'point' else np.concatenate([r for p in g for r in p])
+                          for items in layers.values() for kind, g, _, _ in items])
+    lo, hi = pts.min(axis=0), pts.max(axis=0)
+    west, east = lo[0] * 360 - 180, hi[0] * 360 - 180
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * lo[1]))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * hi[1]))))
+    tilejson = {
+        "tilejson": "3.0.0",
+        "name": city,
+        "scheme": "xyz",
+        "format": "pbf",
+        "tiles": [f"{url_prefix.rstrip('/')}/{city}/{{z}}/{{x}}/{{y}}.pbf"],
+        "minzoom": min_zoom,
+        "maxzoom": max_zoom,
+        "bounds": [round(west, 6), round(south, 6), round(east, 6), round(north, 6)],
+        "center": [round((west + east) / 2, 6), round((south + north) / 2, 6), min(max(14, min_zoom), max_zoom)],
+        "vector_layers": [
+            {"id": name, "fields": layer_fields(items),
+             "minzoom": max(LAYERS[name]['minzoom'], min_zoom), "maxzoom": max_zoom}
+            for name, items in layers.items()
+        ],
+    }
+    city_dir.mkdir(parents=True, exist_ok=True)
+    with open(city_dir / "tiles.json", 'w', encoding='utf-8') as f:
+        json.dump(tilejson, f, ensure_ascii=False, indent=2)
+
+    logger.info(f"  ✅ {city}: {total_tiles} 个瓦片, {total_bytes / 1024 / 1024:.2f} MB → {city_dir}")
+    logger.info(f"     耗时: 读取 {t1 - t0:.2f}s | 切片编码 {t2 - t1:.2f}s")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="城市建筑 / POI 矢量瓦片生成")
+    parser.add_argument("--cities", type=str, default="all", help="处理的城市, 逗号分隔或'all'")
+    parser.add_argument("--min-zoom", type=int, default=DEFAULT_MIN_ZOOM, help="最小缩放级")
+    parser.add_argument("--max-zoom", type=int, default=DEFAULT_MAX_ZOOM, help="最大缩放级")
+    parser.add_argument("--output", type=str, default=None,
+                        help="瓦片根目录, 默认 frontend/public/data/tiles")
+    parser.add_argument("--url-prefix", type=str, default="/data/tiles", help="tiles.json 中的瓦片 URL 前缀")
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent.parent
+    processed_dir = base / "data" / "processed"
+    out_dir = Path(args.output) if args.output else base / "frontend" / "public" / "data" / "tiles"
+    cities = CITIES if args.cities.lower() == "all" else [c.strip() for c in args.cities.split(",")]
+
+    logger.info("=========== 开始生成矢量瓦片 ===========")
+    for city in cities:
+        logger.info(f"━━━ {city} ━━━")
+        generate_city_tiles(city, processed_dir, out_dir, args.min_zoom, args.max_zoom, args.url_prefix)
+    logger.info("=========== 瓦片生成完成 ===========")
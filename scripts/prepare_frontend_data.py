@@ -5,20 +5,34 @@ prepare_frontend_data.py — 前端数据预处理脚本
 
 输入: data/processed/uav_trajectories.csv  (82MB, 766K行, 5093条轨迹)
 输出: frontend/public/data/uav_trajectories.json (~5-8MB, 确定性采样20%)
+      --formats bin 时另输出 uav_trajectories.bin + uav_trajectories_header.json
+      (Float32/Int32 紧凑数组 + 每航班偏移表，浏览器可零解析映射为 TypedArray)
+      --formats chunks 时另输出 chunks/manifest.json + 按 60 秒窗口切分的 chunk_*.json
+      始终另输出 uav_trajectories_intervals.json: 航班时间区间索引 (有序起止时刻、
+      每秒活跃数/累计起飞数直方图、按时间窗分桶的航班下标)，看板每帧 O(log n) 求活跃无人机
 
 优化策略:
   1. 服务端完成 CSV 解析和分组（不再由浏览器做）
   2. 只保留前端需要的字段: path + timestamps
   3. 坐标精度裁剪: lon/lat→6位, alt→整数, timestamp→3位
   4. 时间戳归一化: 相对于全局最小值（避免浮点精度丢失）
+  5. 可选时空 Douglas–Peucker 简化 (--simplify-m): 删除近似共线的冗余采样点，
+     报告写入 data/processed/trajectories/simplify_report.csv
 """
 
 import csv
+import sys
 import json
 import hashlib
 import logging
+import argparse
+import numpy as np
+from array import array
+from bisect import bisect_left
 from pathlib import Path
 
+from spatial_index import FlightIntervalIndex
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("FrontendDataPrep")
 
@@ -26,6 +40,14 @@ logger = logging.getLogger("FrontendDataPrep")
 SAMPLE_RATIO = 1.0  # 100% data usage
 # 高度放大倍数（与前端 MapContainer.tsx 一致）
 ALT_SCALE = 3
+# 时间分片窗口长度 (秒)，用于 --formats chunks
+CHUNK_SECONDS = 60
+# --formats 可选的输出格式
+OUTPUT_FORMATS = ('json', 'bin', 'chunks')
+# 轨迹简化后相邻保留点的默认最大时间间隔 (秒)，0 表示不限制
+DEFAULT_SIMPLIFY_GAP_S = 5.0
+# 经纬度换算常量 (与 process_trajectories.py 一致)
+METERS_PER_DEG_LAT = 111320.0
 
 
 def deterministic_sample(flight_id: str, ratio: float) -> bool:
@@ -34,16 +56,8 @@ def deterministic_sample(flight_id: str, ratio: float) -> bool:
     return (int(h[:8], 16) / 0xFFFFFFFF) < ratio
 
 
-def main():
-    base = Path(__file__).resolve().parent.parent
-    input_csv = base / "data" / "processed" / "trajectories" / "uav_trajectories.csv"
-    output_json = base / "frontend" / "public" / "data" / "processed" / "trajectories" / "uav_trajectories.json"
-
-    if not input_csv.exists():
-        logger.error(f"❌ 输入文件不存在: {input_csv}")
-        return
-
-    # 第一遍：读取并按 flight_id 分组
+def load_flight_groups(input_csv: Path):
+    """读取 CSV 并按 flight_id 分组，返回 (groups, global_min_ts, global_max_ts)"""
     logger.info(f"读取 CSV: {input_csv}")
     groups: dict[str, dict] = {}
     global_min_ts = float('inf')
@@ -84,6 +98,272 @@ def main():
 
     logger.info(f"CSV 读取完成: {row_count} 行, {len(groups)} 条轨迹")
     logger.info(f"时间范围: {global_min_ts} ~ {global_max_ts} ({global_max_ts - global_min_ts:.0f}秒)")
+    return groups, global_min_ts, global_max_ts
+
+
+def simplify_trajectory(path: list, timestamps: list,
+                        tolerance_m: float, max_gap_s: float):
+    """
+    时空 Douglas–Peucker 简化 (同步欧氏距离 SED):
+    对候选段 [i, j]，按时间在端点间线性插值得到每个中间点的"同步位置"，
+    与真实位置的三维距离 (米) 超过 tolerance_m 时在误差最大点处拆分；
+    段时长超过 max_gap_s 时即使误差达标也强制拆分，保证回放插值的时间分辨率。
+    每段的误差计算对中间点整体向量化。
+    返回 (保留点下标数组, 简化后相对原始轨迹的最大 SED 偏差/米)
+    """
+    n = len(timestamps)
+    if n <= 2:
+        return np.arange(n), 0.0
+
+    pts = np.asarray(path, dtype=np.float64)
+    t = np.asarray(timestamps, dtype=np.float64)
+    lat0 = float(pts[:, 1].mean())
+    xyz = np.column_stack([
+        (pts[:, 0] - pts[0, 0]) * METERS_PER_DEG_LAT * np.cos(np.radians(lat0)),
+        (pts[:, 1] - pts[0, 1]) * METERS_PER_DEG_LAT,
+        pts[:, 2] / ALT_SCALE,
+    ])
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        span = t[j] - t[i]
+        mid = slice(i + 1, j)
+        ratio = (t[mid] - t[i]) / span if span > 0 else np.zeros(j - i - 1)
+        sync = xyz[i] + ratio[:, None] * (xyz[j] - xyz[i])
+        err = np.sqrt(((xyz[mid] - sync) ** 2).sum(axis=1))
+        k = int(err.argmax())
+        if err[k] > tolerance_m:
+            split = i + 1 + k
+        elif max_gap_s > 0 and span > max_gap_s:
+            split = (i + j) // 2
+        else:
+            continue
+        keep[split] = True
+        stack.append((i, split))
+        stack.append((split, j))
+
+    idx = np.flatnonzero(keep)
+    # 以简化后折线在原始时刻的插值位置计算实际最大偏差
+    approx = np.column_stack([np.interp(t, t[idx], xyz[idx, c]) for c in range(3)])
+    max_dev = float(np.sqrt(((xyz - approx) ** 2).sum(axis=1)).max())
+    return idx, max_dev
+
+
+def simplify_all(trajectories: list, tolerance_m: float, max_gap_s: float, report_csv: Path):
+    """对所有轨迹执行时空简化 (原地替换 path/timestamps)，并写出每航班简化报告"""
+    report = []
+    before_total = after_total = 0
+    for traj in trajectories:
+        before = len(traj['timestamps'])
+        idx, max_dev = simplify_trajectory(traj['path'], traj['timestamps'],
+                                           tolerance_m, max_gap_s)
+        traj['path'] = [traj['path'][i] for i in idx]
+        traj['timestamps'] = [traj['timestamps'][i] for i in idx]
+        report.append({'flight_id': traj['id'], 'points_before': before,
+                       'points_after': len(idx), 'max_deviation_m': round(max_dev, 3)})
+        before_total += before
+        after_total += len(idx)
+
+    report_csv.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['flight_id', 'points_before',
+                                               'points_after', 'max_deviation_m'])
+        writer.writeheader()
+        writer.writerows(report)
+
+    worst = max((r['max_deviation_m'] for r in report), default=0.0)
+    logger.info(f"轨迹简化 (容差 {tolerance_m:g} 米, 最大间隔 {max_gap_s:g} 秒): "
+                f"{before_total} → {after_total} 点 "
+                f"({after_total / max(before_total, 1) * 100:.1f}%), 最大偏差 {worst:.2f} 米")
+    logger.info(f"   简化报告: {report_csv}")
+
+
+def write_json_output(output_data: dict, output_json: Path):
+    """输出紧凑 JSON (嵌套 path / timestamps 数组)"""
+    output_json.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(output_data, f, separators=(',', ':'))  # 紧凑格式
+    return output_json.stat().st_size
+
+
+def write_binary_output(output_data: dict, output_bin: Path):
+    """
+    输出按航班索引的二进制轨迹 (小端序, 4 字节对齐):
+      offsets    Int32[F+1]   第 i 条轨迹的点位于 [offsets[i], offsets[i+1])
+      timestamps Float32[N]   归一化时间戳 (秒)
+      positions  Float32[N*3] [lon-originLon, lat-originLat, alt]
+    经纬度减去原点后再存 Float32，精度保持在 1e-6 度以内；
+    前端可直接 new Float32Array(buffer, byteOffset, length) 映射，
+    配合 deck.gl COORDINATE_SYSTEM.LNGLAT_OFFSETS + coordinateOrigin 使用。
+    头信息写入 {stem}_header.json，记录航班 id 与各段的 byteOffset/length。
+    """
+    trajectories = output_data['trajectories']
+    all_lons = [p[0] for t in trajectories for p in t['path']]
+    all_lats = [p[1] for t in trajectories for p in t['path']]
+    origin_lon = round((min(all_lons) + max(all_lons)) / 2, 6) if all_lons else 0.0
+    origin_lat = round((min(all_lats) + max(all_lats)) / 2, 6) if all_lats else 0.0
+
+    offsets = array('i', [0])
+    timestamps = array('f')
+    positions = array('f')
+    for t in trajectories:
+        for lon, lat, alt in t['path']:
+            positions.extend((lon - origin_lon, lat - origin_lat, alt))
+        timestamps.extend(t['timestamps'])
+        offsets.append(len(timestamps))
+
+    sections = [('offsets', 'Int32', offsets, 1),
+                ('timestamps', 'Float32', timestamps, 1),
+                ('positions', 'Float32', positions, 3)]
+    buffers = {}
+    byte_offset = 0
+    output_bin.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_bin, 'wb') as f:
+        for name, dtype, arr, size in sections:
+            if sys.byteorder != 'little':
+                arr.byteswap()
+            arr.tofile(f)
+            buffers[name] = {'type': dtype, 'byteOffset': byte_offset,
+                             'length': len(arr), 'size': size}
+            byte_offset += len(arr) * arr.itemsize
+
+    header = {
+        'version': 1,
+        'binary': output_bin.name,
+        'byteLength': byte_offset,
+        'timeRange': output_data['timeRange'],
+        'totalFlights': output_data['totalFlights'],
+        'sampledFlights': output_data['sampledFlights'],
+        'pointCount': len(timestamps),
+        'altScale': ALT_SCALE,
+        'origin': [origin_lon, origin_lat],
+        'ids': [t['id'] for t in trajectories],
+        'buffers': buffers,
+    }
+    header_json = output_bin.with_name(output_bin.stem + '_header.json')
+    with open(header_json, 'w', encoding='utf-8') as f:
+        json.dump(header, f, separators=(',', ':'))
+    return byte_offset + header_json.stat().st_size
+
+
+def write_chunked_output(output_data: dict, chunk_dir: Path, chunk_seconds: float = CHUNK_SECONDS):
+    """
+    按固定时间窗口切分轨迹，输出 chunk_{k}.json + manifest.json:
+      - 每个分片只包含该窗口内活跃的航班，点集裁剪到窗口内
+      - 额外保留窗口前后各一个点，保证跨边界插值连续
+      - manifest 列出各分片的时间范围、航班数与点数 (空窗口不输出)
+    前端可按播放时间逐片加载，拖动进度条时只请求可见窗口。
+    """
+    buckets: dict[int, list] = {}
+    for t in output_data['trajectories']:
+        ts = t['timestamps']
+        if not ts:
+            continue
+        first_k = int(ts[0] // chunk_seconds)
+        last_k = int(ts[-1] // chunk_seconds)
+        for k in range(first_k, last_k + 1):
+            lo = bisect_left(ts, k * chunk_seconds)
+            hi = bisect_left(ts, (k + 1) * chunk_seconds)
+            # 即使窗口内没有采样点 (被两个采样点跨过)，也保留前后各一点用于插值
+            lo = max(lo - 1, 0)
+            hi = min(hi + 1, len(ts))
+            buckets.setdefault(k, []).append({
+                'id': t['id'],
+                'path': t['path'][lo:hi],
+                'timestamps': ts[lo:hi]
+            })
+
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    for stale in chunk_dir.glob('chunk_*.json'):
+        stale.unlink()
+
+    chunks = []
+    total_bytes = 0
+    for k in sorted(buckets):
+        fname = f"chunk_{k:05d}.json"
+        start = round(k * chunk_seconds, 3)
+        end = round((k + 1) * chunk_seconds, 3)
+        with open(chunk_dir / fname, 'w', encoding='utf-8') as f:
+            json.dump({'index': k, 'start': start, 'end': end,
+                       'trajectories': buckets[k]}, f, separators=(',', ':'))
+        total_bytes += (chunk_dir / fname).stat().st_size
+        chunks.append({
+            'index': k, 'start': start, 'end': end, 'file': fname,
+            'flights': len(buckets[k]),
+            'points': sum(len(b['timestamps']) for b in buckets[k]),
+        })
+
+    manifest = {
+        'chunkSeconds': chunk_seconds,
+        'timeRange': output_data['timeRange'],
+        'totalFlights': output_data['totalFlights'],
+        'sampledFlights': output_data['sampledFlights'],
+        'chunks': chunks,
+    }
+    with open(chunk_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    logger.info(f"   时间分片: {len(chunks)} 个 ({chunk_seconds:g} 秒/片), "
+                f"单片最多 {max((c['flights'] for c in chunks), default=0)} 条轨迹")
+    return total_bytes + (chunk_dir / 'manifest.json').stat().st_size
+
+
+def write_interval_index(output_data: dict, output_json: Path,
+                         bucket_seconds: float = CHUNK_SECONDS):
+    """
+    输出航班时间区间索引 (与 trajectories 同序的航班下标):
+      start / end                 每航班首末时间戳 (归一化秒)
+      startsSorted / endsSorted   有序端点: t 时刻活跃数 = upperBound(startsSorted, t) - lowerBound(endsSorted, t)
+      bucketOffsets / bucketFlights  第 k 个时间窗 [k*bucketSeconds, (k+1)*bucketSeconds) 的相交航班
+      activePerSecond / cumulativePerSecond  每秒活跃数与累计起飞数 (看板直接按秒取值)
+    """
+    trajectories = [t for t in output_data['trajectories'] if t['timestamps']]
+    starts = [t['timestamps'][0] for t in trajectories]
+    ends = [t['timestamps'][-1] for t in trajectories]
+    index = FlightIntervalIndex(starts, ends, bucket_seconds, origin=0.0)
+    active, cumulative = index.per_second(output_data['timeRange']['max'])
+
+    data = {
+        'version': 1,
+        'bucketSeconds': bucket_seconds,
+        'ids': [t['id'] for t in trajectories],
+        'start': starts,
+        'end': ends,
+        'startsSorted': index.starts_sorted.tolist(),
+        'endsSorted': index.ends_sorted.tolist(),
+        'bucketOffsets': index.bucket_offsets.tolist(),
+        'bucketFlights': index.bucket_ids.tolist(),
+        'activePerSecond': active.tolist(),
+        'cumulativePerSecond': cumulative.tolist(),
+        'maxActive': int(active.max()) if len(active) else 0,
+    }
+    output_json.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    logger.info(f"✅ 区间索引: {output_json} ({len(trajectories)} 条航班, "
+                f"{len(index.bucket_offsets) - 1} 个时间窗, 峰值活跃 {data['maxActive']})")
+    return output_json.stat().st_size
+
+
+def main(formats=('json',), chunk_seconds: float = CHUNK_SECONDS,
+         simplify_m: float = 0.0, simplify_gap_s: float = DEFAULT_SIMPLIFY_GAP_S):
+    base = Path(__file__).resolve().parent.parent
+    input_csv = base / "data" / "processed" / "trajectories" / "uav_trajectories.csv"
+    output_dir = base / "frontend" / "public" / "data" / "processed" / "trajectories"
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"未知输出格式: {', '.join(unknown)} (可选: {', '.join(OUTPUT_FORMATS)})")
+
+    if not input_csv.exists():
+        logger.error(f"❌ 输入文件不存在: {input_csv}")
+        return
+
+    # 第一遍：读取并按 flight_id 分组
+    groups, global_min_ts, global_max_ts = load_flight_groups(input_csv)
 
     # 第二遍：确定性采样 + 时间戳归一化
     sampled = []
@@ -99,7 +379,10 @@ def main():
 
     logger.info(f"确定性采样 {SAMPLE_RATIO*100:.0f}%: {len(sampled)} / {len(groups)} 条轨迹")
 
-    # 输出 JSON
+    if simplify_m > 0:
+        simplify_all(sampled, simplify_m, simplify_gap_s,
+                     input_csv.parent / "simplify_report.csv")
+
     output_data = {
         'timeRange': {
             'min': 0,
@@ -110,17 +393,41 @@ def main():
         'trajectories': sampled
     }
 
-    output_json.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, separators=(',', ':'))  # 紧凑格式
+    csv_mb = input_csv.stat().st_size / (1024 * 1024)
+    writers = {
+        'json': (write_json_output, output_dir / "uav_trajectories.json"),
+        'bin': (write_binary_output, output_dir / "uav_trajectories.bin"),
+        'chunks': (lambda data, path: write_chunked_output(data, path, chunk_seconds),
+                   output_dir / "chunks"),
+    }
+    for fmt in formats:
+        writer, output_path = writers[fmt]
+        size_mb = writer(output_data, output_path) / (1024 * 1024)
+        logger.info(f"✅ 输出完成: {output_path}")
+        logger.info(f"   文件大小: {size_mb:.2f} MB (原始 CSV: {csv_mb:.2f} MB)")
+        logger.info(f"   压缩比: {size_mb / csv_mb * 100:.1f}%")
 
-    size_mb = output_json.stat().st_size / (1024 * 1024)
-    logger.info(f"✅ 输出完成: {output_json}")
-    logger.info(f"   文件大小: {size_mb:.2f} MB (原始 CSV: {input_csv.stat().st_size / (1024*1024):.2f} MB)")
-    logger.info(f"   压缩比: {size_mb / (input_csv.stat().st_size / (1024*1024)) * 100:.1f}%")
+    write_interval_index(output_data, output_dir / "uav_trajectories_intervals.json", chunk_seconds)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="前端轨迹数据预处理")
+    parser.add_argument("--formats", type=str, default="json",
+                        help="输出格式, 逗号分隔: json (嵌套数组) / bin (Float32/Int32 二进制 + 头 JSON)"
+                             " / chunks (按时间窗口分片 + manifest)")
+    parser.add_argument("--chunk-seconds", type=float, default=CHUNK_SECONDS,
+                        help="chunks 模式下每个时间分片的长度 (秒), 同时作为区间索引的分桶宽度")
+    parser.add_argument("--simplify-m", type=float, default=0.0,
+                        help="时空 Douglas-Peucker 简化容差 (米), 0 表示不简化")
+    parser.add_argument("--simplify-gap-s", type=float, default=DEFAULT_SIMPLIFY_GAP_S,
+                        help="简化后相邻保留点的最大时间间隔 (秒), 0 表示不限制")
+    args = parser.parse_args()
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        parser.error(f"未知输出格式: {', '.join(unknown)} (可选: {', '.join(OUTPUT_FORMATS)})")
+
     logger.info("=========== 开始前端数据预处理 ===========")
-    main()
+    main(formats, chunk_seconds=args.chunk_seconds,
+         simplify_m=args.simplify_m, simplify_gap_s=args.simplify_gap_s)
     logger.info("=========== 预处理完成 ===========")
@@ -7,11 +7,22 @@ process_airlab_energy.py — AirLab CMU 无人机飞行能耗数据清洗脚本
 
 来源: CMU AirLab — DJI Matrice 100, 187次飞行
 原始字段: time, airspeed, vertspd, psi, aoa, theta, diffalt, density, payload, power, airspeed_x, airspeed_y
+
+也可通过 --zip 直接从 Figshare 下载的压缩包中流式读取每个 {N}/processed.csv，
+无需先解压 (fetch_flight_datasets.py --no-extract)；--workers 控制并行进程数。
+
+--incremental 只处理汇总表中还没有的飞行编号 (新增的 {N}/ 目录或压缩包成员)，
+把结果追加到两个 CSV 末尾，耗时只与新增飞行数有关；已处理飞行的原始文件若被修改，需全量重跑。
 """
 
 import csv
+import io
 import os
+import re
+import zipfile
 import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 try:
@@ -29,6 +40,10 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 RAW_DIR = BASE_DIR / "data" / "raw" / "airlab_energy" / "data"
 OUTPUT_DIR = BASE_DIR / "data" / "processed" / "airlab_energy"
 FLIGHT_SHEET = RAW_DIR / "Flight Sheet.xlsx"
+ZIP_DIR = BASE_DIR / "data" / "raw" / "airlab_energy"
+
+# 压缩包内的飞行记录成员: .../{N}/processed.csv
+ZIP_FLIGHT_PATTERN = re.compile(r'(?:^|/)(\d+)/processed\.csv$')
 
 # 时序明细中保留的字段
 DETAIL_FIELDS = [
@@ -48,13 +63,24 @@ SUMMARY_FIELDS = [
 ]
 
 
-def load_flight_sheet():
-    """从 Flight Sheet.xlsx 读取飞行实验参数"""
-    if not FLIGHT_SHEET.exists():
+def load_flight_sheet(zip_path: Path = None):
+    """从 Flight Sheet.xlsx 读取飞行实验参数 (给定 zip_path 时从压缩包内读取)"""
+    if zip_path is not None:
+        with zipfile.ZipFile(zip_path) as zf:
+            members = [n for n in zf.namelist()
+                       if n.endswith("Flight Sheet.xlsx") and not n.startswith("__MACOSX")]
+            if not members:
+                logger.warning(f"压缩包中未找到 Flight Sheet: {zip_path}")
+                return {}
+            # openpyxl 需要可 seek 的文件对象，表格很小，直接读入内存
+            source = io.BytesIO(zf.read(members[0]))
+    elif not FLIGHT_SHEET.exists():
         logger.warning(f"未找到 Flight Sheet: {FLIGHT_SHEET}")
         return {}
+    else:
+        source = FLIGHT_SHEET
 
-    wb = openpyxl.load_workbook(FLIGHT_SHEET, read_only=True)
+    wb = openpyxl.load_workbook(source, read_only=True)
     ws = wb.active
     headers = [str(c.value).strip() if c.value else f"col_{i}" for i, c in enumerate(ws[1])]
 
@@ -80,29 +106,46 @@ def process_single_flight(flight_dir: Path, flight_number: int, flight_meta: dic
     if not csv_file.exists():
         return None, []
 
-    rows = []
     with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                parsed = {
-                    "time": float(row["time"]),
-                    "airspeed": float(row["airspeed"]),
-                    "vertspd": float(row["vertspd"]),
-                    "psi": float(row["psi"]),
-                    "aoa": float(row["aoa"]),
-                    "theta": float(row["theta"]),
-                    "diffalt": float(row["diffalt"]),
-                    "density": float(row["density"]),
-                    "payload": float(row["payload"]),
-                    "power": float(row["power"]),
-                    "airspeed_x": float(row["airspeed_x"]),
-                    "airspeed_y": float(row["airspeed_y"]),
-                }
-                rows.append(parsed)
-            except (ValueError, KeyError):
-                continue
+        rows = parse_flight_rows(f)
+    return summarize_flight(rows, flight_number, flight_meta)
+
+
+def process_zip_flight(zf: zipfile.ZipFile, member: str, flight_number: int, flight_meta: dict):
+    """从压缩包成员流式读取单个飞行记录，返回 (summary_row, detail_rows)"""
+    with zf.open(member) as raw:
+        rows = parse_flight_rows(io.TextIOWrapper(raw, encoding='utf-8', newline=''))
+    return summarize_flight(rows, flight_number, flight_meta)
+
+
+def parse_flight_rows(f) -> list:
+    """解析 processed.csv 文本流，跳过无法解析的行"""
+    rows = []
+    reader = csv.DictReader(f)
+    for row in reader:
+        try:
+            parsed = {
+                "time": float(row["time"]),
+                "airspeed": float(row["airspeed"]),
+                "vertspd": float(row["vertspd"]),
+                "psi": float(row["psi"]),
+                "aoa": float(row["aoa"]),
+                "theta": float(row["theta"]),
+                "diffalt": float(row["diffalt"]),
+                "density": float(row["density"]),
+                "payload": float(row["payload"]),
+                "power": float(row["power"]),
+                "airspeed_x": float(row["airspeed_x"]),
+                "airspeed_y": float(row["airspeed_y"]),
+            }
+            rows.append(parsed)
+        except (ValueError, KeyError):
+            continue
+    return rows
 
+
+def summarize_flight(rows: list, flight_number: int, flight_meta: dict):
+    """由解析后的时序行计算汇总统计与明细行，返回 (summary_row, detail_rows)"""
     if len(rows) < 2:
         return None, []
 
@@ -173,34 +216,133 @@ def process_single_flight(flight_dir: Path, flight_number: int, flight_meta: dic
     return summary, detail_rows
 
 
-def main():
+def discover_flight_dirs() -> list:
+    """发现 RAW_DIR 下所有飞行记录目录，返回 [(flight_number, dir), ...]"""
+    flight_dirs = []
+    for d in sorted(RAW_DIR.iterdir()):
+        if d.is_dir() and d.name.isdigit():
+            flight_dirs.append((int(d.name), d))
+    return flight_dirs
+
+
+def discover_zip_flights(zip_path: Path) -> list:
+    """列出压缩包中所有 {N}/processed.csv 成员，返回 [(flight_number, member), ...]"""
+    found = {}
+    with zipfile.ZipFile(zip_path) as zf:
+        for name in zf.namelist():
+            if name.startswith("__MACOSX"):
+                continue
+            m = ZIP_FLIGHT_PATTERN.search(name)
+            if m:
+                found.setdefault(m.group(1), name)
+    # 与 discover_flight_dirs 一致按目录名排序，保证两种数据源输出完全相同
+    return [(int(dir_name), found[dir_name]) for dir_name in sorted(found)]
+
+
+def load_processed_flights(summary_file: Path) -> set:
+    """汇总表中已有的飞行编号"""
+    if not summary_file.exists():
+        return set()
+    with open(summary_file, 'r', newline='', encoding='utf-8') as f:
+        return {int(row["flight_number"]) for row in csv.DictReader(f)}
+
+
+def find_default_zip():
+    """未解压时在 data/raw/airlab_energy/ 中查找最大的 zip 作为数据源"""
+    zips = sorted(ZIP_DIR.glob("*.zip"), key=lambda p: p.stat().st_size, reverse=True)
+    return zips[0] if zips else None
+
+
+# 进程池 worker 状态: 每个进程只打开一次压缩包、只接收一次元数据
+_worker_zip = None
+_worker_meta = {}
+
+
+def _init_worker(zip_path, flight_meta: dict):
+    global _worker_zip, _worker_meta
+    _worker_zip = zipfile.ZipFile(zip_path) if zip_path is not None else None
+    _worker_meta = flight_meta
+
+
+def _close_worker():
+    """关闭本进程打开的压缩包 (串行路径在主进程中调用 _init_worker)"""
+    global _worker_zip
+    if _worker_zip is not None:
+        _worker_zip.close()
+        _worker_zip = None
+
+
+def _process_task(task):
+    flight_number, source = task
+    if _worker_zip is not None:
+        return process_zip_flight(_worker_zip, source, flight_number, _worker_meta)
+    return process_single_flight(source, flight_number, _worker_meta)
+
+
+def main(zip_path: Path = None, workers: int = 1, incremental: bool = False):
     logger.info("=" * 60)
     logger.info("AirLab CMU 飞行能耗数据清洗")
     logger.info("=" * 60)
 
+    if zip_path is None and not RAW_DIR.exists():
+        zip_path = find_default_zip()
+        if zip_path is None:
+            logger.error(f"❌ 未找到原始数据目录或压缩包: {RAW_DIR}")
+            return
+
     # 加载飞行元数据
-    flight_meta = load_flight_sheet()
+    flight_meta = load_flight_sheet(zip_path)
 
-    # 发现所有飞行记录目录
-    flight_dirs = []
-    for d in sorted(RAW_DIR.iterdir()):
-        if d.is_dir() and d.name.isdigit():
-            flight_dirs.append((int(d.name), d))
+    # 发现所有飞行记录 (目录或压缩包成员)
+    if zip_path is not None:
+        tasks = discover_zip_flights(zip_path)
+        logger.info(f"从压缩包 {zip_path.name} 发现 {len(tasks)} 个飞行记录")
+    else:
+        tasks = discover_flight_dirs()
+        logger.info(f"发现 {len(tasks)} 个飞行记录目录")
 
-    logger.info(f"发现 {len(flight_dirs)} 个飞行记录目录")
+    summary_file = OUTPUT_DIR / "flights_summary.csv"
+    detail_file = OUTPUT_DIR / "flights_detail.csv"
+    append = False
+    if incremental:
+        done = load_processed_flights(summary_file)
+        if done and detail_file.exists():
+            tasks = [task for task in tasks if task[0] not in done]
+            append = True
+            logger.info(f"增量模式: 已处理 {len(done)} 次飞行，待处理新增 {len(tasks)} 个")
+            if not tasks:
+                logger.info("✅ 没有新的飞行记录，输出保持不变")
+                return
+        else:
+            logger.info("增量模式: 尚无已处理结果，执行全量处理")
+
+    # 处理所有飞行 (结果按 flight_number 顺序返回)
+    if workers > 1:
+        logger.info(f"并行处理: {workers} 个进程")
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(zip_path, flight_meta))
+        results = executor.map(_process_task, tasks, chunksize=4)
+    else:
+        executor = None
+        _init_worker(zip_path, flight_meta)
+        results = map(_process_task, tasks)
 
-    # 处理所有飞行
     summaries = []
     all_details = []
     skipped = 0
 
-    for flight_num, flight_dir in flight_dirs:
-        summary, details = process_single_flight(flight_dir, flight_num, flight_meta)
-        if summary is None:
-            skipped += 1
-            continue
-        summaries.append(summary)
-        all_details.extend(details)
+    try:
+        for summary, details in results:
+            if summary is None:
+                skipped += 1
+                continue
+            summaries.append(summary)
+            all_details.extend(details)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        else:
+            _close_worker()
 
     logger.info(f"成功处理 {len(summaries)} 次飞行, 跳过 {skipped} 次")
     logger.info(f"明细数据共 {len(all_details)} 行")
@@ -208,27 +350,31 @@ def main():
     # 输出目录
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    # 写入汇总 CSV
-    summary_file = OUTPUT_DIR / "flights_summary.csv"
-    with open(summary_file, 'w', newline='', encoding='utf-8') as f:
+    # 写入汇总 CSV (增量模式追加到末尾，不重复表头)
+    mode = 'a' if append else 'w'
+    with open(summary_file, mode, newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
-        writer.writeheader()
+        if not append:
+            writer.writeheader()
         writer.writerows(summaries)
-    logger.info(f"✅ 汇总文件: {summary_file} ({len(summaries)} 行, {summary_file.stat().st_size / 1024:.1f} KB)")
+    action = "追加" if append else "写入"
+    logger.info(f"✅ 汇总文件: {summary_file} ({action} {len(summaries)} 行, {summary_file.stat().st_size / 1024:.1f} KB)")
 
     # 写入明细 CSV
-    detail_file = OUTPUT_DIR / "flights_detail.csv"
-    with open(detail_file, 'w', newline='', encoding='utf-8') as f:
+    with open(detail_file, mode, newline='', encoding='utf-8') as f:
         writer = csv.DictWriter(f, fieldnames=DETAIL_FIELDS)
-        writer.writeheader()
+        if not append:
+            writer.writeheader()
         writer.writerows(all_details)
     size_mb = detail_file.stat().st_size / (1024 * 1024)
-    logger.info(f"✅ 明细文件: {detail_file} ({len(all_details)} 行, {size_mb:.2f} MB)")
+    logger.info(f"✅ 明细文件: {detail_file} ({action} {len(all_details)} 行, {size_mb:.2f} MB)")
+    if not summaries:
+        return
 
     # 打印统计摘要
     logger.info("")
     logger.info("=" * 60)
-    logger.info("📊 数据统计摘要:")
+    logger.info("📊 数据统计摘要" + (" (本次新增):" if append else ":"))
     logger.info(f"  总飞行次数: {len(summaries)}")
     total_duration = sum(s["duration_s"] for s in summaries)
     logger.info(f"  总飞行时长: {total_duration:.0f} 秒 ({total_duration / 3600:.2f} 小时)")
@@ -247,4 +393,13 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="AirLab CMU 飞行能耗数据清洗")
+    parser.add_argument("--zip", type=str, default=None,
+                        help="直接从 Figshare 压缩包读取 (无需解压)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="并行进程数 (1 表示串行)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="只处理汇总表中还没有的飞行，结果追加到现有 CSV")
+    args = parser.parse_args()
+
+    main(Path(args.zip) if args.zip else None, workers=max(1, args.workers), incremental=args.incremental)
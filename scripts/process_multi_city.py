@@ -5,15 +5,47 @@ process_multi_city.py — 多城市数据批量处理脚本
 输出到 data/processed/{city}/ 子目录
 
 复用 process_buildings.py 和 process_pois.py 的核心算法
+
+建筑 Feature 批量组装: 所有 way 的顶点一次收集为扁平坐标数组 + 偏移 (旧版 nodes 格式一次 searchsorted
+查坐标)，闭合/有效性判断向量化；高度解析 (含 md5 确定性高度) 与 Feature 字典构造仍逐建筑进行。
+GeoJSON 优先用 orjson 紧凑输出，--compat-json 时与旧版 json.dump 输出字节一致
+
+--compact: 坐标量化到 1e-6 度 (约 0.1 米)，去掉 POI 的 tags 对象与空字符串属性，文件名不变
+--topojson: 另写 {name}.topojson (量化整数坐标 + 差分编码的 arcs，可用 topojson-client 还原)
+每次处理后输出 data/processed/output_size_report.csv (各文件字节数、gzip 字节数、解析耗时)
+
+建筑几何修复 (默认开启，--no-repair 关闭，与输出格式无关): relation 成员片段拼接成闭合环、
+内环只归入包含它的外环、删除重复与共线顶点、统一绕向 (外环逆时针)；全部 way 环在扁平数组上批量修复
+(clean_rings)。--simplify-m 可按米级容差做 Douglas-Peucker 简化。
+与历史文件字节一致需同时指定 --compat-json --no-repair
+
+每个城市另外输出 spatial_index.sidx (spatial_index.build_city_index):
+建筑轮廓扁平顶点数组 + 环偏移、每栋建筑 bbox/高度、均匀网格 (CSR)、禁飞区网格哈希与需求 POI，
+审计与轨迹映射脚本可直接内存映射读取，无需重新解析 GeoJSON
 """
 import os
 import sys
+import csv
+import gzip
 import json
+import time
 import hashlib
 import logging
 import argparse
 from pathlib import Path
 
+import numpy as np
+
+from spatial_index import (METERS_PER_DEG_LAT, ring_signed_area, points_in_ring,
+                           simplify_ring_indices, find_city_file, ragged_arange,
+                           build_city_index, CITY_INDEX_SOURCES, NFZ_RADIUS_M, DEFAULT_NFZ_RADIUS_M)
+from cities import CITIES, CITY_NAMES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -21,14 +53,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger("MultiCityProcessor")
 
-# 城市列表 (与 fetch_multi_city_data.py 保持一致)
-CITIES = ["shenzhen", "chongqing", "beijing", "shanghai", "guangzhou", "chengdu"]
-
-CITY_NAMES = {
-    "shenzhen": "深圳南山", "chongqing": "重庆主城", "beijing": "北京核心",
-    "shanghai": "上海核心", "guangzhou": "广州核心", "chengdu": "成都核心"
-}
-
 # 建筑高度估算配置 (复用 process_buildings.py 逻辑)
 BUILDING_HEIGHT_MAP = {
     'commercial': (20, 80), 'office': (30, 120), 'industrial': (8, 20),
@@ -39,6 +63,13 @@ BUILDING_HEIGHT_MAP = {
 }
 DEFAULT_HEIGHT_RANGE = (10, 30)
 
+# --compact / --topojson 的坐标精度 (小数位数)，1e-6 度约 0.1 米
+COORD_PRECISION = 6
+# 顶点到相邻两点连线的距离小于此值 (米) 视为共线并删除
+COLLINEAR_TOLERANCE_M = 0.01
+# 尺寸报告覆盖的输出文件
+REPORT_FILES = ["buildings_3d", "poi_sensitive", "poi_demand"]
+
 
 def deterministic_height(osm_id: int, min_h: float, max_h: float) -> float:
     """基于 osm_id 的确定性伪随机高度"""
@@ -63,6 +94,41 @@ def parse_height(tags: dict, osm_id: int) -> float:
     return deterministic_height(osm_id, range_[0], range_[1])
 
 
+def parse_heights(tags_list: list, osm_ids: list) -> list:
+    """
+    批量计算建筑高度，结果与逐个调用 parse_height 一致。
+    height / building:levels 字符串解析结果按取值缓存 (大量建筑共用 "3"、"6" 等取值)，
+    只有两者都缺失或无效的建筑才计算 md5 确定性高度
+    """
+    parsed = {}
+
+    def to_float(text):
+        if text not in parsed:
+            try:
+                parsed[text] = float(text)
+            except ValueError:
+                parsed[text] = None
+        return parsed[text]
+
+    heights = [None] * len(tags_list)
+    pending = []
+    for k, tags in enumerate(tags_list):
+        h = None
+        if 'height' in tags:
+            h = to_float(str(tags['height']).replace('m', '').strip())
+        if h is None and 'building:levels' in tags:
+            levels = to_float(tags['building:levels'])
+            h = levels * 3.0 if levels is not None else None
+        if h is None:
+            pending.append(k)
+        heights[k] = h
+
+    for k in pending:
+        range_ = BUILDING_HEIGHT_MAP.get(tags_list[k].get('building', 'yes'), DEFAULT_HEIGHT_RANGE)
+        heights[k] = deterministic_height(osm_ids[k], range_[0], range_[1])
+    return heights
+
+
 def build_node_index(elements: list) -> dict:
     """构建 node 索引: {id -> (lat, lon)}"""
     idx = {}
@@ -72,23 +138,23 @@ def build_node_index(elements: list) -> dict:
     return idx
 
 
-def way_to_polygon(way: dict, node_index: dict):
-    """将 way 转换为 GeoJSON 坐标环 [[lon, lat], ...]"""
-    coords = []
-    
+def way_coords(way: dict, node_index: dict) -> list:
+    """way 的顶点 [[lon, lat], ...] (不补闭合点)"""
     # 新版 out geom; 会直接返回 geometry 数组
     if 'geometry' in way:
-        for pt in way['geometry']:
-            if pt is not None:
-                coords.append([pt['lon'], pt['lat']])
-    else:
-        # 旧版兼容
-        nodes = way.get('nodes', [])
-        for nid in nodes:
-            if nid in node_index:
-                lat, lon = node_index[nid]
-                coords.append([lon, lat])
-                
+        return [[pt['lon'], pt['lat']] for pt in way['geometry'] if pt is not None]
+    # 旧版兼容
+    coords = []
+    for nid in way.get('nodes', []):
+        if nid in node_index:
+            lat, lon = node_index[nid]
+            coords.append([lon, lat])
+    return coords
+
+
+def way_to_polygon(way: dict, node_index: dict):
+    """将 way 转换为 GeoJSON 坐标环 [[lon, lat], ...]"""
+    coords = way_coords(way, node_index)
     if len(coords) < 3:
         return None
     if coords[0] != coords[-1]:
@@ -96,12 +162,259 @@ def way_to_polygon(way: dict, node_index: dict):
     return coords
 
 
+def collect_way_rings(ways: list, node_index: dict):
+    """
+    一次性把所有 way 的顶点收集为扁平坐标数组 + 偏移 (取点规则与 way_coords 一致):
+    out geom; 格式的顶点由扁平推导式整体取出；旧版 nodes 格式的节点 id 拼成一个数组，
+    在排序后的节点 id 上一次 searchsorted 查坐标，缺失节点整体剔除。
+    返回 (lons, lats, offsets, valid, closed):
+      lons / lats 为 object 数组，保留原始数值对象 (保证序列化结果不变)；
+      第 k 个 way 的顶点位于 [offsets[k], offsets[k+1])；valid = 顶点数 >= 3；closed = 首尾重合
+    """
+    is_geom = np.fromiter(('geometry' in way for way in ways), dtype=bool, count=len(ways))
+    counts = np.zeros(len(ways), dtype=np.int64)
+    parts = []
+
+    geoms = [way['geometry'] for way in ways if 'geometry' in way]
+    if geoms:
+        g_lon = [pt['lon'] for g in geoms for pt in g if pt is not None]
+        g_lat = [pt['lat'] for g in geoms for pt in g if pt is not None]
+        g_counts = [len(g) for g in geoms]
+        if sum(g_counts) != len(g_lon):
+            g_counts = [sum(pt is not None for pt in g) for g in geoms]
+        counts[is_geom] = g_counts
+        parts.append((is_geom, g_lon, g_lat))
+
+    node_lists = [way.get('nodes', []) for way in ways if 'geometry' not in way]
+    if node_lists:
+        flat = np.fromiter((nid for nodes in node_lists for nid in nodes), dtype=np.int64)
+        owner = np.repeat(np.arange(len(node_lists)), [len(nodes) for nodes in node_lists])
+        known = np.fromiter(node_index.keys(), dtype=np.int64, count=len(node_index))
+        order = np.argsort(known, kind='stable')
+        known = known[order]
+        pos = np.minimum(np.searchsorted(known, flat), max(len(known) - 1, 0))
+        found = known[pos] == flat if len(known) else np.zeros(len(flat), dtype=bool)
+        table = np.empty((len(node_index), 2), dtype=object)
+        if len(node_index):
+            table[:] = list(node_index.values())
+        lat_lon = table[order[pos[found]]]
+        counts[~is_geom] = np.bincount(owner[found], minlength=len(node_lists))
+        parts.append((~is_geom, lat_lon[:, 1], lat_lon[:, 0]))
+
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    lons = np.empty(int(offsets[-1]), dtype=object)
+    lats = np.empty(int(offsets[-1]), dtype=object)
+    for mask, part_lon, part_lat in parts:
+        _, idx = ragged_arange(offsets[:-1][mask], counts[mask])
+        lons[idx] = part_lon
+        lats[idx] = part_lat
+
+    valid = counts >= 3
+    closed = np.zeros(len(ways), dtype=bool)
+    if valid.any():
+        lon_arr = lons.astype(np.float64)
+        lat_arr = lats.astype(np.float64)
+        first, last = offsets[:-1][valid], offsets[1:][valid] - 1
+        closed[valid] = (lon_arr[first] == lon_arr[last]) & (lat_arr[first] == lat_arr[last])
+    return lons, lats, offsets, valid, closed
+
+
 def build_way_index(elements: list) -> dict:
     return {e['id']: e for e in elements if e.get('type') == 'way'}
 
 
-def relation_to_multipolygon(relation, way_index, node_index):
-    """将 relation 转换为 MultiPolygon"""
+# ===========================================================================
+#  几何修复
+# ===========================================================================
+def stitch_rings(segments: list) -> list:
+    """
+    把首尾相接的 way 片段拼成闭合环 (OSM 多边形的外环常被拆成多条 way)。
+    已闭合的片段直接成环；拼不上的片段按旧逻辑首尾直接闭合
+    """
+    rings, pending = [], []
+    for seg in segments:
+        if len(seg) >= 4 and seg[0] == seg[-1]:
+            rings.append(seg)
+        elif len(seg) >= 2:
+            pending.append(list(seg))
+
+    while pending:
+        cur = pending.pop(0)
+        extended = True
+        while cur[0] != cur[-1] and extended:
+            extended = False
+            for i, seg in enumerate(pending):
+                if seg[0] == cur[-1]:
+                    cur = cur + seg[1:]
+                elif seg[-1] == cur[-1]:
+                    cur = cur + seg[::-1][1:]
+                elif seg[-1] == cur[0]:
+                    cur = seg[:-1] + cur
+                elif seg[0] == cur[0]:
+                    cur = seg[::-1][:-1] + cur
+                else:
+                    continue
+                pending.pop(i)
+                extended = True
+                break
+        if cur[0] != cur[-1]:
+            cur.append(cur[0])
+        if len(cur) >= 4:
+            rings.append(cur)
+    return rings
+
+
+def _cyclic_neighbors(offsets: np.ndarray):
+    """扁平环数组中每个点在本环内的前一点与后一点下标 (环首尾相接)"""
+    counts = np.diff(offsets)
+    idx = np.arange(offsets[-1], dtype=np.int64)
+    start = np.repeat(offsets[:-1], counts)
+    end = np.repeat(offsets[1:], counts)
+    return np.where(idx == start, end - 1, idx - 1), np.where(idx == end - 1, start, idx + 1)
+
+
+def _keep_points(keep: np.ndarray, rid: np.ndarray, n_rings: int, arrays: list):
+    """按点掩码筛选扁平环数组，返回 (rid, offsets, arrays)"""
+    rid = rid[keep]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(rid, minlength=n_rings))]).astype(np.int64)
+    return rid, offsets, [a[keep] for a in arrays]
+
+
+def clean_rings(lon, lat, offsets, simplify_m: float = 0.0, ccw=True):
+    """
+    批量几何修复: 所有环为扁平坐标 + 偏移 (可含闭合点)，每一步在全部环上一次完成。
+    删除相邻重复顶点与共线/尖刺顶点 (反复直到没有可删的点)，可选 Douglas-Peucker 简化 (米，逐环)，
+    并统一绕向 (RFC 7946: 外环逆时针、内环顺时针；ccw 可为每个环单独给出)。
+    返回 (lon, lat, offsets, ok)：修复后的开放环；ok[k] 为假表示第 k 个环不足 3 个顶点或面积为零 (为空段)
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_rings = len(offsets) - 1
+    ccw = np.broadcast_to(np.asarray(ccw, dtype=bool), (n_rings,))
+    rid = np.repeat(np.arange(n_rings, dtype=np.int64), np.diff(offsets))
+
+    # 去掉与首点重合的闭合点
+    keep = np.ones(len(lon), dtype=bool)
+    multi = np.flatnonzero(np.diff(offsets) > 1)
+    first, last = offsets[multi], offsets[multi + 1] - 1
+    keep[last[(lon[first] == lon[last]) & (lat[first] == lat[last])]] = False
+    rid, offsets, (lon, lat) = _keep_points(keep, rid, n_rings, [lon, lat])
+
+    def dedupe(rid, offsets, arrays):
+        prev, _ = _cyclic_neighbors(offsets)
+        keep = (arrays[0] != arrays[0][prev]) | (arrays[1] != arrays[1][prev])
+        rid, offsets, arrays = _keep_points(keep, rid, n_rings, arrays)
+        # 不足 3 个顶点的环退化，整体剔除
+        ok_ = np.diff(offsets) >= 3
+        return (ok_,) + _keep_points(ok_[rid], rid, n_rings, arrays)
+
+    ok, rid, offsets, (lon, lat) = dedupe(rid, offsets, [lon, lat])
+
+    # 局部平面米坐标 (以各环首点为原点)，用于共线判断、简化与面积
+    start = np.repeat(offsets[:-1], np.diff(offsets))
+    kx = METERS_PER_DEG_LAT * np.cos(np.radians(lat[start]))
+    x = (lon - lon[start]) * kx
+    y = (lat - lat[start]) * METERS_PER_DEG_LAT
+
+    while len(x):
+        prev, nxt = _cyclic_neighbors(offsets)
+        sx, sy = x[nxt] - x[prev], y[nxt] - y[prev]
+        dx, dy = x - x[prev], y - y[prev]
+        length = np.hypot(sx, sy)
+        cross = np.abs(sx * dy - sy * dx)
+        # 前后两点重合 (尖刺) 时 length 为 0，同样删除
+        drop = (cross <= COLLINEAR_TOLERANCE_M * length) | (length == 0)
+        if not drop.any():
+            break
+        rid, offsets, arrays = _keep_points(~drop, rid, n_rings, [lon, lat, x, y])
+        still_ok, rid, offsets, (lon, lat, x, y) = dedupe(rid, offsets, arrays)
+        ok &= still_ok
+
+    if simplify_m > 0:
+        keep = np.zeros(len(x), dtype=bool)
+        for r in np.flatnonzero(ok):
+            a, b = offsets[r], offsets[r + 1]
+            keep[a + simplify_ring_indices(np.column_stack([x[a:b], y[a:b]]), simplify_m)] = True
+        rid, offsets, (lon, lat, x, y) = _keep_points(keep, rid, n_rings, [lon, lat, x, y])
+        ok &= np.diff(offsets) >= 3
+        rid, offsets, (lon, lat, x, y) = _keep_points(ok[rid], rid, n_rings, [lon, lat, x, y])
+
+    # 鞋带公式有向面积 (的两倍)，面积为零的环退化
+    _, nxt = _cyclic_neighbors(offsets)
+    area2 = np.bincount(rid, weights=x * y[nxt], minlength=n_rings) - \
+        np.bincount(rid, weights=x[nxt] * y, minlength=n_rings)
+    ok &= area2 != 0
+    rid, offsets, (lon, lat) = _keep_points(ok[rid], rid, n_rings, [lon, lat])
+
+    # 绕向与要求相反的环段内倒序
+    counts = np.diff(offsets)
+    flip = ((area2 > 0) != ccw)[rid]
+    idx = np.arange(len(lon), dtype=np.int64)
+    order = np.where(flip, np.repeat(offsets[:-1] + offsets[1:] - 1, counts) - idx, idx)
+    return lon[order], lat[order], offsets, ok
+
+
+def clean_ring(ring: list, simplify_m: float = 0.0, ccw: bool = True):
+    """
+    单个环的几何修复 (clean_rings 的单环形式)。
+    返回闭合环 [[lon, lat], ...]；不足 3 个顶点或面积为零时返回 None
+    """
+    pts = np.asarray(ring, dtype=np.float64)[:, :2]
+    lon, lat, _, ok = clean_rings(pts[:, 0], pts[:, 1], [0, len(pts)], simplify_m, ccw)
+    if not ok[0]:
+        return None
+    out = np.column_stack([lon, lat]).tolist()
+    out.append(out[0])
+    return out
+
+
+def assign_inner_rings(outers: list, inners: list) -> list:
+    """
+    每个内环只归入包含它的外环 (过半顶点落在外环内；多个外环满足时取面积最小者)，
+    不被任何外环包含的内环丢弃。返回 [[外环, 内环...], ...]
+    """
+    outer_arrs = [np.asarray(o)[:-1] for o in outers]
+    areas = [abs(ring_signed_area(a)) for a in outer_arrs]
+    polygons = [[o] for o in outers]
+    for inner in inners:
+        pts = np.asarray(inner)[:-1]
+        best = None
+        for i, arr in enumerate(outer_arrs):
+            inside = np.count_nonzero(points_in_ring(arr, pts[:, 0], pts[:, 1]))
+            if inside * 2 > len(pts) and (best is None or areas[i] < areas[best]):
+                best = i
+        if best is not None:
+            polygons[best].append(inner)
+    return polygons
+
+
+def relation_to_multipolygon(relation, way_index, node_index, repair: bool = True,
+                             simplify_m: float = 0.0):
+    """
+    将 relation 转换为 Polygon / MultiPolygon。
+    repair=True: 成员 way 不在元素列表中时使用成员自带的 geometry (out geom;)，
+    片段拼接为闭合环、清理顶点，内环只归入包含它的外环；
+    repair=False: 旧逻辑 (每个外环复制全部内环)
+    """
+    if repair:
+        segments = {'outer': [], 'inner': []}
+        for member in relation.get('members', []):
+            if member.get('type') != 'way':
+                continue
+            coords = way_coords(way_index.get(member.get('ref'), member), node_index)
+            segments['inner' if member.get('role') == 'inner' else 'outer'].append(coords)
+        outers = [r for r in (clean_ring(r, simplify_m, ccw=True)
+                              for r in stitch_rings(segments['outer'])) if r]
+        if not outers:
+            return None, None
+        inners = [r for r in (clean_ring(r, simplify_m, ccw=False)
+                              for r in stitch_rings(segments['inner'])) if r]
+        polygons = assign_inner_rings(outers, inners)
+        if len(polygons) == 1:
+            return "Polygon", polygons[0]
+        return "MultiPolygon", polygons
+
     outers, inners = [], []
     for member in relation.get('members', []):
         if member.get('type') == 'way' and member.get('ref') in way_index:
@@ -126,7 +439,233 @@ def relation_to_multipolygon(relation, way_index, node_index):
 # ===========================================================================
 #  建筑处理
 # ===========================================================================
-def process_city_buildings(city: str, raw_dir: Path, out_dir: Path) -> bool:
+def assemble_building_features(elements: list, node_index: dict, way_index: dict,
+                               repair: bool = True, simplify_m: float = 0.0):
+    """
+    批量组装建筑 Feature (保持元素原有顺序)。
+    repair=True 时对全部 way 环做一次批量几何修复 (clean_rings)，退化的 way 计入 skip。
+    返回 (features, (way_count, rel_count, skip_count))
+    """
+    buildings = [el for el in elements
+                 if 'building' in el.get('tags', {}) and el['type'] in ('way', 'relation')]
+    ways = [el for el in buildings if el['type'] == 'way']
+    lons, lats, offsets, valid, closed = collect_way_rings(ways, node_index)
+    heights = parse_heights([el['tags'] for el in buildings], [el['id'] for el in buildings])
+
+    # 全部顶点一次转为 [lon, lat] 列表 (object 数组 tolist 保留原始数值对象)，各 way 按偏移切片；
+    # 修复时先对全部 way 环做一次批量 clean_rings，再切片修复后的顶点
+    if repair:
+        lon, lat, offsets, valid = clean_rings(lons.astype(np.float64), lats.astype(np.float64), offsets,
+                                               simplify_m, ccw=True)
+        pairs = np.column_stack([lon, lat]).tolist()
+    else:
+        pairs = np.column_stack([lons, lats]).tolist() if len(lons) else []
+    starts, ends = offsets[:-1].tolist(), offsets[1:].tolist()
+
+    features = []
+    way_count, rel_count, skip_count = 0, 0, 0
+    k = 0
+    for el, height in zip(buildings, heights):
+        if el['type'] == 'way':
+            w, k = k, k + 1
+            if not valid[w]:
+                skip_count += 1
+                continue
+            ring = pairs[starts[w]:ends[w]]
+            if repair or not closed[w]:
+                ring.append(ring[0])
+            geom_type, coords = "Polygon", [ring]
+            way_count += 1
+        else:
+            geom_type, coords = relation_to_multipolygon(el, way_index, node_index, repair, simplify_m)
+            if not geom_type:
+                skip_count += 1
+                continue
+            rel_count += 1
+
+        tags = el['tags']
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "osm_id": el['id'],
+                "height": height,
+                "building_type": tags.get('building', 'yes'),
+                "name": tags.get('name', ''),
+                "levels": tags.get('building:levels', ''),
+            },
+            "geometry": {
+                "type": geom_type,
+                "coordinates": coords
+            }
+        })
+    return features, (way_count, rel_count, skip_count)
+
+
+def polygon_rings_of(geometry: dict) -> list:
+    if geometry['type'] == 'MultiPolygon':
+        return [r for poly in geometry['coordinates'] for r in poly]
+    return geometry['coordinates']
+
+
+def load_json(path: Path):
+    """读取原始 JSON，有 orjson 时使用 orjson (解析结果与标准库一致)"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dump_geojson(geojson: dict, output_file: Path, compat: bool = False):
+    """
+    写出 GeoJSON。
+    compat=True: 与旧版 json.dump(..., ensure_ascii=False) 字节一致 (改用 json.dumps 一次性走 C 编码器)
+    否则优先 orjson 紧凑输出，未安装 orjson 时使用标准库紧凑分隔符
+    """
+    if compat or orjson is None:
+        separators = None if compat else (',', ':')
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(geojson, ensure_ascii=False, separators=separators))
+    else:
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(geojson))
+
+
+def quantize(values, precision: int = COORD_PRECISION) -> np.ndarray:
+    """经纬度 → 以 10^-precision 度为单位的整数"""
+    return np.rint(np.asarray(values, dtype=np.float64) * 10 ** precision).astype(np.int64)
+
+
+def quantize_geometry(geometry: dict, precision: int = COORD_PRECISION) -> dict:
+    """把 Point / Polygon / MultiPolygon 的坐标量化到 precision 位小数"""
+    scale = 10 ** precision
+
+    def ring(r):
+        return (quantize(r, precision) / scale).tolist()
+
+    gtype, coords = geometry['type'], geometry['coordinates']
+    if gtype == 'Point':
+        coords = ring([coords[:2]])[0]
+    elif gtype == 'Polygon':
+        coords = [ring(r) for r in coords]
+    elif gtype == 'MultiPolygon':
+        coords = [[ring(r) for r in poly] for poly in coords]
+    return {"type": gtype, "coordinates": coords}
+
+
+def compact_feature(feature: dict, precision: int = COORD_PRECISION) -> dict:
+    """量化坐标并裁剪属性: 去掉 tags 对象 (信息已在 name/category 中) 与空字符串属性"""
+    props = {k: v for k, v in feature['properties'].items() if k != 'tags' and v != ''}
+    return {"type": "Feature", "properties": props,
+            "geometry": quantize_geometry(feature['geometry'], precision)}
+
+
+def to_topojson(geojson: dict, layer: str, precision: int = COORD_PRECISION) -> dict:
+    """
+    FeatureCollection → TopoJSON Topology (单个 GeometryCollection 对象)。
+    坐标量化为整数 (transform.scale = 10^-precision)，每个环一条 arc 并差分编码，
+    量化后重复的相邻顶点 (零差分) 在环仍不少于 4 个顶点时丢弃
+    """
+    features = geojson['features']
+
+    def rings_of(geom):
+        if geom['type'] == 'Polygon':
+            return geom['coordinates']
+        if geom['type'] == 'MultiPolygon':
+            return [r for poly in geom['coordinates'] for r in poly]
+        return [[geom['coordinates'][:2]]]
+
+    all_pts = [pt[:2] for f in features for r in rings_of(f['geometry']) for pt in r]
+    origin = quantize(np.min(all_pts, axis=0), precision) if all_pts else np.zeros(2, dtype=np.int64)
+
+    arcs = []
+
+    def arc(r):
+        q = quantize([pt[:2] for pt in r], precision) - origin
+        delta = np.vstack([q[:1], np.diff(q, axis=0)])
+        keep = np.any(delta != 0, axis=1)
+        keep[0] = True
+        if keep.sum() >= 4:
+            delta = delta[keep]
+        arcs.append(delta.tolist())
+        return len(arcs) - 1
+
+    geometries = []
+    for f in features:
+        geom = f['geometry']
+        if geom['type'] == 'Polygon':
+            g = {"type": "Polygon", "arcs": [[arc(r)] for r in geom['coordinates']]}
+        elif geom['type'] == 'MultiPolygon':
+            g = {"type": "MultiPolygon",
+                 "arcs": [[[arc(r)] for r in poly] for poly in geom['coordinates']]}
+        else:
+            g = {"type": "Point",
+                 "coordinates": (quantize([geom['coordinates'][:2]], precision)[0] - origin).tolist()}
+        g["properties"] = f['properties']
+        geometries.append(g)
+
+    scale = 10.0 ** -precision
+    return {
+        "type": "Topology",
+        "transform": {"scale": [scale, scale],
+                      "translate": (origin / 10 ** precision).tolist()},
+        "objects": {layer: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": arcs,
+        "metadata": geojson.get("metadata", {}),
+    }
+
+
+def save_feature_collection(geojson: dict, output_file: Path, compat_json: bool = False,
+                            compact: bool = False, topojson: bool = False,
+                            precision: int = COORD_PRECISION):
+    """按输出选项写出 GeoJSON (及可选的 TopoJSON)"""
+    if compact:
+        geojson = dict(geojson, features=[compact_feature(f, precision) for f in geojson['features']],
+                       metadata={**geojson.get('metadata', {}), 'coord_precision': precision})
+    dump_geojson(geojson, output_file, compat=compat_json and not compact)
+    if topojson:
+        topo_file = output_file.with_suffix('.topojson')
+        dump_geojson(to_topojson(geojson, output_file.stem, precision), topo_file)
+        logger.info(f"  ✅ 已保存: {topo_file}")
+
+
+def file_size_report(path: Path) -> dict:
+    """单个输出文件的字节数、gzip 后字节数与 JSON 解析耗时 (标准库 json，取 3 次最小值)"""
+    raw = path.read_bytes()
+    parse_s = float('inf')
+    for _ in range(3):
+        t0 = time.perf_counter()
+        data = json.loads(raw)
+        parse_s = min(parse_s, time.perf_counter() - t0)
+    if data.get('type') == 'Topology':
+        count = sum(len(o.get('geometries', [])) for o in data.get('objects', {}).values())
+    else:
+        count = len(data.get('features', []))
+    return {
+        'file': path.name,
+        'features': count,
+        'bytes': len(raw),
+        'gzip_bytes': len(gzip.compress(raw, compresslevel=6)),
+        'parse_ms': round(parse_s * 1000, 2),
+    }
+
+
+def write_size_report(rows: list, report_csv: Path):
+    if not rows:
+        return
+    with open(report_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['city', 'file', 'features', 'bytes', 'gzip_bytes', 'parse_ms'])
+        writer.writeheader()
+        writer.writerows(rows)
+    for r in rows:
+        logger.info(f"  {r['city']:<10} {r['file']:<24} {r['bytes'] / 1024:>8.0f} KB "
+                    f"(gzip {r['gzip_bytes'] / 1024:>6.0f} KB)  解析 {r['parse_ms']:>7.2f} ms")
+    logger.info(f"  ✅ 尺寸报告: {report_csv}")
+
+
+def process_city_buildings(city: str, raw_dir: Path, out_dir: Path, compat_json: bool = False,
+                           compact: bool = False, topojson: bool = False, simplify_m: float = 0.0,
+                           repair: bool = True) -> bool:
     """处理单个城市的建筑数据"""
     # 按优先级查找原始文件 (根目录 > 子目录)
     if city == "shenzhen":
@@ -159,57 +698,14 @@ def process_city_buildings(city: str, raw_dir: Path, out_dir: Path) -> bool:
 
     logger.info(f"  🔄 处理建筑数据: {input_file.name}")
 
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = load_json(input_file)
 
     elements = data.get('elements', [])
     node_index = build_node_index(elements)
     way_index = build_way_index(elements)
 
-    features = []
-    way_count, rel_count, skip_count = 0, 0, 0
-
-    for el in elements:
-        tags = el.get('tags', {})
-        if 'building' not in tags:
-            continue
-
-        osm_id = el['id']
-        height = parse_height(tags, osm_id)
-        geom_type, coords = None, None
-
-        if el['type'] == 'way':
-            ring = way_to_polygon(el, node_index)
-            if ring:
-                geom_type, coords = "Polygon", [ring]
-                way_count += 1
-            else:
-                skip_count += 1
-                continue
-        elif el['type'] == 'relation':
-            geom_type, coords = relation_to_multipolygon(el, way_index, node_index)
-            if not geom_type:
-                skip_count += 1
-                continue
-            rel_count += 1
-        else:
-            continue
-
-        feature = {
-            "type": "Feature",
-            "properties": {
-                "osm_id": osm_id,
-                "height": height,
-                "building_type": tags.get('building', 'yes'),
-                "name": tags.get('name', ''),
-                "levels": tags.get('building:levels', ''),
-            },
-            "geometry": {
-                "type": geom_type,
-                "coordinates": coords
-            }
-        }
-        features.append(feature)
+    features, (way_count, rel_count, skip_count) = assemble_building_features(
+        elements, node_index, way_index, repair=repair, simplify_m=simplify_m)
 
     geojson = {
         "type": "FeatureCollection",
@@ -221,10 +717,11 @@ def process_city_buildings(city: str, raw_dir: Path, out_dir: Path) -> bool:
         }
     }
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(geojson, f, ensure_ascii=False)
+    save_feature_collection(geojson, output_file, compat_json, compact, topojson)
 
-    logger.info(f"  📊 建筑: {len(features)} features (way={way_count}, rel={rel_count}, skip={skip_count})")
+    n_vertices = sum(len(r) for f in features for r in polygon_rings_of(f['geometry']))
+    logger.info(f"  📊 建筑: {len(features)} features (way={way_count}, rel={rel_count}, skip={skip_count}), "
+                f"顶点 {n_vertices}")
     logger.info(f"  ✅ 已保存: {output_file}")
     return True
 
@@ -232,7 +729,8 @@ def process_city_buildings(city: str, raw_dir: Path, out_dir: Path) -> bool:
 # ===========================================================================
 #  POI 处理
 # ===========================================================================
-def process_city_pois(city: str, raw_dir: Path, out_dir: Path) -> bool:
+def process_city_pois(city: str, raw_dir: Path, out_dir: Path, compat_json: bool = False,
+                      compact: bool = False, topojson: bool = False) -> bool:
     """处理单个城市的 POI 数据"""
     all_ok = True
 
@@ -270,8 +768,7 @@ def process_city_pois(city: str, raw_dir: Path, out_dir: Path) -> bool:
 
         logger.info(f"  🔄 处理 {poi_type} POI: {input_file.name}")
 
-        with open(input_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_json(input_file)
 
         elements = data.get('elements', [])
         features = []
@@ -328,8 +825,7 @@ def process_city_pois(city: str, raw_dir: Path, out_dir: Path) -> bool:
             }
         }
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(geojson, f, ensure_ascii=False)
+        save_feature_collection(geojson, output_file, compat_json, compact, topojson)
 
         logger.info(f"  📊 {poi_type} POI: {len(features)} features")
         logger.info(f"  ✅ 已保存: {output_file}")
@@ -337,6 +833,19 @@ def process_city_pois(city: str, raw_dir: Path, out_dir: Path) -> bool:
     return all_ok
 
 
+# ===========================================================================
+#  空间索引
+# ===========================================================================
+def write_city_index(city: str, out_dir: Path) -> bool:
+    """由本城市已输出的 GeoJSON 构建可内存映射的空间索引文件"""
+    if not any((out_dir / name).exists() for name in CITY_INDEX_SOURCES.values()):
+        logger.warning(f"  ⚠️  无可索引的 GeoJSON: {out_dir}")
+        return False
+    path = build_city_index(out_dir, radius_map=NFZ_RADIUS_M, default_radius=DEFAULT_NFZ_RADIUS_M)
+    logger.info(f"  ✅ 空间索引: {path} ({path.stat().st_size / 1024:.0f} KB)")
+    return True
+
+
 # ===========================================================================
 #  主入口
 # ===========================================================================
@@ -346,6 +855,20 @@ if __name__ == "__main__":
                         help="处理的城市, 逗号分隔或'all'")
     parser.add_argument("--force", action="store_true", default=False,
                         help="强制重新处理, 覆盖已有文件")
+    parser.add_argument("--compat-json", action="store_true", default=False,
+                        help="按旧版 json.dump 格式输出 (配合 --no-repair 与历史文件字节一致)")
+    parser.add_argument("--no-repair", action="store_true", default=False,
+                        help="不做建筑几何修复, 保持旧版几何 (每个外环复制全部内环, 不清理顶点)")
+    parser.add_argument("--simplify-m", type=float, default=0.0,
+                        help="建筑轮廓 Douglas-Peucker 简化容差 (米), 0 表示不简化")
+    parser.add_argument("--compact", action="store_true", default=False,
+                        help="坐标量化到 1e-6 度并裁剪 POI tags / 空属性")
+    parser.add_argument("--topojson", action="store_true", default=False,
+                        help="另外输出量化 + 差分编码的 .topojson")
+    parser.add_argument("--no-index", action="store_true", default=False,
+                        help="不生成 spatial_index.sidx")
+    parser.add_argument("--index-only", action="store_true", default=False,
+                        help="只由已有 GeoJSON 重建 spatial_index.sidx")
     args = parser.parse_args()
 
     base = Path(__file__).resolve().parent.parent
@@ -361,6 +884,7 @@ if __name__ == "__main__":
     logger.info("🔄 多城市数据批量处理")
     logger.info("=" * 60)
 
+    size_rows = []
     for i, city in enumerate(cities):
         name = CITY_NAMES.get(city, city)
         logger.info(f"\n━━━ [{i+1}/{len(cities)}] {name} ━━━")
@@ -372,8 +896,23 @@ if __name__ == "__main__":
             city_out = processed_dir / city
             city_out.mkdir(parents=True, exist_ok=True)
 
-        process_city_buildings(city, raw_dir, city_out)
-        process_city_pois(city, raw_dir, city_out)
+        if args.index_only:
+            # 深圳的已有 GeoJSON 可能位于 processed 根目录或 shenzhen/ 子目录
+            city_out = find_city_file(processed_dir, city, "poi_demand.geojson").parent
+        else:
+            options = dict(compat_json=args.compat_json, compact=args.compact, topojson=args.topojson)
+            process_city_buildings(city, raw_dir, city_out, simplify_m=args.simplify_m,
+                                   repair=not args.no_repair, **options)
+            process_city_pois(city, raw_dir, city_out, **options)
+            for stem in REPORT_FILES:
+                for suffix in ('.geojson', '.topojson'):
+                    path = city_out / f"{stem}{suffix}"
+                    if path.exists() and (suffix == '.geojson' or args.topojson):
+                        size_rows.append({'city': city, **file_size_report(path)})
+        if not args.no_index:
+            write_city_index(city, city_out)
+
+    write_size_report(size_rows, processed_dir / "output_size_report.csv")
 
     logger.info("\n" + "=" * 60)
     logger.info("✅ 全部处理完成!")
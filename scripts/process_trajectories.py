@@ -5,27 +5,33 @@ process_trajectories.py — UAV 轨迹数据清洗与城市映射脚本
 
 输入:
   - data/raw/uav_trajectories_raw.csv         (HF 原始数据: timestamp, tx, ty, tz)
+    或 data/raw/uav_trajectories_raw.parquet  (fetch_uav_trajectories.py --format parquet)
   - data/processed/poi_demand.geojson          (需求 POI 作为起降锚点池)
 
 输出:
-  - data/processed/uav_trajectories.csv        (字段遵循 Data_Dictionary.md)
+  - data/processed/trajectories/uav_trajectories.csv  (字段遵循 Data_Dictionary.md; --output 可改)
 
 算法:
   1. 读取原始 CSV，按时间间隔 >1s 自动切分为独立轨迹
   2. 有限差分推导: speed_x/y/z, yaw, pitch, roll, battery_rem
+     (按批把轨迹拼成扁平数组 + 偏移量，segment_ops.py 分段算子一次算完，不逐点循环)
   3. 平移映射: 将局部 x/y 坐标线性映射到 POI 对之间的 WGS84 经纬度
   4. 高度映射: 原始 z 归一化后映射到 50-120m 合理飞行高度
 
-不使用 shapely/geopandas，纯 Python + math + csv 实现
+不使用 shapely/geopandas，NumPy + csv 实现
 """
 
 import csv
 import json
-import math
 import hashlib
 import logging
+import argparse
 from pathlib import Path
 
+import numpy as np
+
+from segment_ops import seg_diff, seg_cumsum, seg_min, seg_max, seg_ffill
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -46,11 +52,36 @@ TRAJECTORY_GAP_SECONDS = 1.0
 MIN_TRAJECTORY_POINTS = 10
 # roll 响应系数 (偏航角变化率 -> 滚转角)
 ROLL_RESPONSE_COEFF = 0.3
+# 原始数据中使用的列
+RAW_COLUMNS = ['timestamp', 'tx', 'ty', 'tz']
+# 输出字段 (Data_Dictionary.md) 与各列保留小数位
+OUTPUT_FIELDS = [
+    'flight_id', 'timestamp', 'lat', 'lon',
+    'alt_abs', 'alt_rel', 'speed_x', 'speed_y', 'speed_z',
+    'roll', 'pitch', 'yaw', 'battery_rem'
+]
+OUTPUT_DECIMALS = {
+    'timestamp': 3, 'lat': 7, 'lon': 7, 'alt_abs': 2, 'alt_rel': 2,
+    'speed_x': 4, 'speed_y': 4, 'speed_z': 4,
+    'roll': 2, 'pitch': 2, 'yaw': 2, 'battery_rem': 2,
+}
+# 每批一起向量化处理的轨迹条数
+BATCH_FLIGHTS = 500
 
 
 def load_poi_anchors(poi_path: Path) -> list:
     """加载 POI 需求点作为轨迹起降锚点池，返回 [(lat, lon, name), ...]"""
     logger.info(f"加载 POI 锚点: {poi_path}")
+    # 同目录有 process_multi_city.py 预构建的空间索引时直接内存映射读取 (顺序与 GeoJSON 一致)
+    if (poi_path.parent / "spatial_index.sidx").exists():
+        from spatial_index import load_prebuilt_index
+        prebuilt = load_prebuilt_index(poi_path, 'demand')
+        if prebuilt is not None:
+            d = prebuilt['demand']
+            anchors = list(zip(d['lat'].tolist(), d['lon'].tolist(), d['name'].tolist()))
+            logger.info(f"  可用锚点数: {len(anchors)} (spatial_index.sidx)")
+            return anchors
+
     with open(poi_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
@@ -107,136 +138,119 @@ def split_trajectories(rows: list) -> list:
     return trajectories
 
 
-def process_single_trajectory(traj: list, flight_id: int,
-                              start_anchor: tuple, end_anchor: tuple) -> list:
+def derive_trajectory_columns(trajectories: list, first_id: int, anchors: list) -> dict:
     """
-    处理单条轨迹:
+    批量处理一组轨迹 (航班编号从 first_id 起连续):
     1. 有限差分推导速度
     2. 速度向量推导姿态角
     3. 能耗模型推导电量
     4. 平移映射到 WGS84
 
-    返回: [dict, dict, ...] 每个 dict 是一行输出记录
+    全部轨迹拼成扁平数组 + 偏移量，用 segment_ops 的分段算子一次算完。
+    返回 {列名: ndarray}，列与输出 CSV 一致 (尚未舍入)
+    """
+    trajectories = [traj for traj in trajectories if len(traj) >= 2]
+    lengths = np.array([len(traj) for traj in trajectories], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    pts = np.array([p for traj in trajectories for p in traj], dtype=np.float64).reshape(-1, 4)
+    t, tx, ty, tz = pts[:, 0], pts[:, 1], pts[:, 2], pts[:, 3]
+
+    def per_point(v):
+        return np.repeat(v, lengths)
+
+    # 起终点锚点 (逐航班)
+    pairs = [deterministic_pair(first_id + k, anchors) for k in range(len(trajectories))]
+    start_lat = np.array([a[0] for a, _ in pairs])
+    start_lon = np.array([a[1] for a, _ in pairs])
+    end_lat = np.array([b[0] for _, b in pairs])
+    end_lon = np.array([b[1] for _, b in pairs])
+
+    # --- 平移映射到 WGS84 ---
+    # 将局部坐标按各自航班的 x/y/z 范围线性插值到起终点之间
+    def ratio(v):
+        v_min, v_max = seg_min(v, offsets), seg_max(v, offsets)
+        v_range = np.where(v_max != v_min, v_max - v_min, 1.0)
+        return (v - per_point(v_min)) / per_point(v_range)
+
+    lat = per_point(start_lat) + ratio(tx) * per_point(end_lat - start_lat)
+    lon = per_point(start_lon) + ratio(ty) * per_point(end_lon - start_lon)
+    alt_abs = ALT_MIN + ratio(tz) * (ALT_MAX - ALT_MIN)
+
+    # --- 有限差分推导速度 ---
+    # 前向差分；每段最后一点沿用与前一点之间的后向差分
+    hi = np.arange(1, len(t) + 1, dtype=np.int64)
+    hi[offsets[1:] - 1] -= 1
+    dt = seg_diff(t, offsets)[hi]
+    dt = np.where(dt <= 0, 0.05, dt)  # 防除零
+    speed_x = seg_diff(tx, offsets)[hi] / dt
+    speed_y = seg_diff(ty, offsets)[hi] / dt
+    speed_z = seg_diff(tz, offsets)[hi] / dt
+
+    # --- 姿态角推导 ---
+    # 偏航角 (yaw): 水平速度方向，近乎悬停时沿用上一时刻 (航班起点前为 0)
+    h_speed = np.sqrt(speed_x ** 2 + speed_y ** 2)
+    yaw = seg_ffill(np.degrees(np.arctan2(speed_y, speed_x)), h_speed > 0.01, offsets, initial=0.0)
+
+    # 俯仰角 (pitch): 爬升/下降角
+    pitch = np.degrees(np.arctan2(speed_z, np.maximum(h_speed, 0.01)))
+
+    # 滚转角 (roll): 基于偏航角变化率 (转弯倾斜)
+    yaw_rate = seg_diff(yaw, offsets, prepend=0.0)
+    # 处理 ±180° 跳变
+    yaw_rate = np.where(yaw_rate > 180, yaw_rate - 360, np.where(yaw_rate < -180, yaw_rate + 360, yaw_rate))
+    roll = np.clip(yaw_rate * ROLL_RESPONSE_COEFF, -45, 45)
+
+    # --- 电量消耗模型 ---
+    v_squared = speed_x ** 2 + speed_y ** 2 + speed_z ** 2
+    drained = seg_cumsum(BATTERY_DRAIN_COEFF * v_squared * dt, offsets)
+    battery = np.maximum(100.0 - drained, 5.0)  # 不低于 5%
+
+    flight_ids = np.array([f"UAV_{first_id + k:05d}" for k in range(len(trajectories))])
+    return {
+        'flight_id': per_point(flight_ids),
+        'timestamp': t, 'lat': lat, 'lon': lon,
+        'alt_abs': alt_abs, 'alt_rel': alt_abs,  # 起飞点假设为地面
+        'speed_x': speed_x, 'speed_y': speed_y, 'speed_z': speed_z,
+        'roll': roll, 'pitch': pitch, 'yaw': yaw,
+        'battery_rem': battery,
+    }
+
+
+def format_rows(columns: dict):
+    """按 OUTPUT_FIELDS 顺序舍入为输出行"""
+    rounded = [columns['flight_id'].tolist()]
+    for name in OUTPUT_FIELDS[1:]:
+        values = np.round(columns[name], OUTPUT_DECIMALS[name])
+        if name == 'roll':
+            # 限幅边界 ±45 写成整数，与既有输出文件逐字节一致
+            values = values.astype(object)
+            clamped = np.abs(columns[name]) >= 45
+            values[clamped] = np.sign(columns[name][clamped]).astype(int) * 45
+        rounded.append(values.tolist())
+    return zip(*rounded)
+
+
+def load_raw_rows(raw_path: Path) -> list:
+    """
+    读取原始轨迹，返回 [(timestamp, tx, ty, tz), ...]。
+    全部行都会载入内存 (按时间间隔切分轨迹需要完整的时间序列)，峰值内存受限的只是写出阶段
+    (每批 BATCH_FLIGHTS 条轨迹)。
+    .parquet 由 fetch_uav_trajectories.py --format parquet 生成，按 RecordBatch 逐批读取，
+    每批整列转换并剔除含空值的行；其余按 CSV 处理。
     """
-    n = len(traj)
-    if n < 2:
-        return []
-
-    start_lat, start_lon, _ = start_anchor
-    end_lat, end_lon, _ = end_anchor
-
-    # 计算原始轨迹的 x/y 范围
-    xs = [p[1] for p in traj]
-    ys = [p[2] for p in traj]
-    zs = [p[3] for p in traj]
-
-    x_min, x_max = min(xs), max(xs)
-    y_min, y_max = min(ys), max(ys)
-    z_min, z_max = min(zs), max(zs)
-
-    x_range = x_max - x_min if x_max != x_min else 1.0
-    y_range = y_max - y_min if y_max != y_min else 1.0
-    z_range = z_max - z_min if z_max != z_min else 1.0
-
-    # 经纬度映射参数
-    cos_lat = math.cos(math.radians((start_lat + end_lat) / 2))
-    meters_per_deg_lon = METERS_PER_DEG_LAT * cos_lat
-
-    records = []
-    battery = 100.0
-    prev_yaw = 0.0
-
-    for i in range(n):
-        t, tx, ty, tz = traj[i]
-
-        # --- 平移映射到 WGS84 ---
-        # 将局部坐标线性插值到起终点之间
-        ratio_x = (tx - x_min) / x_range
-        ratio_y = (ty - y_min) / y_range
-        ratio_z = (tz - z_min) / z_range
-
-        lat = start_lat + ratio_x * (end_lat - start_lat)
-        lon = start_lon + ratio_y * (end_lon - start_lon)
-        alt_abs = ALT_MIN + ratio_z * (ALT_MAX - ALT_MIN)
-        alt_rel = alt_abs  # 起飞点假设为地面
-
-        # --- 有限差分推导速度 ---
-        if i < n - 1:
-            dt = traj[i + 1][0] - t
-            if dt <= 0:
-                dt = 0.05  # 防除零
-            speed_x = (traj[i + 1][1] - tx) / dt
-            speed_y = (traj[i + 1][2] - ty) / dt
-            speed_z = (traj[i + 1][3] - tz) / dt
-        elif i > 0:
-            dt = t - traj[i - 1][0]
-            if dt <= 0:
-                dt = 0.05
-            speed_x = (tx - traj[i - 1][1]) / dt
-            speed_y = (ty - traj[i - 1][2]) / dt
-            speed_z = (tz - traj[i - 1][3]) / dt
-        else:
-            speed_x = speed_y = speed_z = 0.0
-            dt = 0.05
-
-        # --- 姿态角推导 ---
-        # 偏航角 (yaw): 水平速度方向
-        h_speed = math.sqrt(speed_x ** 2 + speed_y ** 2)
-        if h_speed > 0.01:
-            yaw = math.degrees(math.atan2(speed_y, speed_x))
-        else:
-            yaw = prev_yaw
-
-        # 俯仰角 (pitch): 爬升/下降角
-        total_h_speed = max(h_speed, 0.01)
-        pitch = math.degrees(math.atan2(speed_z, total_h_speed))
-
-        # 滚转角 (roll): 基于偏航角变化率 (转弯倾斜)
-        yaw_rate = yaw - prev_yaw
-        # 处理 ±180° 跳变
-        if yaw_rate > 180:
-            yaw_rate -= 360
-        elif yaw_rate < -180:
-            yaw_rate += 360
-        roll = max(-45, min(45, yaw_rate * ROLL_RESPONSE_COEFF))
-        prev_yaw = yaw
-
-        # --- 电量消耗模型 ---
-        v_squared = speed_x ** 2 + speed_y ** 2 + speed_z ** 2
-        battery -= BATTERY_DRAIN_COEFF * v_squared * dt
-        battery = max(battery, 5.0)  # 不低于 5%
-
-        records.append({
-            'flight_id': f"UAV_{flight_id:05d}",
-            'timestamp': round(t, 3),
-            'lat': round(lat, 7),
-            'lon': round(lon, 7),
-            'alt_abs': round(alt_abs, 2),
-            'alt_rel': round(alt_rel, 2),
-            'speed_x': round(speed_x, 4),
-            'speed_y': round(speed_y, 4),
-            'speed_z': round(speed_z, 4),
-            'roll': round(roll, 2),
-            'pitch': round(pitch, 2),
-            'yaw': round(yaw, 2),
-            'battery_rem': round(battery, 2),
-        })
-
-    return records
-
-
-def process_trajectories(raw_csv: Path, poi_path: Path, output_csv: Path):
-    """主处理流程"""
-    # 1. 加载 POI 锚点
-    anchors = load_poi_anchors(poi_path)
-    if len(anchors) < 2:
-        logger.error("POI 锚点不足 2 个，无法进行平移映射")
-        return
-
-    # 2. 读取原始 CSV
-    logger.info(f"读取原始轨迹: {raw_csv}")
     rows = []
-    with open(raw_csv, 'r', encoding='utf-8') as f:
+    if raw_path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(raw_path)
+        for batch in pf.iter_batches(columns=RAW_COLUMNS):
+            cols = [batch.column(name) for name in RAW_COLUMNS]
+            valid = ~np.any([col.is_null().to_numpy(zero_copy_only=False) for col in cols], axis=0)
+            values = [np.asarray(col.to_numpy(zero_copy_only=False), dtype=np.float64)[valid].tolist()
+                      for col in cols]
+            rows.extend(zip(*values))
+        return rows
+
+    with open(raw_path, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
         for row in reader:
             try:
@@ -248,6 +262,20 @@ def process_trajectories(raw_csv: Path, poi_path: Path, output_csv: Path):
                 ))
             except (ValueError, KeyError):
                 continue
+    return rows
+
+
+def process_trajectories(raw_csv: Path, poi_path: Path, output_csv: Path):
+    """主处理流程"""
+    # 1. 加载 POI 锚点
+    anchors = load_poi_anchors(poi_path)
+    if len(anchors) < 2:
+        logger.error("POI 锚点不足 2 个，无法进行平移映射")
+        return
+
+    # 2. 读取原始数据 (CSV 或 Parquet)
+    logger.info(f"读取原始轨迹: {raw_csv}")
+    rows = load_raw_rows(raw_csv)
 
     logger.info(f"原始数据行数: {len(rows)}")
 
@@ -256,29 +284,22 @@ def process_trajectories(raw_csv: Path, poi_path: Path, output_csv: Path):
     trajectories = split_trajectories(rows)
     logger.info(f"切分为 {len(trajectories)} 条独立轨迹")
 
-    # 4. 逐条处理
+    # 4. 按批处理 (每批 BATCH_FLIGHTS 条轨迹)
     output_csv.parent.mkdir(parents=True, exist_ok=True)
-    fieldnames = [
-        'flight_id', 'timestamp', 'lat', 'lon',
-        'alt_abs', 'alt_rel', 'speed_x', 'speed_y', 'speed_z',
-        'roll', 'pitch', 'yaw', 'battery_rem'
-    ]
-
     total_records = 0
     with open(output_csv, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
+        writer = csv.writer(f)
+        writer.writerow(OUTPUT_FIELDS)
 
-        for idx, traj in enumerate(trajectories):
-            start_anchor, end_anchor = deterministic_pair(idx, anchors)
-            records = process_single_trajectory(
-                traj, idx, start_anchor, end_anchor
-            )
-            writer.writerows(records)
-            total_records += len(records)
+        for idx in range(0, len(trajectories), BATCH_FLIGHTS):
+            batch = trajectories[idx:idx + BATCH_FLIGHTS]
+            columns = derive_trajectory_columns(batch, idx, anchors)
+            writer.writerows(format_rows(columns))
+            total_records += len(columns['timestamp'])
 
-            if (idx + 1) % 500 == 0:
-                logger.info(f"  已处理 {idx + 1}/{len(trajectories)} 条轨迹...")
+            done = idx + len(batch)
+            if done < len(trajectories):
+                logger.info(f"  已处理 {done}/{len(trajectories)} 条轨迹...")
 
     size_mb = output_csv.stat().st_size / (1024 * 1024)
     logger.info(f"✅ 轨迹处理完成: {output_csv}")
@@ -289,10 +310,36 @@ def process_trajectories(raw_csv: Path, poi_path: Path, output_csv: Path):
 
 if __name__ == "__main__":
     base = Path(__file__).resolve().parent.parent
-
-    raw_csv = base / "data" / "raw" / "uav_trajectories_raw.csv"
-    poi_path = base / "data" / "processed" / "poi_demand.geojson"
-    output_csv = base / "data" / "processed" / "uav_trajectories.csv"
+    processed_dir = base / "data" / "processed"
+
+    parser = argparse.ArgumentParser(description="UAV 轨迹数据清洗与城市映射")
+    parser.add_argument("--raw", type=str, default=None,
+                        help="原始轨迹, 默认取 data/raw/uav_trajectories_raw.parquet / .csv 中较新的一个")
+    parser.add_argument("--poi", type=str, default=None,
+                        help="需求 POI, 默认 data/processed/poi_demand.geojson (或 shenzhen/ 子目录)")
+    parser.add_argument("--output", type=str, default=None,
+                        help="输出 CSV, 默认 data/processed/trajectories/uav_trajectories.csv")
+    args = parser.parse_args()
+
+    # Parquet (fetch_uav_trajectories.py --format parquet) 与 CSV 都存在时取较新的一个，
+    # 避免旧的 Parquet 遮住重新下载的 CSV；修改时间相同时优先 Parquet
+    if args.raw:
+        raw_csv = Path(args.raw)
+    else:
+        candidates = [p for p in (base / "data" / "raw" / "uav_trajectories_raw.parquet",
+                                  base / "data" / "raw" / "uav_trajectories_raw.csv") if p.exists()]
+        raw_csv = max(candidates, key=lambda p: p.stat().st_mtime) if candidates else \
+            base / "data" / "raw" / "uav_trajectories_raw.csv"
+    if args.poi:
+        poi_path = Path(args.poi)
+    else:
+        # 深圳 POI 可能位于 processed 根目录 (process_multi_city.py 兼容输出) 或 shenzhen/ 子目录
+        poi_path = processed_dir / "poi_demand.geojson"
+        if not poi_path.exists():
+            poi_path = processed_dir / "shenzhen" / "poi_demand.geojson"
+    # 下游 (energy_model / prepare_frontend_data / 审计脚本) 均从 trajectories/ 子目录读取
+    output_csv = Path(args.output) if args.output else \
+        processed_dir / "trajectories" / "uav_trajectories.csv"
 
     if not raw_csv.exists():
         logger.error(f"❌ 原始数据不存在: {raw_csv}")
@@ -301,9 +348,10 @@ if __name__ == "__main__":
 
     if not poi_path.exists():
         logger.error(f"❌ POI 数据不存在: {poi_path}")
-        logger.info("请先运行 process_pois.py 生成需求 POI")
+        logger.info("请先运行 process_multi_city.py 生成需求 POI")
         exit(1)
 
+    output_csv.parent.mkdir(parents=True, exist_ok=True)
     logger.info("=========== 开始 UAV 轨迹清洗与城市映射 ===========")
     process_trajectories(raw_csv, poi_path, output_csv)
     logger.info("=========== 轨迹处理完成 ===========")
@@ -0,0 +1,312 @@
+"""
+run_compliance_audit.py — 多城市 × 航班分批的并行合规审计驱动脚本
+
+把 (城市, 航班批次) 作为工作单元分发到进程池，同时执行建筑碰撞审计
+(audit_building_collisions.py) 与禁飞区入侵检测 (audit_nfz_intrusions.py)，
+结果边完成边写入合并输出，并生成违规汇总。
+
+输入 (每个城市):
+  - data/processed/{city}/buildings_3d.geojson / poi_sensitive.geojson
+  - 轨迹: data/processed/trajectories/{city}/uav_trajectories.csv
+          (深圳另可使用 data/processed/trajectories/uav_trajectories.csv)
+
+输出:
+  - data/processed/audit/compliance_building_collisions.csv
+  - data/processed/audit/compliance_nfz_intrusions.csv
+  - data/processed/audit/compliance_summary.json  (violation_flights / violation_rate 等)
+
+共享方式:
+  主进程为每个城市准备一个空间索引文件 (优先用 process_multi_city.py 预构建的
+  spatial_index.sidx)，并把轨迹列写入缓存目录中的二进制文件 (spatial_index.save_arrays)；
+  worker 以只读内存映射方式打开，每个进程每个城市只加载一次，
+  任务本身只传递 (城市, 航班区间)，不序列化索引和轨迹数组。
+"""
+
+import os
+import csv
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from spatial_index import (load_trajectory_points, save_arrays, load_arrays, build_city_index,
+                           load_city_index, load_prebuilt_index, index_matches, find_city_file,
+                           CITY_INDEX_FILENAME, DEFAULT_CELL_SIZE, NFZ_RADIUS_M, DEFAULT_NFZ_RADIUS_M)
+import audit_building_collisions as building_audit
+import audit_nfz_intrusions as nfz_audit
+from cities import CITIES
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("ComplianceAudit")
+
+# 每个工作单元包含的航班数
+DEFAULT_BATCH_FLIGHTS = 500
+TRAJ_COLUMNS = ('timestamp', 'lat', 'lon', 'alt_rel')
+# 缓存文件的布局与索引构建代码 (含禁飞半径表) 所在模块，修改后缓存需重建
+SPATIAL_INDEX_CODE = Path(__file__).resolve().parent / "spatial_index.py"
+
+
+def find_city_trajectories(processed_dir: Path, city: str) -> Path:
+    """城市轨迹优先取 trajectories/{city}/，深圳兼容 trajectories/ 根目录"""
+    candidates = [processed_dir / "trajectories" / city / "uav_trajectories.csv"]
+    if city == "shenzhen":
+        candidates.append(processed_dir / "trajectories" / "uav_trajectories.csv")
+    for c in candidates:
+        if c.exists():
+            return c
+    return None
+
+
+def is_stale(target: Path, sources: list) -> bool:
+    """目标不存在或比任一源文件旧时需要重建"""
+    if not target.exists():
+        return True
+    mtime = target.stat().st_mtime
+    return any(s is not None and s.exists() and s.stat().st_mtime > mtime for s in sources)
+
+
+def cached_index_matches(index_path: Path, **config) -> bool:
+    """缓存目录中的城市索引可读且配置 (网格边长 / 禁飞半径) 与本次运行一致"""
+    try:
+        index = load_city_index(index_path)
+    except (ValueError, KeyError, OSError):
+        return False
+    return index_matches(index, **config)
+
+
+def prepare_city_index(city: str, processed_dir: Path, cache_dir: Path,
+                       cell_size: float = DEFAULT_CELL_SIZE):
+    """
+    返回城市空间索引文件路径；无任何几何数据时返回 None。
+    优先使用 process_multi_city.py 预构建的 spatial_index.sidx，过期或配置不一致时使用缓存目录中的索引；
+    缓存索引早于源数据 / 本脚本 / spatial_index.py，或网格边长、禁飞半径与本次运行不一致时重建
+    """
+    buildings_path = find_city_file(processed_dir, city, "buildings_3d.geojson")
+    poi_path = find_city_file(processed_dir, city, "poi_sensitive.geojson")
+    if not buildings_path.exists() and not poi_path.exists():
+        return None
+    source = poi_path if poi_path.exists() else buildings_path
+
+    radius = {'radius_map': NFZ_RADIUS_M, 'default_radius': DEFAULT_NFZ_RADIUS_M}
+    # 无建筑数据时索引没有建筑部分，不检查网格边长
+    config = dict(radius, cell_size=cell_size if buildings_path.exists() else None)
+    prebuilt = load_prebuilt_index(source, 'nfz' if poi_path.exists() else 'buildings', **config)
+    if prebuilt is not None:
+        return source.parent / CITY_INDEX_FILENAME
+
+    index_path = cache_dir / f"{city}_index.sidx"
+    if is_stale(index_path, [buildings_path, poi_path, Path(__file__), SPATIAL_INDEX_CODE]) or \
+            not cached_index_matches(index_path, **config):
+        build_city_index(source.parent, index_path, cell_size=cell_size, **radius)
+        logger.info(f"  索引文件: {index_path.name} ({index_path.stat().st_size / 1024:.0f} KB)")
+    return index_path
+
+
+def prepare_city_trajectories(city: str, traj_csv: Path, cache_dir: Path):
+    """把轨迹 CSV 转为可内存映射的列式缓存，返回 (路径, 航班数)"""
+    traj_path = cache_dir / f"{city}_traj.sidx"
+    if is_stale(traj_path, [traj_csv, Path(__file__), SPATIAL_INDEX_CODE]):
+        table = load_trajectory_points(traj_csv, columns=TRAJ_COLUMNS[1:])
+        arrays = {k: table[k] for k in ('flight_offsets',) + TRAJ_COLUMNS}
+        save_arrays(traj_path, arrays, {'flight_ids': [str(f) for f in table['flight_ids']]})
+    _, meta = load_arrays(traj_path)
+    return traj_path, len(meta['flight_ids'])
+
+
+# ===========================================================================
+#  Worker
+# ===========================================================================
+# 每个 worker 进程内按城市缓存已映射的索引与轨迹
+_city_cache = {}
+
+
+def _load_city(city: str, index_path: str, traj_path: str):
+    if city not in _city_cache:
+        index = load_city_index(Path(index_path), mmap=True)
+        arrays, meta = load_arrays(Path(traj_path), mmap=True)
+        arrays['flight_ids'] = np.asarray(meta['flight_ids'], dtype=object)
+        _city_cache[city] = (index, arrays)
+    return _city_cache[city]
+
+
+def _slice_table(arrays: dict, f0: int, f1: int) -> dict:
+    """截取第 [f0, f1) 个航班，偏移表重置为从 0 开始"""
+    offsets = arrays['flight_offsets']
+    a, b = int(offsets[f0]), int(offsets[f1])
+    table = {'flight_ids': arrays['flight_ids'][f0:f1],
+             'flight_offsets': np.asarray(offsets[f0:f1 + 1]) - a}
+    for k in TRAJ_COLUMNS:
+        table[k] = arrays[k][a:b]
+    return table
+
+
+def _audit_batch(task: dict):
+    """审计一个 (城市, 航班批次) 工作单元"""
+    index, arrays = _load_city(task['city'], task['index_path'], task['traj_path'])
+    table = _slice_table(arrays, task['f0'], task['f1'])
+    segment_mode = task['mode'] == "segment"
+
+    building_events, nfz_events = [], []
+    buildings = index['buildings']
+    if buildings is not None and len(buildings):
+        if segment_mode:
+            p, b, clearance, t_enter, t_exit = building_audit.detect_swept_collisions(
+                table, buildings, task['margin'])
+            building_events = building_audit.collision_segments(
+                table, buildings, p, b, clearance, t_enter, t_exit)
+        else:
+            p, b, clearance = building_audit.detect_point_collisions(table, buildings, task['margin'])
+            building_events = building_audit.collision_segments(table, buildings, p, b, clearance)
+
+    if index['nfz'] is not None and len(index['nfz']):
+        args = (table, index['pois'], index['proj'], index['nfz'], task['ceiling'])
+        if segment_mode:
+            p, i, dist, t_in, t_out = nfz_audit.detect_swept_intrusions(*args)
+            nfz_events = nfz_audit.intrusion_events(table, index['pois'], p, i, dist, t_in, t_out)
+        else:
+            p, i, dist = nfz_audit.detect_intrusions(*args)
+            nfz_events = nfz_audit.intrusion_events(table, index['pois'], p, i, dist)
+
+    return {'city': task['city'], 'flights': task['f1'] - task['f0'],
+            'points': len(table['timestamp']),
+            'building_events': building_events, 'nfz_events': nfz_events}
+
+
+# ===========================================================================
+#  主流程
+# ===========================================================================
+def run_audit(cities: list, processed_dir: Path, output_dir: Path, traj_overrides: dict = None,
+              batch_flights: int = DEFAULT_BATCH_FLIGHTS, workers: int = 1, mode: str = "point",
+              margin_m: float = building_audit.DEFAULT_MARGIN_M,
+              ceiling_m: float = nfz_audit.NFZ_CEILING_M, cell_size: float = DEFAULT_CELL_SIZE):
+    t0 = time.perf_counter()
+    cache_dir = output_dir / "_cache"
+    traj_overrides = traj_overrides or {}
+
+    # 1. 主进程准备每个城市的索引文件与轨迹缓存，并切分工作单元
+    tasks = []
+    summary = {}
+    for city in cities:
+        traj_csv = traj_overrides.get(city) or find_city_trajectories(processed_dir, city)
+        if traj_csv is None or not Path(traj_csv).exists():
+            logger.warning(f"  ⚠️  {city}: 无轨迹数据，跳过")
+            continue
+        index_path = prepare_city_index(city, processed_dir, cache_dir, cell_size)
+        if index_path is None:
+            logger.warning(f"  ⚠️  {city}: 无建筑与敏感 POI 数据，跳过")
+            continue
+        traj_path, n_flights = prepare_city_trajectories(city, Path(traj_csv), cache_dir)
+        summary[city] = {'flights': n_flights, 'points': 0,
+                         'building_violation_flights': set(), 'nfz_violation_flights': set()}
+        for f0 in range(0, n_flights, batch_flights):
+            tasks.append({'city': city, 'index_path': str(index_path), 'traj_path': str(traj_path),
+                          'f0': f0, 'f1': min(f0 + batch_flights, n_flights),
+                          'mode': mode, 'margin': margin_m, 'ceiling': ceiling_m})
+        logger.info(f"  {city}: {n_flights} 条航班 → {-(-n_flights // batch_flights)} 个工作单元")
+    t1 = time.perf_counter()
+
+    # 2. 并行执行，结果边完成边写入合并输出
+    output_dir.mkdir(parents=True, exist_ok=True)
+    b_csv = output_dir / "compliance_building_collisions.csv"
+    z_csv = output_dir / "compliance_nfz_intrusions.csv"
+    with open(b_csv, 'w', newline='', encoding='utf-8') as fb, \
+            open(z_csv, 'w', newline='', encoding='utf-8') as fz:
+        b_writer = csv.DictWriter(fb, fieldnames=['city'] + building_audit.SEGMENT_FIELDS)
+        z_writer = csv.DictWriter(fz, fieldnames=['city'] + nfz_audit.EVENT_FIELDS)
+        b_writer.writeheader()
+        z_writer.writeheader()
+
+        def consume(result):
+            city = result['city']
+            stats = summary[city]
+            stats['points'] += result['points']
+            for e in result['building_events']:
+                b_writer.writerow({'city': city, **e})
+                stats['building_violation_flights'].add(e['flight_id'])
+            for e in result['nfz_events']:
+                z_writer.writerow({'city': city, **e})
+                stats['nfz_violation_flights'].add(e['flight_id'])
+
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_audit_batch, t) for t in tasks]
+                for done, fut in enumerate(as_completed(futures), 1):
+                    consume(fut.result())
+                    if done % 10 == 0 or done == len(futures):
+                        logger.info(f"  已完成 {done}/{len(futures)} 个工作单元")
+        else:
+            for t in tasks:
+                consume(_audit_batch(t))
+    t2 = time.perf_counter()
+
+    # 3. 汇总
+    report = {'mode': mode, 'cities': {}}
+    total_flights = total_violations = 0
+    for city, stats in summary.items():
+        b_set, z_set = stats['building_violation_flights'], stats['nfz_violation_flights']
+        violations = len(b_set | z_set)
+        report['cities'][city] = {
+            'flights': stats['flights'],
+            'points': stats['points'],
+            'building_violation_flights': len(b_set),
+            'nfz_violation_flights': len(z_set),
+            'violation_flights': violations,
+            'violation_rate': round(violations / max(stats['flights'], 1), 4),
+        }
+        total_flights += stats['flights']
+        total_violations += violations
+    report['total'] = {
+        'flights': total_flights,
+        'violation_flights': total_violations,
+        'violation_rate': round(total_violations / max(total_flights, 1), 4),
+        'work_units': len(tasks),
+        'workers': workers,
+        'prepare_seconds': round(t1 - t0, 2),
+        'audit_seconds': round(t2 - t1, 2),
+    }
+    summary_json = output_dir / "compliance_summary.json"
+    with open(summary_json, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for city, r in report['cities'].items():
+        logger.info(f"  {city}: 违规航班 {r['violation_flights']} / {r['flights']} "
+                    f"({r['violation_rate'] * 100:.1f}%) [建筑 {r['building_violation_flights']}, "
+                    f"禁飞区 {r['nfz_violation_flights']}]")
+    logger.info(f"✅ 审计完成: {summary_json}")
+    logger.info(f"   耗时: 准备 {t1 - t0:.2f}s | 审计 {t2 - t1:.2f}s ({len(tasks)} 个工作单元, {workers} 进程)")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多城市并行合规审计")
+    parser.add_argument("--cities", type=str, default="all", help="审计的城市, 逗号分隔或'all'")
+    parser.add_argument("--trajectories", type=str, default="",
+                        help="指定城市轨迹, 形如 chongqing=path/a.csv,shenzhen=path/b.csv")
+    parser.add_argument("--batch-flights", type=int, default=DEFAULT_BATCH_FLIGHTS,
+                        help="每个工作单元的航班数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument("--mode", type=str, choices=["point", "segment"], default="point",
+                        help="point: 逐采样点检查; segment: 检查相邻采样点之间的线段 (扫掠)")
+    parser.add_argument("--margin", type=float, default=building_audit.DEFAULT_MARGIN_M,
+                        help="楼顶安全余量 (米)")
+    parser.add_argument("--ceiling", type=float, default=nfz_audit.NFZ_CEILING_M,
+                        help="禁飞区高度上限 (米)")
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent.parent
+    processed_dir = base / "data" / "processed"
+    cities = CITIES if args.cities.lower() == "all" else [c.strip() for c in args.cities.split(",")]
+    overrides = dict(item.split("=", 1) for item in args.trajectories.split(",") if "=" in item)
+
+    logger.info("=========== 开始多城市合规审计 ===========")
+    run_audit(cities, processed_dir, processed_dir / "audit", traj_overrides=overrides,
+              batch_flights=max(1, args.batch_flights), workers=max(1, args.workers),
+              mode=args.mode, margin_m=args.margin, ceiling_m=args.ceiling)
+    logger.info("=========== 审计完成 ===========")
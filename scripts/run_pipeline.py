@@ -0,0 +1,494 @@
+"""
+run_pipeline.py — 数据处理流水线统一入口 (依赖感知缓存 + 并发执行)
+
+把各脚本声明为 DAG 中的阶段 (STAGES)，每个阶段列出脚本、参数、输入、输出与上游阶段:
+
+  fetch_multi_city_data ──▶ process_multi_city ──┬──▶ process_trajectories ──┬──▶ energy_model
+  fetch_uav_trajectories ───────────────────────┘            │              ├──▶ prepare_frontend_data
+  fetch_flight_datasets ──▶ process_airlab_energy ───────────┼──────────────┘
+                            process_multi_city ──▶ generate_vector_tiles     ├──▶ run_compliance_audit
+                                                                             ├──▶ audit_separation
+                                                                             ├──▶ airspace_density
+                                                                             └──▶ energy_risk
+                            process_airlab_energy ──▶ energy_features ──▶ energy_model, energy_risk
+
+输入:
+  - 各阶段声明的输入文件 (glob 模式，目录则递归包含其中全部文件) 与脚本源码
+
+输出:
+  - 各阶段脚本自身的输出
+  - data/processed/pipeline/state.json       每个阶段上次成功运行时的输入/输出摘要 + 文件摘要缓存
+  - data/processed/pipeline/logs/{stage}.log 各阶段的标准输出与错误输出
+  - data/processed/pipeline/timing_report.csv 各阶段耗时、起止时刻、松弛时间与是否位于关键路径
+
+算法:
+  1. 阶段指纹 = SHA-1(脚本源码摘要, 参数, 每个输入文件的相对路径与内容摘要)；
+     文件大小与 mtime 未变时复用缓存的内容摘要，不重读文件
+  2. 指纹与上次成功运行一致、且输出文件仍与记录一致时跳过该阶段 (上游重新生成的输出
+     会改变下游的输入摘要，从而只让真正受影响的下游重跑)
+  3. requires 中的输入缺失 (如原始数据未下载) 而输出已存在时沿用已有输出 (kept)
+  4. 所有上游结束后阶段即可调度，线程池并发启动子进程 (如 AirLab 处理与多城市处理)
+  5. 按实际耗时在 DAG 上求最长路径，输出关键路径与各阶段松弛时间
+
+fetch_* 阶段需要联网，默认视为数据源不执行，--fetch 时才纳入流水线
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import logging
+import argparse
+import subprocess
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("Pipeline")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SCRIPTS_DIR = BASE_DIR / "scripts"
+PIPELINE_DIR = BASE_DIR / "data" / "processed" / "pipeline"
+STATE_FILE = PIPELINE_DIR / "state.json"
+LOG_DIR = PIPELINE_DIR / "logs"
+REPORT_FILE = PIPELINE_DIR / "timing_report.csv"
+
+# 读文件计算摘要的块大小
+HASH_CHUNK_BYTES = 1 << 20
+# 阶段失败时在终端回显的日志尾部行数
+FAILED_LOG_TAIL_LINES = 20
+
+# ===========================================================================
+#  阶段声明: 路径均相对仓库根目录，支持 glob；code 为脚本导入的同目录模块，
+#  requires 中的每个模式至少要匹配一个文件 (缺失时沿用已有输出, 不运行脚本)；
+#  脚本在 scripts/ 下运行，args 中不要传仓库相对路径 (输出路径用脚本默认值)
+# ===========================================================================
+CITY_OUTPUTS = [
+    "data/processed/poi_*.geojson",
+    "data/processed/*/poi_*.geojson",
+    "data/processed/*/buildings_3d.geojson",
+    "data/processed/*/spatial_index.sidx",
+]
+TRAJECTORIES_CSV = "data/processed/trajectories/uav_trajectories.csv"
+
+STAGES = {
+    "fetch_multi_city_data": {
+        "script": "fetch_multi_city_data.py", "args": [], "deps": [], "network": True,
+        "inputs": [],
+        "outputs": ["data/raw/*_raw.json", "data/raw/*/*_raw.json"],
+    },
+    "fetch_flight_datasets": {
+        "script": "fetch_flight_datasets.py", "args": [], "deps": [], "network": True,
+        "inputs": [],
+        "outputs": ["data/raw/airlab_energy/data"],
+    },
+    "fetch_uav_trajectories": {
+        "script": "fetch_uav_trajectories.py", "args": [], "deps": [], "network": True,
+        "inputs": [],
+        "outputs": ["data/raw/uav_trajectories_raw.*"],
+    },
+    "process_multi_city": {
+        "script": "process_multi_city.py", "args": [],
+        "deps": ["fetch_multi_city_data"],
+        "code": ["spatial_index.py", "cities.py"],
+        "inputs": ["data/raw/*_raw.json", "data/raw/*/*_raw.json"],
+        "requires": ["data/raw/**/*_raw.json"],
+        "outputs": CITY_OUTPUTS,
+    },
+    "process_airlab_energy": {
+        "script": "process_airlab_energy.py", "args": [],
+        "deps": ["fetch_flight_datasets"],
+        "inputs": ["data/raw/airlab_energy/data"],
+        "requires": ["data/raw/airlab_energy/data/*/processed.csv"],
+        "outputs": ["data/processed/airlab_energy/flights_summary.csv",
+                    "data/processed/airlab_energy/flights_detail.csv"],
+    },
+    "process_trajectories": {
+        "script": "process_trajectories.py", "args": [],
+        "deps": ["fetch_uav_trajectories", "process_multi_city"],
+        "code": ["spatial_index.py", "segment_ops.py"],
+        "inputs": ["data/raw/uav_trajectories_raw.*",
+                   "data/processed/poi_demand.geojson",
+                   "data/processed/shenzhen/poi_demand.geojson"],
+        "requires": ["data/raw/uav_trajectories_raw.*", "data/processed/**/poi_demand.geojson"],
+        "outputs": [TRAJECTORIES_CSV],
+    },
+    "energy_features": {
+        "script": "energy_features.py", "args": [],
+        "deps": ["process_airlab_energy"],
+        "code": ["segment_ops.py"],
+        "inputs": ["data/processed/airlab_energy/flights_detail.csv"],
+        "requires": ["data/processed/airlab_energy/flights_detail.csv"],
+        "outputs": ["data/processed/airlab_energy/features/*"],
+    },
+    "energy_model": {
+        "script": "energy_model.py", "args": [],
+        "deps": ["energy_features", "process_trajectories"],
+        "code": ["segment_ops.py", "energy_features.py"],
+        "inputs": ["data/processed/airlab_energy/flights_detail.csv",
+                   "data/processed/airlab_energy/features/*", TRAJECTORIES_CSV],
+        "requires": ["data/processed/airlab_energy/flights_detail.csv", TRAJECTORIES_CSV],
+        "outputs": ["data/processed/energy_predictions.json"],
+    },
+    "energy_risk": {
+        "script": "energy_model.py", "args": ["--mode", "evaluate"],
+        "deps": ["energy_features", "process_trajectories"],
+        "code": ["segment_ops.py", "energy_features.py"],
+        "inputs": ["data/processed/airlab_energy/flights_detail.csv",
+                   "data/processed/airlab_energy/features/*", TRAJECTORIES_CSV],
+        "requires": ["data/processed/airlab_energy/flights_detail.csv", TRAJECTORIES_CSV],
+        "outputs": ["data/processed/energy_risk.csv"],
+    },
+    "prepare_frontend_data": {
+        "script": "prepare_frontend_data.py", "args": [],
+        "deps": ["process_trajectories"],
+        "code": ["spatial_index.py"],
+        "inputs": [TRAJECTORIES_CSV],
+        "requires": [TRAJECTORIES_CSV],
+        "outputs": ["frontend/public/data/processed/trajectories/uav_trajectories.json",
+                    "frontend/public/data/processed/trajectories/uav_trajectories_intervals.json"],
+    },
+    "audit_separation": {
+        "script": "audit_separation.py", "args": [],
+        "deps": ["process_trajectories"],
+        "code": ["spatial_index.py"],
+        "inputs": [TRAJECTORIES_CSV],
+        "requires": [TRAJECTORIES_CSV],
+        "outputs": ["data/processed/audit/separation_conflicts.csv"],
+    },
+    "airspace_density": {
+        "script": "airspace_density.py", "args": [],
+        "deps": ["process_trajectories"],
+        "code": ["spatial_index.py"],
+        "inputs": [TRAJECTORIES_CSV],
+        "requires": [TRAJECTORIES_CSV],
+        "outputs": ["data/processed/airspace/density.sidx",
+                    "data/processed/airspace/density_summary.csv",
+                    "frontend/public/data/processed/airspace/density.json"],
+    },
+    "generate_vector_tiles": {
+        "script": "generate_vector_tiles.py", "args": [],
+        "deps": ["process_multi_city"],
+        "code": ["spatial_index.py", "cities.py"],
+        "inputs": ["data/processed/*/buildings_3d.geojson", "data/processed/*/poi_*.geojson",
+                   "data/processed/poi_*.geojson"],
+        "requires": ["data/processed/**/poi_*.geojson"],
+        "outputs": ["frontend/public/data/tiles"],
+    },
+    "run_compliance_audit": {
+        "script": "run_compliance_audit.py", "args": [],
+        "deps": ["process_multi_city", "process_trajectories"],
+        "code": ["spatial_index.py", "audit_building_collisions.py", "audit_nfz_intrusions.py",
+                 "cities.py"],
+        "inputs": CITY_OUTPUTS + ["data/processed/trajectories/*/uav_trajectories.csv",
+                                  TRAJECTORIES_CSV],
+        "requires": ["data/processed/trajectories/**/uav_trajectories.csv"],
+        "outputs": ["data/processed/audit/compliance_*"],
+    },
+}
+
+
+# ===========================================================================
+#  文件摘要 (带 size + mtime 缓存)
+# ===========================================================================
+class DigestCache:
+    """相对路径 → [size, mtime_ns, sha1]；大小与修改时间不变时直接复用摘要"""
+
+    def __init__(self, entries: dict = None):
+        self.entries = dict(entries or {})
+        self.lock = threading.Lock()
+
+    def digest(self, path: Path) -> str:
+        rel = path.relative_to(BASE_DIR).as_posix()
+        st = path.stat()
+        with self.lock:
+            cached = self.entries.get(rel)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+                h.update(chunk)
+        with self.lock:
+            self.entries[rel] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+
+def expand_patterns(patterns: list) -> list:
+    """glob 模式 → 排序后的文件列表 (目录递归展开)"""
+    files = set()
+    for pattern in patterns:
+        for p in BASE_DIR.glob(pattern):
+            if p.is_dir():
+                files.update(q for q in p.rglob('*') if q.is_file())
+            elif p.is_file():
+                files.add(p)
+    return sorted(files)
+
+
+def snapshot(patterns: list, cache: DigestCache) -> dict:
+    """{相对路径: sha1}"""
+    return {p.relative_to(BASE_DIR).as_posix(): cache.digest(p) for p in expand_patterns(patterns)}
+
+
+def stage_fingerprint(name: str, cache: DigestCache) -> dict:
+    stage = STAGES[name]
+    code = [stage["script"]] + stage.get("code", [])
+    return {
+        "code": {c: cache.digest(SCRIPTS_DIR / c) for c in code},
+        "args": list(stage["args"]),
+        "inputs": snapshot(stage["inputs"], cache),
+    }
+
+
+def fingerprint_key(fp: dict) -> str:
+    return hashlib.sha1(json.dumps(fp, sort_keys=True).encode()).hexdigest()
+
+
+def stale_reason(name: str, fp: dict, record: dict, cache: DigestCache):
+    """阶段需要重跑的原因；已是最新时返回 None"""
+    if not record:
+        return "无成功运行记录"
+    if fingerprint_key(fp) == record.get("fingerprint"):
+        outputs = snapshot(STAGES[name]["outputs"], cache)
+        if not outputs:
+            return "输出缺失"
+        if outputs != record.get("outputs"):
+            return "输出被修改或删除"
+        return None
+    old = record.get("detail", {})
+    if fp["code"] != old.get("code"):
+        return "脚本变更"
+    if fp["args"] != old.get("args"):
+        return "参数变更"
+    old_inputs = old.get("inputs", {})
+    changed = sorted(k for k in set(fp["inputs"]) | set(old_inputs)
+                     if fp["inputs"].get(k) != old_inputs.get(k))
+    more = f" 等 {len(changed)} 个" if len(changed) > 1 else ""
+    return f"输入变更: {changed[0]}{more}" if changed else "指纹变更"
+
+
+# ===========================================================================
+#  DAG 与调度
+# ===========================================================================
+def select_stages(targets: list, include_network: bool) -> list:
+    """目标阶段及其全部上游 (按 STAGES 声明顺序)；未启用 --fetch 时去掉联网阶段"""
+    selected, stack = set(), list(targets)
+    while stack:
+        name = stack.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        stack.extend(STAGES[name]["deps"])
+    return [s for s in STAGES if s in selected and (include_network or not STAGES[s].get("network"))]
+
+
+def run_stage(name: str, state: dict, cache: DigestCache, force: bool, dry_run: bool) -> dict:
+    """检查指纹并在需要时以子进程运行脚本；返回 {status, reason, start, end}"""
+    start = time.perf_counter()
+    stage = STAGES[name]
+    missing = [p for p in stage.get("requires", []) if not expand_patterns([p])]
+    if missing:
+        # 原始数据不在本地 (如未下载) 时沿用已有输出，下游照常运行
+        status = "kept" if expand_patterns(stage["outputs"]) else "failed"
+        if status == "failed":
+            logger.error(f"❌ {name}: 缺少输入 {', '.join(missing)}，且没有已有输出")
+        return {"status": status, "reason": f"缺少输入 {', '.join(missing)}",
+                "start": start, "end": time.perf_counter()}
+    fp = stage_fingerprint(name, cache)
+    reason = "--force" if force else stale_reason(name, fp, state["stages"].get(name), cache)
+    if reason is None or dry_run:
+        status = "cached" if reason is None else "stale"
+        return {"status": status, "reason": reason or "", "start": start, "end": time.perf_counter()}
+
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    log_path = LOG_DIR / f"{name}.log"
+    logger.info(f"▶️  {name}: {reason}")
+    with open(log_path, 'w', encoding='utf-8') as log:
+        proc = subprocess.run([sys.executable, stage["script"], *stage["args"]],
+                              cwd=SCRIPTS_DIR, stdout=log, stderr=subprocess.STDOUT)
+    end = time.perf_counter()
+
+    outputs = snapshot(stage["outputs"], cache)
+    if proc.returncode != 0 or not outputs:
+        detail = f"退出码 {proc.returncode}" if proc.returncode != 0 else "未生成任何输出"
+        tail = log_path.read_text(encoding='utf-8', errors='replace').splitlines()[-FAILED_LOG_TAIL_LINES:]
+        logger.error(f"❌ {name} 失败 ({detail})，日志: {log_path}")
+        for line in tail:
+            logger.error(f"   | {line}")
+        return {"status": "failed", "reason": detail, "start": start, "end": end}
+
+    # 输入在运行前取摘要: 若运行期间输入被改动，下次会按变更重跑
+    state["stages"][name] = {
+        "fingerprint": fingerprint_key(fp), "detail": fp, "outputs": outputs,
+        "duration_s": round(end - start, 3), "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    logger.info(f"✅ {name} 完成 ({end - start:.1f}s, {len(outputs)} 个输出文件)")
+    return {"status": "ran", "reason": reason, "start": start, "end": end}
+
+
+def run_pipeline(stages: list, workers: int, force: bool = False, dry_run: bool = False) -> dict:
+    """按依赖并发调度阶段；上游失败的阶段标记为 blocked"""
+    state = load_state()
+    cache = DigestCache(state.get("files"))
+    results, running = {}, {}
+    pending = list(stages)
+    t0 = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name in list(pending):
+                deps = [d for d in STAGES[name]["deps"] if d in stages]
+                if any(d not in results for d in deps):
+                    continue
+                pending.remove(name)
+                bad = [d for d in deps if results[d]["status"] in ("failed", "blocked")]
+                if bad:
+                    now = time.perf_counter()
+                    results[name] = {"status": "blocked", "reason": f"上游失败: {', '.join(bad)}",
+                                     "start": now, "end": now}
+                elif dry_run and any(results[d]["status"] == "stale" for d in deps):
+                    # 预演模式下上游会重跑，下游的输入届时才确定
+                    now = time.perf_counter()
+                    results[name] = {"status": "stale", "reason": "上游将重跑", "start": now, "end": now}
+                else:
+                    running[pool.submit(run_stage, name, state, cache, force, dry_run)] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    if not dry_run:
+        state["files"] = cache.entries
+        save_state(state)
+    for r in results.values():
+        r["start"] -= t0
+        r["end"] -= t0
+    return results
+
+
+def load_state() -> dict:
+    if STATE_FILE.exists():
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"stages": {}, "files": {}}
+
+
+def save_state(state: dict):
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_FILE.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, STATE_FILE)
+
+
+# ===========================================================================
+#  关键路径报告
+# ===========================================================================
+def critical_path(stages: list, results: dict):
+    """
+    以各阶段实际耗时为权求 DAG 最长路径。
+    返回 (路径, 路径总耗时, {阶段: 松弛时间})
+    """
+    dur = {s: results[s]["end"] - results[s]["start"] for s in stages}
+    deps = {s: [d for d in STAGES[s]["deps"] if d in results] for s in stages}
+    finish, prev = {}, {}
+    for s in stages:  # STAGES 声明顺序即拓扑序
+        best = max(deps[s], key=lambda d: finish[d], default=None)
+        prev[s] = best
+        finish[s] = dur[s] + (finish[best] if best else 0.0)
+    # 反向: 从阶段开始到流水线结束的最长耗时
+    tail = {}
+    for s in reversed(stages):
+        children = [c for c in stages if s in deps[c]]
+        tail[s] = dur[s] + max((tail[c] for c in children), default=0.0)
+    total = max(finish.values(), default=0.0)
+    slack = {s: total - (finish[s] - dur[s] + tail[s]) for s in stages}
+
+    path, s = [], max(finish, key=finish.get) if finish else None
+    while s:
+        path.append(s)
+        s = prev[s]
+    return path[::-1], total, slack
+
+
+def report(stages: list, results: dict, report_path: Path = None):
+    path, total, slack = critical_path(stages, results)
+    on_path = set(path)
+    rows = []
+    logger.info("-" * 78)
+    logger.info(f"{'阶段':<24}{'状态':<9}{'开始':>8}{'结束':>8}{'耗时':>8}{'松弛':>8}  原因")
+    for s in stages:
+        r = results[s]
+        dur = r["end"] - r["start"]
+        mark = "*" if s in on_path else " "
+        logger.info(f"{mark}{s:<23}{r['status']:<9}{r['start']:>7.1f}s{r['end']:>7.1f}s"
+                    f"{dur:>7.1f}s{slack[s]:>7.1f}s  {r['reason']}")
+        rows.append({'stage': s, 'status': r['status'], 'start_s': round(r['start'], 3),
+                     'end_s': round(r['end'], 3), 'duration_s': round(dur, 3),
+                     'slack_s': round(slack[s], 3), 'critical': int(s in on_path),
+                     'reason': r['reason']})
+    wall = max((r["end"] for r in results.values()), default=0.0)
+    busy = sum(r["end"] - r["start"] for r in results.values())
+    logger.info("-" * 78)
+    logger.info(f"关键路径 (*): {' → '.join(path)} = {total:.1f}s")
+    logger.info(f"墙钟耗时 {wall:.1f}s, 阶段耗时合计 {busy:.1f}s")
+
+    if report_path is not None:
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ['stage'])
+            writer.writeheader()
+            writer.writerows(rows)
+        logger.info(f"📊 耗时报告: {report_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据处理流水线 (依赖感知缓存 + 并发执行)")
+    parser.add_argument("--stages", type=str, default="all",
+                        help="目标阶段, 逗号分隔或'all' (自动包含其上游)")
+    parser.add_argument("--fetch", action="store_true", default=False,
+                        help="包含需要联网的 fetch_* 阶段")
+    parser.add_argument("--force", action="store_true", default=False,
+                        help="忽略缓存, 重跑所选阶段")
+    parser.add_argument("--dry-run", action="store_true", default=False,
+                        help="只检查各阶段是否最新, 不执行")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="同时运行的阶段数")
+    parser.add_argument("--list", action="store_true", default=False, help="列出全部阶段后退出")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, stage in STAGES.items():
+            net = " (联网)" if stage.get("network") else ""
+            logger.info(f"{name}{net}: {stage['script']} ← {', '.join(stage['deps']) or '-'}")
+        sys.exit(0)
+
+    targets = list(STAGES) if args.stages.lower() == "all" else \
+        [s.strip() for s in args.stages.split(",")]
+    unknown = [s for s in targets if s not in STAGES]
+    if unknown:
+        logger.error(f"❌ 未知阶段: {', '.join(unknown)} (可用: {', '.join(STAGES)})")
+        sys.exit(1)
+    stages = select_stages(targets, args.fetch)
+    if not stages:
+        logger.error("❌ 没有可执行的阶段 (fetch_* 阶段需要 --fetch)")
+        sys.exit(1)
+
+    logger.info("=========== 开始运行流水线 ===========")
+    logger.info(f"阶段: {', '.join(stages)} (并发 {max(1, args.workers)})")
+    results = run_pipeline(stages, max(1, args.workers), force=args.force, dry_run=args.dry_run)
+    report(stages, results, None if args.dry_run else REPORT_FILE)
+
+    failed = [s for s, r in results.items() if r["status"] in ("failed", "blocked")]
+    if failed:
+        logger.error(f"❌ 未完成的阶段: {', '.join(failed)}")
+        sys.exit(1)
+    logger.info("=========== 流水线完成 ===========")
@@ -0,0 +1,240 @@
+"""
+segment_ops.py — 不等长分段 (ragged) 数组的向量化分段运算
+
+轨迹、能耗等数据都是"按航班连续存放的扁平数组 + 偏移量"：第 f 段位于
+[offsets[f], offsets[f+1])。本模块提供在这种布局上的分段算子，全部是一次 NumPy 调用
+(reduceat / cumsum / 索引)，代替 pandas groupby 或逐航班的 Python 循环。
+
+约定:
+  - offsets: int64[F+1]，offsets[0] == 0，单调不减，offsets[-1] == 数组长度
+  - 逐点结果与输入等长；逐段结果长度为 F
+  - 空段的逐段归约结果取 empty 参数 (默认 NaN)
+
+算子:
+  segment_offsets   连续相同键 → (键, offsets)
+  segment_ids       每个点所属段号
+  seg_diff          段内相邻差分，段首取 fill 或相对 prepend 的差
+  seg_cumsum        段内累加 (全局 cumsum 减去段基数)
+  seg_sum / seg_min / seg_max / seg_first / seg_last   逐段归约
+  seg_first_index   段内第一个 mask 为真的位置
+  seg_ffill         段内向前填充 (段首之前无有效值时取 initial)
+  seg_shift         段内滞后 lag 个点 (段首前 lag 个点取 fill)
+  seg_rolling_sum / seg_rolling_mean / seg_rolling_std   段内尾随窗口 (段首不足窗口时取已有点)
+  seg_trapezoid / seg_cumtrapz   段内梯形积分 (总量 / 逐点累计)
+"""
+
+import numpy as np
+
+# 尾随窗口不超过此长度时逐滞后直接累加，更长时用前缀和
+ROLLING_DIRECT_MAX = 64
+
+
+def segment_offsets(keys):
+    """连续相同键的分段: 返回 (每段的键, offsets[F+1])。键须已按段连续存放"""
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return keys[:0], np.zeros(1, dtype=np.int64)
+    change = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = np.concatenate([[0], change]).astype(np.int64)
+    return keys[starts], np.append(starts, len(keys))
+
+
+def segment_ids(offsets):
+    """每个点所属的段号 int64[N]"""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+
+
+def _starts_nonempty(offsets):
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = offsets[:-1]
+    nonempty = offsets[1:] > starts
+    return starts, nonempty
+
+
+def _reduce(ufunc, values, offsets, empty):
+    values = np.asarray(values)
+    starts, nonempty = _starts_nonempty(offsets)
+    if nonempty.all():
+        return ufunc.reduceat(values, starts) if len(starts) else values[:0]
+    dtype = np.result_type(values.dtype, np.asarray(empty).dtype)
+    out = np.full(len(starts), empty, dtype=dtype)
+    if nonempty.any():
+        out[nonempty] = ufunc.reduceat(values, starts[nonempty])
+    return out
+
+
+def seg_diff(values, offsets, fill=np.nan, prepend=None):
+    """
+    段内差分 values[i] - values[i-1]。
+    段首: prepend 为 None 时取 fill (与 groupby().diff().fillna(fill) 一致)，否则取 values[首] - prepend
+    """
+    values = np.asarray(values)
+    out = np.empty(len(values), dtype=np.result_type(values.dtype, np.float64))
+    if len(values) == 0:
+        return out
+    out[0] = 0.0
+    np.subtract(values[1:], values[:-1], out=out[1:])
+    starts, nonempty = _starts_nonempty(offsets)
+    starts = starts[nonempty]
+    out[starts] = fill if prepend is None else values[starts] - prepend
+    return out
+
+
+def seg_cumsum(values, offsets):
+    """
+    段内累加。一次全局 cumsum 再减去各段之前的累计值；
+    与逐段顺序累加相比只有末位舍入差异 (量级为全局累计值 × 机器精度)
+    """
+    values = np.asarray(values)
+    csum = np.cumsum(values)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    base = np.concatenate([np.zeros(1, dtype=csum.dtype), csum])[offsets[:-1]]
+    return csum - np.repeat(base, np.diff(offsets))
+
+
+def seg_sum(values, offsets, empty=0.0):
+    return _reduce(np.add, values, offsets, empty)
+
+
+def seg_min(values, offsets, empty=np.nan):
+    return _reduce(np.minimum, values, offsets, empty)
+
+
+def seg_max(values, offsets, empty=np.nan):
+    return _reduce(np.maximum, values, offsets, empty)
+
+
+def seg_first(values, offsets, empty=np.nan):
+    """每段第一个值"""
+    values = np.asarray(values)
+    starts, nonempty = _starts_nonempty(offsets)
+    if nonempty.all():
+        return values[starts]
+    return np.where(nonempty, values[np.minimum(starts, max(len(values) - 1, 0))], empty)
+
+
+def seg_last(values, offsets, empty=np.nan):
+    """每段最后一个值"""
+    values = np.asarray(values)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, nonempty = _starts_nonempty(offsets)
+    ends = offsets[1:] - 1
+    if nonempty.all():
+        return values[ends]
+    return np.where(nonempty, values[np.maximum(ends, 0)], empty)
+
+
+def seg_first_index(mask, offsets):
+    """每段第一个 mask 为真的全局下标；段内没有时为 -1"""
+    mask = np.asarray(mask, dtype=bool)
+    n = len(mask)
+    idx = np.where(mask, np.arange(n, dtype=np.int64), n)
+    first = _reduce(np.minimum, idx, offsets, n).astype(np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return np.where(first < offsets[1:], first, -1)
+
+
+def seg_ffill(values, valid, offsets, initial=np.nan):
+    """段内向前填充: 无效位置取本段此前最近的有效值，段首之前没有有效值时取 initial"""
+    values = np.asarray(values)
+    n = len(values)
+    last = np.maximum.accumulate(np.where(valid, np.arange(n, dtype=np.int64), -1)) if n else \
+        np.zeros(0, dtype=np.int64)
+    start = np.repeat(np.asarray(offsets, dtype=np.int64)[:-1], np.diff(offsets))
+    has = last >= start
+    return np.where(has, values[np.maximum(last, 0)], initial)
+
+
+def seg_shift(values, offsets, lag=1, fill=np.nan):
+    """段内滞后: out[i] = values[i - lag]，段内前 lag 个点取 fill"""
+    values = np.asarray(values)
+    n = len(values)
+    src = np.arange(n, dtype=np.int64) - lag
+    start = np.repeat(np.asarray(offsets, dtype=np.int64)[:-1], np.diff(offsets))
+    valid = src >= start
+    out = np.full(n, fill, dtype=np.result_type(values.dtype, np.asarray(fill).dtype))
+    out[valid] = values[src[valid]]
+    return out
+
+
+def _rolling_bounds(offsets, window):
+    """尾随窗口 [lo, i] 的起点 lo 与点数"""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    idx = np.arange(offsets[-1], dtype=np.int64)
+    start = np.repeat(offsets[:-1], np.diff(offsets))
+    lo = np.maximum(idx - window + 1, start)
+    return idx, lo, idx - lo + 1
+
+
+def _rolling_direct(deviation, values, lo, window):
+    """窗口较短时逐个滞后累加 deviation(values[i-k], values[i])，O(N × window)"""
+    idx = np.arange(len(values), dtype=np.int64)
+    total = np.zeros(len(values))
+    sq_total = np.zeros(len(values))
+    for k in range(window):
+        src = idx - k
+        valid = src >= lo
+        d = deviation(values[src[valid]], values[valid])
+        total[valid] += d
+        sq_total[valid] += d * d
+    return total, sq_total
+
+
+def seg_rolling_sum(values, offsets, window):
+    """
+    段内尾随 window 个点之和，返回 (sums, counts)。
+    window <= ROLLING_DIRECT_MAX 时逐滞后直接累加 (误差只与窗口内的值有关)，
+    否则用全局前缀和相减 (O(N)，误差量级为全局累计值 × 机器精度)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    idx, lo, counts = _rolling_bounds(offsets, window)
+    if window <= ROLLING_DIRECT_MAX:
+        sums, _ = _rolling_direct(lambda v, _: v, values, lo, window)
+        return sums, counts
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    return csum[idx + 1] - csum[lo], counts
+
+
+def seg_rolling_mean(values, offsets, window):
+    sums, counts = seg_rolling_sum(values, offsets, window)
+    return sums / counts
+
+
+def seg_rolling_std(values, offsets, window):
+    """
+    段内尾随窗口总体标准差 (ddof=0)。
+    短窗口按相对当前点的偏差累加 (方差平移不变，避免大数相减)；长窗口先减全局均值再用前缀和
+    """
+    values = np.asarray(values, dtype=np.float64)
+    idx, lo, counts = _rolling_bounds(offsets, window)
+    if window <= ROLLING_DIRECT_MAX:
+        sums, sq_sums = _rolling_direct(np.subtract, values, lo, window)
+    else:
+        centered = values - values.mean() if len(values) else values
+        csum = np.concatenate([[0.0], np.cumsum(centered)])
+        csq = np.concatenate([[0.0], np.cumsum(centered * centered)])
+        sums, sq_sums = csum[idx + 1] - csum[lo], csq[idx + 1] - csq[lo]
+    mean = sums / counts
+    return np.sqrt(np.maximum(sq_sums / counts - mean * mean, 0.0))
+
+
+def _trapezoid_steps(y, x, offsets):
+    """每个点与段内前一点之间的梯形面积，段首为 0"""
+    y = np.asarray(y, dtype=np.float64)
+    dx = seg_diff(np.asarray(x, dtype=np.float64), offsets, fill=0.0)
+    y_prev = np.empty_like(y)
+    if len(y):
+        y_prev[0] = y[0]
+        y_prev[1:] = y[:-1]
+    return 0.5 * (y + y_prev) * dx
+
+
+def seg_trapezoid(y, x, offsets):
+    """每段 ∫y dx (梯形法)"""
+    return seg_sum(_trapezoid_steps(y, x, offsets), offsets)
+
+
+def seg_cumtrapz(y, x, offsets):
+    """段内逐点累计 ∫y dx (梯形法)，段首为 0"""
+    return seg_cumsum(_trapezoid_steps(y, x, offsets), offsets)
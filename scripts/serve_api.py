@@ -0,0 +1,446 @@
+"""
+serve_api.py — 轨迹 / 能耗 / 城市几何的本地 HTTP 查询服务 (asyncio)
+
+启动时一次性把数据载入内存并建立索引，之后的查询只做数组切片与二分查找:
+
+输入:
+  - data/processed/trajectories/uav_trajectories.csv   (process_trajectories.py)
+  - data/processed/energy_predictions.json             (energy_model.py，可缺省)
+  - data/processed/{city}/buildings_3d.geojson / poi_demand.geojson / poi_sensitive.geojson
+  - data/processed/airspace/density.sidx               (airspace_density.py，可缺省，内存映射)
+
+接口 (GET，均返回 JSON；请求带 Accept-Encoding: gzip 且响应较大时 gzip 压缩):
+  /api/health                                 载入的数据规模与缓存命中统计
+  /api/active?t=秒                            t 时刻在空中的航班数 (两次二分)
+  /api/flights?t=秒[&bbox=lon0,lat0,lon1,lat1]  t 时刻在空中 (且位于 bbox 内) 的航班及其插值位置
+  /api/flight/{flight_id}                     单航班轨迹: timestamp / lon / lat / alt
+  /api/flight/{flight_id}/energy              单航班能耗曲线: power / battery / payload
+                                              (energy_model.py --uncertainty 时另含 power_p10/p50/p90 与 energy_Wh 区间)
+  /api/city/{city}/{layer}[?bbox=...]         城市几何 (layer = buildings / poi_demand / poi_sensitive)
+  /api/density?t=秒                           t 所在时间桶的非空空域体素 (ix / iy / iz / flights / points)
+
+索引:
+  1. 轨迹按 (flight_id, timestamp) 排序成扁平数组 + 每航班偏移表 (spatial_index.load_trajectory_points)
+  2. 活跃航班: 航班起止时刻的区间索引 (spatial_index.FlightIntervalIndex) 只过滤 t 所在时间窗的候选；位置用全局单调键
+     flight_idx * 跨度 + timestamp 一次 searchsorted 求出所有活跃航班的前后采样点后线性插值
+  3. 城市要素启动时预先序列化为字节串并计算经纬度 bbox，查询只做 bbox 过滤与拼接
+  4. 完整响应 (含压缩结果) 按 (路径, 查询串, 是否 gzip) 放入 LRU 缓存 (/api/health 除外)
+"""
+
+import gzip
+import json
+import time
+import asyncio
+import logging
+import argparse
+from http import HTTPStatus
+from pathlib import Path
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import numpy as np
+
+from spatial_index import load_trajectory_points, find_city_file, FlightIntervalIndex, load_arrays
+from cities import CITIES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("QueryServer")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# LRU 缓存的响应条数
+DEFAULT_CACHE_SIZE = 1024
+# 小于此字节数的响应不压缩
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+# 请求头大小上限
+MAX_HEADER_BYTES = 16 * 1024
+CITY_LAYERS = {
+    'buildings': "buildings_3d.geojson",
+    'poi_demand': "poi_demand.geojson",
+    'poi_sensitive': "poi_sensitive.geojson",
+}
+TRAJ_COLUMNS = ('lat', 'lon', 'alt_rel')
+# 不进入 LRU 缓存的路径 (响应随服务状态变化)
+UNCACHED_PATHS = {'/api/health'}
+
+
+def _json_default(obj):
+    """json 回退路径下的 NumPy 数组与标量"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    """OrderedDict 实现的 LRU，记录命中率"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.data = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.capacity:
+            self.data.popitem(last=False)
+
+
+# ===========================================================================
+#  内存数据与查询
+# ===========================================================================
+class TrajectoryStore:
+    """扁平轨迹数组 + 每航班起止时刻"""
+
+    def __init__(self, table: dict, energy: dict = None):
+        self.flight_ids = table['flight_ids']
+        self.offsets = table['flight_offsets']
+        self.ts = table['timestamp']
+        self.lon, self.lat, self.alt = table['lon'], table['lat'], table['alt_rel']
+        self.flight_index = {fid: f for f, fid in enumerate(self.flight_ids.tolist())}
+        self.energy = energy or {}
+
+        n = len(self.flight_ids)
+        first, last = self.offsets[:-1], np.maximum(self.offsets[1:] - 1, 0)
+        self.t_start = self.ts[first] if n else np.zeros(0)
+        self.t_end = self.ts[last] if n else np.zeros(0)
+        self.intervals = FlightIntervalIndex(self.t_start, self.t_end)
+        # 全局单调键: 每个航班占一段互不重叠的时间区间
+        t_min = float(self.ts.min()) if len(self.ts) else 0.0
+        self.t_min = t_min
+        self.span = float(self.ts.max() - t_min) + 1.0 if len(self.ts) else 1.0
+        flight_of_point = np.repeat(np.arange(n, dtype=np.float64), np.diff(self.offsets))
+        self.key = flight_of_point * self.span + (self.ts - t_min)
+
+    def __len__(self):
+        return len(self.flight_ids)
+
+    def lookup(self, flight_id: str) -> int:
+        f = self.flight_index.get(flight_id)
+        if f is None:
+            raise HTTPError(404, f"未知航班: {flight_id}")
+        return f
+
+    def trajectory(self, flight_id: str) -> dict:
+        f = self.lookup(flight_id)
+        a, b = self.offsets[f], self.offsets[f + 1]
+        return {
+            'flight_id': flight_id,
+            'timestamp': self.ts[a:b],
+            'lon': self.lon[a:b],
+            'lat': self.lat[a:b],
+            'alt': self.alt[a:b],
+        }
+
+    def energy_profile(self, flight_id: str) -> dict:
+        f = self.lookup(flight_id)
+        record = self.energy.get(flight_id)
+        if record is None:
+            raise HTTPError(404, f"航班无能耗预测: {flight_id}")
+        a, b = self.offsets[f], self.offsets[f + 1]
+        return {'flight_id': flight_id, 'timestamp': self.ts[a:b], **record}
+
+    def active(self, t: float, bbox=None) -> dict:
+        """t 时刻在空中的航班，位置在前后两个采样点之间线性插值"""
+        f = self.intervals.active(t)
+        key = f * self.span + (t - self.t_min)
+        hi = np.minimum(np.searchsorted(self.key, key, side='left'), self.offsets[f + 1] - 1)
+        lo = np.maximum(hi - 1, self.offsets[f])
+        dt = self.ts[hi] - self.ts[lo]
+        w = np.where(dt > 0, (t - self.ts[lo]) / np.where(dt > 0, dt, 1.0), 0.0)
+        lon = self.lon[lo] + w * (self.lon[hi] - self.lon[lo])
+        lat = self.lat[lo] + w * (self.lat[hi] - self.lat[lo])
+        alt = self.alt[lo] + w * (self.alt[hi] - self.alt[lo])
+        if bbox is not None:
+            inside = (lon >= bbox[0]) & (lat >= bbox[1]) & (lon <= bbox[2]) & (lat <= bbox[3])
+            f, lon, lat, alt = f[inside], lon[inside], lat[inside], alt[inside]
+        return {
+            't': t,
+            'count': len(f),
+            'flight_ids': self.flight_ids[f].tolist(),
+            'lon': np.round(lon, 7), 'lat': np.round(lat, 7), 'alt': np.round(alt, 2),
+        }
+
+
+class FeatureLayer:
+    """预序列化的 GeoJSON 要素 + 经纬度 bbox"""
+
+    def __init__(self, geojson: dict):
+        features = geojson.get('features', [])
+        self.encoded = [dumps(feat) for feat in features]
+        bbox = np.empty((len(features), 4))
+        for k, feat in enumerate(features):
+            pts = np.asarray(list(iter_coords(feat['geometry']['coordinates'])), dtype=np.float64)
+            bbox[k] = (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max())
+        self.bbox = bbox
+
+    def __len__(self):
+        return len(self.encoded)
+
+    def query(self, bbox=None) -> bytes:
+        if bbox is None:
+            idx = range(len(self.encoded))
+        else:
+            b = self.bbox
+            idx = np.flatnonzero((b[:, 2] >= bbox[0]) & (b[:, 3] >= bbox[1]) &
+                                 (b[:, 0] <= bbox[2]) & (b[:, 1] <= bbox[3]))
+        return (b'{"type":"FeatureCollection","features":[' +
+                b','.join(self.encoded[k] for k in idx) + b']}')
+
+
+def iter_coords(coords):
+    """遍历任意嵌套深度 GeoJSON coordinates 中的 [lon, lat]"""
+    if coords and isinstance(coords[0], (int, float)):
+        yield coords[:2]
+        return
+    for c in coords:
+        yield from iter_coords(c)
+
+
+def load_city_layers(processed_dir: Path, cities: list) -> dict:
+    layers = {}
+    for city in cities:
+        for layer, filename in CITY_LAYERS.items():
+            path = find_city_file(processed_dir, city, filename)
+            if not path.exists():
+                continue
+            with open(path, 'rb') as f:
+                data = orjson.loads(f.read()) if orjson is not None else json.load(f)
+            layers[(city, layer)] = FeatureLayer(data)
+        found = [l for c, l in layers if c == city]
+        if found:
+            logger.info(f"  {city}: " + ", ".join(f"{l} {len(layers[(city, l)])}" for l in found))
+    return layers
+
+
+def parse_time(query: dict) -> float:
+    if 't' not in query:
+        raise HTTPError(400, "缺少参数 t")
+    try:
+        return float(query['t'][0])
+    except ValueError:
+        raise HTTPError(400, "t 应为数值")
+
+
+def parse_bbox(value: str):
+    try:
+        bbox = [float(v) for v in value.split(',')]
+    except ValueError:
+        bbox = []
+    if len(bbox) != 4:
+        raise HTTPError(400, "bbox 格式应为 lon0,lat0,lon1,lat1")
+    return bbox
+
+
+# ===========================================================================
+#  HTTP
+# ===========================================================================
+class QueryServer:
+    def __init__(self, store: TrajectoryStore, layers: dict, cache_size: int = DEFAULT_CACHE_SIZE,
+                 density=None):
+        self.store = store
+        self.layers = layers
+        # (arrays, meta) 或 None
+        self.density = density
+        self.cache = LRUCache(cache_size)
+
+    def route(self, path: str, query: dict) -> bytes:
+        """路径 → JSON 字节串"""
+        parts = [unquote(p) for p in path.strip('/').split('/')]
+        bbox = parse_bbox(query['bbox'][0]) if 'bbox' in query else None
+        if parts == ['api', 'health']:
+            return dumps({
+                'flights': len(self.store), 'points': len(self.store.ts),
+                'energy_flights': len(self.store.energy),
+                'layers': {f"{c}/{l}": len(v) for (c, l), v in self.layers.items()},
+                'cache': {'size': len(self.cache.data), 'hits': self.cache.hits,
+                          'misses': self.cache.misses},
+            })
+        if parts == ['api', 'active']:
+            t = parse_time(query)
+            return dumps({'t': t, 'count': self.store.intervals.count(t)})
+        if parts == ['api', 'flights']:
+            return dumps(self.store.active(parse_time(query), bbox))
+        if len(parts) == 3 and parts[:2] == ['api', 'flight']:
+            return dumps(self.store.trajectory(parts[2]))
+        if len(parts) == 4 and parts[:2] == ['api', 'flight'] and parts[3] == 'energy':
+            return dumps(self.store.energy_profile(parts[2]))
+        if parts == ['api', 'density']:
+            return dumps(self.density_slice(parse_time(query)))
+        if len(parts) == 4 and parts[:2] == ['api', 'city']:
+            layer = self.layers.get((parts[2], parts[3]))
+            if layer is None:
+                raise HTTPError(404, f"无此城市图层: {parts[2]}/{parts[3]}")
+            return layer.query(bbox)
+        raise HTTPError(404, f"未知路径: {path}")
+
+    def density_slice(self, t: float) -> dict:
+        if self.density is None:
+            raise HTTPError(404, "空域负载栅格不存在 (请先运行 airspace_density.py)")
+        arrays, meta = self.density
+        k = int(np.floor((t - meta['time_origin']) / meta['bucket_s']))
+        offsets = arrays['time_offsets']
+        a, b = (offsets[k], offsets[k + 1]) if 0 <= k < len(offsets) - 1 else (0, 0)
+        return {
+            'bucket': k, 't_start': meta['time_origin'] + k * meta['bucket_s'],
+            'bucket_s': meta['bucket_s'], 'cell_m': meta['cell_m'], 'alt_band_m': meta['alt_band_m'],
+            'origin': meta['origin'], 'grid_offset': meta['grid_offset'],
+            # 内存映射数组转为普通 ndarray 视图 (orjson 不接受 memmap 子类)
+            **{name: np.asarray(arrays[name][a:b]) for name in ('ix', 'iy', 'iz', 'flights', 'points')},
+        }
+
+    def respond(self, target: str, accept_gzip: bool):
+        """返回 (状态码, 响应体, 是否已压缩)；成功响应进入 LRU 缓存 (UNCACHED_PATHS 除外)"""
+        url = urlsplit(target)
+        cacheable = '/' + url.path.strip('/') not in UNCACHED_PATHS
+        key = (target, accept_gzip)
+        cached = self.cache.get(key) if cacheable else None
+        if cached is not None:
+            return cached
+        try:
+            body = self.route(url.path, parse_qs(url.query))
+        except HTTPError as e:
+            return e.status, dumps({'error': str(e)}), False
+        except Exception:
+            logger.exception(f"❌ 处理请求失败: {target}")
+            return 500, dumps({'error': "服务器内部错误"}), False
+        compressed = accept_gzip and len(body) >= GZIP_MIN_BYTES
+        if compressed:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        result = (200, body, compressed)
+        if cacheable:
+            self.cache.put(key, result)
+        return result
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """HTTP/1.1 keep-alive 连接，只支持 GET"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, version = (lines[0].split(' ') + ['', '', ''])[:3]
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                t0 = time.perf_counter()
+                if method != 'GET':
+                    status, body, compressed = 405, dumps({'error': "只支持 GET"}), False
+                else:
+                    status, body, compressed = self.respond(
+                        target, 'gzip' in headers.get('accept-encoding', ''))
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                out = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                       "Content-Type: application/json; charset=utf-8",
+                       f"Content-Length: {len(body)}",
+                       "Access-Control-Allow-Origin: *",
+                       f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                if compressed:
+                    out.append("Content-Encoding: gzip")
+                writer.write(('\r\n'.join(out) + '\r\n\r\n').encode('latin-1') + body)
+                await writer.drain()
+                logger.debug(f"{method} {target} {status} {len(body)}B "
+                             f"{(time.perf_counter() - t0) * 1e3:.2f}ms")
+                if not keep_alive:
+                    break
+        except Exception:
+            logger.exception("❌ 连接处理异常，已关闭连接")
+        finally:
+            writer.close()
+
+
+async def serve(server: QueryServer, host: str, port: int):
+    srv = await asyncio.start_server(server.handle, host, port, limit=MAX_HEADER_BYTES)
+    logger.info(f"✅ 查询服务已启动: http://{host}:{port}/api/health")
+    async with srv:
+        await srv.serve_forever()
+
+
+def load_server(traj_csv: Path, energy_json: Path, processed_dir: Path, cities: list,
+                cache_size: int = DEFAULT_CACHE_SIZE) -> QueryServer:
+    t0 = time.perf_counter()
+    table = load_trajectory_points(traj_csv, columns=TRAJ_COLUMNS)
+    energy = {}
+    if energy_json.exists():
+        with open(energy_json, 'rb') as f:
+            energy = orjson.loads(f.read()) if orjson is not None else json.load(f)
+    else:
+        logger.warning(f"⚠️ 能耗预测不存在: {energy_json} (能耗接口将返回 404)")
+    store = TrajectoryStore(table, energy)
+    logger.info(f"轨迹: {len(store)} 条航班, {len(store.ts)} 个点; 能耗预测: {len(energy)} 条航班")
+    layers = load_city_layers(processed_dir, cities)
+    density_path = processed_dir / "airspace" / "density.sidx"
+    density = load_arrays(density_path) if density_path.exists() else None
+    if density is not None:
+        logger.info(f"  空域负载栅格: {len(density[0]['flights'])} 个非空体素")
+    logger.info(f"载入耗时 {time.perf_counter() - t0:.2f}s")
+    return QueryServer(store, layers, cache_size, density)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="轨迹 / 能耗 / 城市几何本地查询服务")
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--trajectories", type=str, default=None,
+                        help="轨迹 CSV, 默认 data/processed/trajectories/uav_trajectories.csv")
+    parser.add_argument("--energy", type=str, default=None,
+                        help="能耗预测 JSON, 默认 data/processed/energy_predictions.json")
+    parser.add_argument("--cities", type=str, default="all", help="载入的城市, 逗号分隔或'all'")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="LRU 缓存响应条数")
+    args = parser.parse_args()
+
+    base = Path(__file__).resolve().parent.parent
+    processed_dir = base / "data" / "processed"
+    traj_csv = Path(args.trajectories) if args.trajectories else \
+        processed_dir / "trajectories" / "uav_trajectories.csv"
+    energy_json = Path(args.energy) if args.energy else processed_dir / "energy_predictions.json"
+    cities = CITIES if args.cities.lower() == "all" else [c.strip() for c in args.cities.split(",")]
+
+    if not traj_csv.exists():
+        logger.error(f"❌ 轨迹数据不存在: {traj_csv}")
+        logger.info("请先运行 process_trajectories.py")
+        exit(1)
+
+    server = load_server(traj_csv, energy_json, processed_dir, cities, args.cache_size)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        logger.info("服务已停止")
@@ -0,0 +1,904 @@
+"""
+spatial_index.py — 建筑/轨迹空间索引公共模块
+
+为审计类脚本 (建筑碰撞、禁飞区入侵等) 提供:
+  1. 局部等距投影: WGS84 经纬度 → 以城市中心为原点的平面米坐标
+  2. BuildingIndex: 扁平化的建筑轮廓数组 (边表 + 每栋建筑的边偏移) + 均匀网格索引
+     - 每栋建筑按 bbox 登记到覆盖的所有网格单元 (CSR: cell_offsets / cell_items)
+     - 查询时点只取所在单元的候选建筑，先做 bbox 过滤，再做向量化射线法点面判断
+     - 线段模式: 线段 bbox 覆盖单元预筛后，做精确的线段-轮廓相交，得到线段在轮廓内的参数区间
+  3. PointGridIndex: 圆形禁飞区 (敏感 POI + 半径) 的网格哈希，只查本单元及相邻单元
+  4. save_arrays / load_arrays: 单文件、64 字节对齐的二进制数组容器，可只读内存映射，
+     用于城市索引 (save_city_index / load_city_index) 在多进程间零拷贝共享
+     build_city_index: process_multi_city.py 为每个城市预构建 spatial_index.sidx
+     (建筑轮廓顶点/环偏移/bbox/高度/网格 + 禁飞区网格 + 需求 POI)，
+     使用方通过 load_prebuilt_index 内存映射加载，无需解析 GeoJSON
+  5. load_trajectory_points: 读取 uav_trajectories.csv 为按航班连续排列的数组 + 偏移表
+  6. FlightIntervalIndex: 航班起止时刻的有序端点数组 + 分桶 CSR，O(log n) 求 t 时刻活跃数
+
+不使用 shapely/geopandas，纯 NumPy 实现。
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("SpatialIndex")
+
+# 经纬度换算常量 (与 process_trajectories.py 一致)
+METERS_PER_DEG_LAT = 111320.0
+# 默认网格单元边长 (米)
+DEFAULT_CELL_SIZE = 100.0
+# 点面判断时每批处理的候选 (点, 建筑) 对数量上限，控制峰值内存
+PIP_BATCH_PAIRS = 500000
+# 各类敏感点的禁飞半径 (米)；城市索引 (process_multi_city.py) 与禁飞区审计共用
+NFZ_RADIUS_M = {
+    'hospital': 150, 'police': 150,
+    'school': 100, 'kindergarten': 100, 'university': 100, 'college': 100,
+    'clinic': 50,
+    'driving_school': 30, 'language_school': 30, 'prep_school': 30,
+    'dancing_school': 30, 'music_school': 30,
+}
+DEFAULT_NFZ_RADIUS_M = 50
+
+
+# ===========================================================================
+#  投影与 ragged 数组工具
+# ===========================================================================
+class LocalProjection:
+    """以 (lon0, lat0) 为原点的等距圆柱投影，城市尺度 (几十公里) 内误差可忽略"""
+
+    def __init__(self, lon0: float, lat0: float):
+        self.lon0 = float(lon0)
+        self.lat0 = float(lat0)
+        self.kx = METERS_PER_DEG_LAT * np.cos(np.radians(self.lat0))
+        self.ky = METERS_PER_DEG_LAT
+
+    def forward(self, lon, lat):
+        """经纬度 → 平面米坐标 (x 向东, y 向北)"""
+        x = (np.asarray(lon, dtype=np.float64) - self.lon0) * self.kx
+        y = (np.asarray(lat, dtype=np.float64) - self.lat0) * self.ky
+        return x, y
+
+
+def ragged_arange(starts: np.ndarray, counts: np.ndarray):
+    """
+    展开若干段连续下标: 第 i 段为 starts[i] .. starts[i]+counts[i]-1
+    返回 (owner, index)，owner 为每个展开元素所属的段号
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+    if total == 0:
+        return owner, np.zeros(0, dtype=np.int64)
+    seg_start = np.cumsum(counts) - counts
+    index = np.arange(total, dtype=np.int64) - np.repeat(seg_start, counts) \
+        + np.repeat(np.asarray(starts, dtype=np.int64), counts)
+    return owner, index
+
+
+# ===========================================================================
+#  多边形环工具 (开放环: 不含重复的闭合点)
+# ===========================================================================
+def ring_signed_area(ring: np.ndarray) -> float:
+    """鞋带公式有向面积: y 轴向上时逆时针为正 (y 轴向下的瓦片坐标中顺时针为正)"""
+    x, y = ring[:, 0], ring[:, 1]
+    return float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2.0
+
+
+def points_in_ring(ring: np.ndarray, px, py) -> np.ndarray:
+    """射线法: 各点是否位于开放环 ring 内部"""
+    px = np.asarray(px, dtype=np.float64)[:, None]
+    py = np.asarray(py, dtype=np.float64)[:, None]
+    x0, y0 = ring[:, 0], ring[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    straddle = (y0 > py) != (y1 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return (np.count_nonzero(straddle & (px < x_cross), axis=1) % 2) == 1
+
+
+def simplify_ring_indices(pts: np.ndarray, tolerance: float) -> np.ndarray:
+    """闭合环的 Douglas-Peucker，返回保留顶点的下标 (升序)；显式栈实现"""
+    if tolerance <= 0 or len(pts) <= 4:
+        return np.arange(len(pts))
+    line = np.vstack([pts, pts[:1]])
+    keep = np.zeros(len(line), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(line) - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = line[b] - line[a]
+        d = line[a + 1:b] - line[a]
+        length = float(np.hypot(seg[0], seg[1]))
+        if length == 0:
+            dist = np.hypot(d[:, 0], d[:, 1])
+        else:
+            dist = np.abs(seg[0] * d[:, 1] - seg[1] * d[:, 0]) / length
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            idx = a + 1 + k
+            keep[idx] = True
+            stack += [(a, idx), (idx, b)]
+    return np.flatnonzero(keep[:-1])
+
+
+# ===========================================================================
+#  建筑索引
+# ===========================================================================
+class BuildingIndex:
+    """
+    建筑轮廓的扁平数组表示与均匀网格索引。
+    所有坐标均为 proj 下的平面米坐标。
+
+    属性:
+      osm_ids      int64[B]      建筑 OSM id
+      heights      float64[B]    建筑高度 (米)
+      bbox         float64[B,4]  (xmin, ymin, xmax, ymax)
+      edge_offsets int64[B+1]    第 b 栋建筑的边位于 [edge_offsets[b], edge_offsets[b+1])
+      edges        float64[E,4]  (x0, y0, x1, y1)，包含外环与内环 (奇偶规则)
+      cell_size / grid_origin / grid_shape / cell_offsets / cell_items  网格索引 (CSR)
+    可选的原始几何 (经纬度，供需要还原轮廓的使用方):
+      vertices       float64[V,2]  所有环的顶点 (lon, lat)
+      ring_offsets   int64[R+1]    第 r 个环的顶点位于 [ring_offsets[r], ring_offsets[r+1])
+      building_rings int64[B+1]    第 b 栋建筑的环位于 [building_rings[b], building_rings[b+1])
+    """
+
+    def __init__(self, proj: LocalProjection, osm_ids, heights, edge_offsets, edges,
+                 cell_size: float = DEFAULT_CELL_SIZE, vertices=None, ring_offsets=None,
+                 building_rings=None):
+        self.proj = proj
+        self.vertices = vertices
+        self.ring_offsets = ring_offsets
+        self.building_rings = building_rings
+        self.osm_ids = np.asarray(osm_ids, dtype=np.int64)
+        self.heights = np.asarray(heights, dtype=np.float64)
+        self.edge_offsets = np.asarray(edge_offsets, dtype=np.int64)
+        self.edges = np.asarray(edges, dtype=np.float64).reshape(-1, 4)
+        self.cell_size = float(cell_size)
+        self._compute_bbox()
+        self._build_grid()
+
+    def __len__(self):
+        return len(self.osm_ids)
+
+    # 持久化时保存的数组字段 (其余为 meta 中的标量)
+    ARRAY_FIELDS = ('osm_ids', 'heights', 'edge_offsets', 'edges', 'bbox',
+                    'cell_offsets', 'cell_items')
+    GEOMETRY_FIELDS = ('vertices', 'ring_offsets', 'building_rings')
+
+    def to_arrays(self, prefix: str = 'b_'):
+        """导出为 (数组字典, meta)，供 save_arrays 写入索引文件"""
+        arrays = {prefix + k: getattr(self, k) for k in self.ARRAY_FIELDS}
+        if self.vertices is not None:
+            arrays.update({prefix + k: getattr(self, k) for k in self.GEOMETRY_FIELDS})
+        meta = {'lon0': self.proj.lon0, 'lat0': self.proj.lat0, 'cell_size': self.cell_size,
+                'grid_origin': [float(v) for v in self.grid_origin],
+                'grid_shape': list(self.grid_shape)}
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, meta: dict, prefix: str = 'b_'):
+        """由索引文件中的数组 (可为内存映射) 直接还原，不重新建网格"""
+        index = cls.__new__(cls)
+        index.proj = LocalProjection(meta['lon0'], meta['lat0'])
+        index.cell_size = float(meta['cell_size'])
+        index.grid_origin = np.asarray(meta['grid_origin'], dtype=np.float64)
+        index.grid_shape = tuple(meta['grid_shape'])
+        for k in cls.ARRAY_FIELDS:
+            setattr(index, k, arrays[prefix + k])
+        for k in cls.GEOMETRY_FIELDS:
+            setattr(index, k, arrays.get(prefix + k))
+        return index
+
+    def rings(self, b: int) -> list:
+        """第 b 栋建筑的所有环 (经纬度 [V,2] 数组，首环为外环)；未保存原始几何时返回空列表"""
+        if self.vertices is None:
+            return []
+        r0, r1 = self.building_rings[b], self.building_rings[b + 1]
+        return [self.vertices[self.ring_offsets[r]:self.ring_offsets[r + 1]] for r in range(r0, r1)]
+
+    def _compute_bbox(self):
+        n = len(self.osm_ids)
+        self.bbox = np.zeros((n, 4))
+        if n == 0:
+            return
+        starts = self.edge_offsets[:-1]
+        xs = np.minimum(self.edges[:, 0], self.edges[:, 2])
+        ys = np.minimum(self.edges[:, 1], self.edges[:, 3])
+        xe = np.maximum(self.edges[:, 0], self.edges[:, 2])
+        ye = np.maximum(self.edges[:, 1], self.edges[:, 3])
+        self.bbox[:, 0] = np.minimum.reduceat(xs, starts)
+        self.bbox[:, 1] = np.minimum.reduceat(ys, starts)
+        self.bbox[:, 2] = np.maximum.reduceat(xe, starts)
+        self.bbox[:, 3] = np.maximum.reduceat(ye, starts)
+
+    def _build_grid(self):
+        """批量登记: 每栋建筑 → 其 bbox 覆盖的所有单元，按单元排序得到 CSR 结构"""
+        if len(self.osm_ids) == 0:
+            self.grid_origin = np.zeros(2)
+            self.grid_shape = (1, 1)
+            self.cell_offsets = np.zeros(2, dtype=np.int64)
+            self.cell_items = np.zeros(0, dtype=np.int64)
+            return
+        self.grid_origin = self.bbox[:, :2].min(axis=0)
+        ix0, iy0 = self.cell_coords(self.bbox[:, 0], self.bbox[:, 1], clip=False)
+        ix1, iy1 = self.cell_coords(self.bbox[:, 2], self.bbox[:, 3], clip=False)
+        nx, ny = int(ix1.max()) + 1, int(iy1.max()) + 1
+        self.grid_shape = (nx, ny)
+
+        wx, wy = ix1 - ix0 + 1, iy1 - iy0 + 1
+        owner, k = ragged_arange(np.zeros(len(wx), dtype=np.int64), wx * wy)
+        cx = ix0[owner] + k % wx[owner]
+        cy = iy0[owner] + k // wx[owner]
+        cell = cx * ny + cy
+        order = np.argsort(cell, kind='stable')
+        self.cell_items = owner[order]
+        counts = np.bincount(cell, minlength=nx * ny)
+        self.cell_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def cell_coords(self, x, y, clip: bool = True):
+        """平面坐标 → 网格单元坐标 (ix, iy)"""
+        ix = np.floor((np.asarray(x) - self.grid_origin[0]) / self.cell_size).astype(np.int64)
+        iy = np.floor((np.asarray(y) - self.grid_origin[1]) / self.cell_size).astype(np.int64)
+        if clip:
+            nx, ny = self.grid_shape
+            ix = np.clip(ix, 0, nx - 1)
+            iy = np.clip(iy, 0, ny - 1)
+        return ix, iy
+
+    def candidates(self, x, y):
+        """
+        网格 + bbox 预筛: 返回 (point_idx, building_idx) 候选对
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        nx, ny = self.grid_shape
+        ix, iy = self.cell_coords(x, y, clip=False)
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        pts = np.flatnonzero(inside)
+        cell = ix[pts] * ny + iy[pts]
+        starts = self.cell_offsets[cell]
+        counts = self.cell_offsets[cell + 1] - starts
+        owner, item = ragged_arange(starts, counts)
+        p = pts[owner]
+        b = self.cell_items[item]
+        bb = self.bbox[b]
+        hit = (x[p] >= bb[:, 0]) & (x[p] <= bb[:, 2]) & (y[p] >= bb[:, 1]) & (y[p] <= bb[:, 3])
+        return p[hit], b[hit]
+
+    def _edge_batches(self, b):
+        """
+        按 PIP_BATCH_PAIRS 把 (候选对 × 边) 的展开分批，控制内存。
+        逐批产出 (候选对切片, 每条边所属的批内候选对号, 边下标, 批内每个候选对的首条边位置)
+        """
+        n_edges = self.edge_offsets[b + 1] - self.edge_offsets[b]
+        avg_edges = max(float(n_edges.mean()) if len(n_edges) else 1.0, 1.0)
+        step = max(int(PIP_BATCH_PAIRS / avg_edges), 1)
+        for s in range(0, len(b), step):
+            sl = slice(s, s + step)
+            counts = n_edges[sl]
+            owner, e = ragged_arange(self.edge_offsets[b[sl]], counts)
+            yield sl, owner, e, np.cumsum(counts) - counts
+
+    def contains(self, x, y, p, b):
+        """
+        对候选对 (p, b) 做向量化射线法判断: 点 (x[p], y[p]) 是否落在建筑 b 内 (奇偶规则)
+        """
+        p = np.asarray(p, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        result = np.zeros(len(p), dtype=bool)
+        for sl, owner, e, _ in self._edge_batches(b):
+            px = x[p[sl]][owner]
+            py = y[p[sl]][owner]
+            x0, y0, x1, y1 = self.edges[e].T
+            straddle = (y0 > py) != (y1 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+            crossing = straddle & (px < x_cross)
+            parity = np.bincount(owner, weights=crossing, minlength=len(p[sl]))
+            result[sl] = (parity.astype(np.int64) % 2) == 1
+        return result
+
+    def locate(self, x, y):
+        """返回落在建筑内的 (point_idx, building_idx) 对"""
+        p, b = self.candidates(x, y)
+        inside = self.contains(x, y, p, b)
+        return p[inside], b[inside]
+
+    def segment_candidates(self, x0, y0, x1, y1):
+        """
+        线段版网格 + bbox 预筛: 线段 bbox 覆盖的所有单元内的建筑，
+        去重后再与建筑 bbox 求交，返回 (segment_idx, building_idx) 候选对
+        """
+        nx, ny = self.grid_shape
+        ix0, iy0 = self.cell_coords(np.minimum(x0, x1), np.minimum(y0, y1), clip=False)
+        ix1, iy1 = self.cell_coords(np.maximum(x0, x1), np.maximum(y0, y1), clip=False)
+        segs = np.flatnonzero((ix1 >= 0) & (ix0 < nx) & (iy1 >= 0) & (iy0 < ny))
+        ix0, ix1 = np.clip(ix0[segs], 0, nx - 1), np.clip(ix1[segs], 0, nx - 1)
+        iy0, iy1 = np.clip(iy0[segs], 0, ny - 1), np.clip(iy1[segs], 0, ny - 1)
+
+        wx, wy = ix1 - ix0 + 1, iy1 - iy0 + 1
+        owner, k = ragged_arange(np.zeros(len(segs), dtype=np.int64), wx * wy)
+        cell = (ix0[owner] + k % wx[owner]) * ny + iy0[owner] + k // wx[owner]
+        starts = self.cell_offsets[cell]
+        owner2, item = ragged_arange(starts, self.cell_offsets[cell + 1] - starts)
+        # 同一建筑可能登记在线段经过的多个单元中，需去重
+        n_b = max(len(self.osm_ids), 1)
+        key = np.unique(segs[owner[owner2]] * n_b + self.cell_items[item])
+        s, b = key // n_b, key % n_b
+
+        bb = self.bbox[b]
+        hit = (np.maximum(x0[s], x1[s]) >= bb[:, 0]) & (np.minimum(x0[s], x1[s]) <= bb[:, 2]) & \
+              (np.maximum(y0[s], y1[s]) >= bb[:, 1]) & (np.minimum(y0[s], y1[s]) <= bb[:, 3])
+        return s[hit], b[hit]
+
+    def segment_overlap(self, x0, y0, x1, y1, s, b):
+        """
+        对候选对 (s, b) 求线段 s 与建筑 b 轮廓的精确相交:
+        返回 (hit, t_enter, t_exit)，t 为线段参数 (0=起点, 1=终点)，
+        t_enter/t_exit 为线段位于轮廓内部的首末参数 (非凸轮廓时为外包区间)
+        """
+        s = np.asarray(s, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        start_in = self.contains(x0, y0, s, b)
+        end_in = self.contains(x1, y1, s, b)
+        t_first = np.full(len(s), np.inf)
+        t_last = np.full(len(s), -np.inf)
+        for sl, owner, e, first_edge in self._edge_batches(b):
+            if len(e) == 0:
+                continue
+            px, py = x0[s[sl]][owner], y0[s[sl]][owner]
+            dx, dy = x1[s[sl]][owner] - px, y1[s[sl]][owner] - py
+            ex0, ey0, ex1, ey1 = self.edges[e].T
+            fx, fy = ex1 - ex0, ey1 - ey0
+            qx, qy = ex0 - px, ey0 - py
+            denom = dx * fy - dy * fx
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = (qx * fy - qy * fx) / denom
+                u = (qx * dy - qy * dx) / denom
+            ok = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+            t_first[sl] = np.minimum.reduceat(np.where(ok, t, np.inf), first_edge)
+            t_last[sl] = np.maximum.reduceat(np.where(ok, t, -np.inf), first_edge)
+
+        hit = start_in | end_in | np.isfinite(t_first)
+        t_enter = np.where(start_in, 0.0, t_first)
+        t_exit = np.where(end_in, 1.0, t_last)
+        return hit, t_enter, t_exit
+
+
+def polygon_rings(geometry: dict) -> list:
+    """GeoJSON Polygon / MultiPolygon → 所有环的列表 (每环 [[lon, lat], ...])"""
+    if geometry is None:
+        return []
+    if geometry.get('type') == 'Polygon':
+        return list(geometry.get('coordinates', []))
+    if geometry.get('type') == 'MultiPolygon':
+        return [ring for poly in geometry.get('coordinates', []) for ring in poly]
+    return []
+
+
+def load_building_index(geojson_path: Path, cell_size: float = DEFAULT_CELL_SIZE,
+                        proj: LocalProjection = None) -> BuildingIndex:
+    """读取 buildings_3d.geojson 并构建 BuildingIndex"""
+    with open(geojson_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    osm_ids, heights, ring_arrays, ring_owner = [], [], [], []
+    for feat in data.get('features', []):
+        rings = [r for r in polygon_rings(feat.get('geometry')) if len(r) >= 3]
+        if not rings:
+            continue
+        props = feat.get('properties', {})
+        b = len(osm_ids)
+        osm_ids.append(int(props.get('osm_id', 0) or 0))
+        heights.append(float(props.get('height', 0.0) or 0.0))
+        for ring in rings:
+            ring_arrays.append(np.asarray(ring, dtype=np.float64)[:, :2])
+            ring_owner.append(b)
+
+    if proj is None:
+        if ring_arrays:
+            allv = np.concatenate(ring_arrays)
+            lon0, lat0 = (allv.min(axis=0) + allv.max(axis=0)) / 2
+        else:
+            lon0, lat0 = 0.0, 0.0
+        proj = LocalProjection(lon0, lat0)
+
+    # 每个环的边: 顶点 i → i+1 (未闭合的环补上最后一条边)
+    edge_chunks = []
+    edge_counts = np.zeros(len(osm_ids), dtype=np.int64)
+    for ring, b in zip(ring_arrays, ring_owner):
+        if not np.array_equal(ring[0], ring[-1]):
+            ring = np.vstack([ring, ring[:1]])
+        x, y = proj.forward(ring[:, 0], ring[:, 1])
+        edge_chunks.append(np.column_stack([x[:-1], y[:-1], x[1:], y[1:]]))
+        edge_counts[b] += len(ring) - 1
+
+    edges = np.concatenate(edge_chunks) if edge_chunks else np.zeros((0, 4))
+    edge_offsets = np.concatenate([[0], np.cumsum(edge_counts)])
+    vertices = np.concatenate(ring_arrays) if ring_arrays else np.zeros((0, 2))
+    ring_offsets = np.concatenate([[0], np.cumsum([len(r) for r in ring_arrays])]).astype(np.int64)
+    ring_counts = np.bincount(np.asarray(ring_owner, dtype=np.int64), minlength=len(osm_ids))
+    building_rings = np.concatenate([[0], np.cumsum(ring_counts)]).astype(np.int64)
+    index = BuildingIndex(proj, osm_ids, heights, edge_offsets, edges, cell_size,
+                          vertices, ring_offsets, building_rings)
+    logger.info(f"建筑索引: {len(index)} 栋, {len(edges)} 条边, "
+                f"网格 {index.grid_shape[0]}×{index.grid_shape[1]} ({cell_size:g} 米)")
+    return index
+
+
+# ===========================================================================
+#  敏感 POI (禁飞区) 网格哈希
+# ===========================================================================
+class PointGridIndex:
+    """
+    圆形区域 (中心点 + 半径) 的均匀网格哈希。
+    单元边长不小于最大半径，因此任一查询点只需检查所在单元及相邻 8 个单元，
+    检测代价随查询点数线性增长，与 点数 × POI 数 无关。
+    """
+
+    def __init__(self, x, y, radii, cell_size: float = None):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.radii = np.asarray(radii, dtype=np.float64)
+        max_r = float(self.radii.max()) if len(self.radii) else 1.0
+        self.cell_size = max(float(cell_size or 0.0), max_r, 1.0)
+        key = self._key(*self._cell(self.x, self.y))
+        self.order = np.argsort(key, kind='stable')
+        self.sorted_keys = key[self.order]
+
+    def __len__(self):
+        return len(self.x)
+
+    ARRAY_FIELDS = ('x', 'y', 'radii', 'order', 'sorted_keys')
+
+    def to_arrays(self, prefix: str = 'z_'):
+        return {prefix + k: getattr(self, k) for k in self.ARRAY_FIELDS}, {'cell_size': self.cell_size}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, meta: dict, prefix: str = 'z_'):
+        index = cls.__new__(cls)
+        index.cell_size = float(meta['cell_size'])
+        for k in cls.ARRAY_FIELDS:
+            setattr(index, k, arrays[prefix + k])
+        return index
+
+    def _cell(self, x, y):
+        return (np.floor(np.asarray(x) / self.cell_size).astype(np.int64),
+                np.floor(np.asarray(y) / self.cell_size).astype(np.int64))
+
+    @staticmethod
+    def _key(ix, iy):
+        return (ix << 32) + iy
+
+    def query(self, x, y):
+        """
+        返回落在圆内的 (point_idx, item_idx, distance) 三元组
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        ix, iy = self._cell(x, y)
+        ps, items = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                key = self._key(ix + dx, iy + dy)
+                lo = np.searchsorted(self.sorted_keys, key, side='left')
+                hi = np.searchsorted(self.sorted_keys, key, side='right')
+                owner, k = ragged_arange(lo, hi - lo)
+                ps.append(owner)
+                items.append(self.order[k])
+        p = np.concatenate(ps)
+        i = np.concatenate(items)
+        dist = np.hypot(x[p] - self.x[i], y[p] - self.y[i])
+        hit = dist <= self.radii[i]
+        return p[hit], i[hit], dist[hit]
+
+
+    def query_segments(self, x0, y0, x1, y1):
+        """
+        线段版查询: 遍历线段 bbox 覆盖单元外扩一圈的所有单元，
+        计算圆心到线段的最近距离，返回 (segment_idx, item_idx, distance, t_in, t_out)，
+        [t_in, t_out] 为线段位于圆内的参数区间
+        """
+        x0, y0 = np.asarray(x0, dtype=np.float64), np.asarray(y0, dtype=np.float64)
+        x1, y1 = np.asarray(x1, dtype=np.float64), np.asarray(y1, dtype=np.float64)
+        ix0, iy0 = self._cell(np.minimum(x0, x1), np.minimum(y0, y1))
+        ix1, iy1 = self._cell(np.maximum(x0, x1), np.maximum(y0, y1))
+        ix0, iy0, ix1, iy1 = ix0 - 1, iy0 - 1, ix1 + 1, iy1 + 1
+        wx, wy = ix1 - ix0 + 1, iy1 - iy0 + 1
+        owner, k = ragged_arange(np.zeros(len(x0), dtype=np.int64), wx * wy)
+        key = self._key(ix0[owner] + k % wx[owner], iy0[owner] + k // wx[owner])
+        lo = np.searchsorted(self.sorted_keys, key, side='left')
+        hi = np.searchsorted(self.sorted_keys, key, side='right')
+        owner2, k2 = ragged_arange(lo, hi - lo)
+        s = owner[owner2]
+        i = self.order[k2]
+
+        dx, dy = x1[s] - x0[s], y1[s] - y0[s]
+        len2 = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((self.x[i] - x0[s]) * dx + (self.y[i] - y0[s]) * dy) / len2
+        t = np.clip(np.nan_to_num(t, nan=0.0), 0.0, 1.0)
+        dist = np.hypot(x0[s] + t * dx - self.x[i], y0[s] + t * dy - self.y[i])
+        hit = dist <= self.radii[i]
+        s, i, dist, dx, dy, len2 = s[hit], i[hit], dist[hit], dx[hit], dy[hit], len2[hit]
+
+        # |P0 + t·d - C|² = r² 的两根即进出圆的参数
+        qx, qy = x0[s] - self.x[i], y0[s] - self.y[i]
+        half_b = qx * dx + qy * dy
+        c = qx * qx + qy * qy - self.radii[i] ** 2
+        root = np.sqrt(np.maximum(half_b * half_b - len2 * c, 0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_in = np.where(len2 > 0, (-half_b - root) / len2, 0.0)
+            t_out = np.where(len2 > 0, (-half_b + root) / len2, 1.0)
+        return s, i, dist, np.clip(t_in, 0.0, 1.0), np.clip(t_out, 0.0, 1.0)
+
+
+def load_sensitive_pois(geojson_path: Path, radius_map: dict, default_radius: float) -> dict:
+    """
+    读取 poi_sensitive.geojson，返回各列数组:
+      poi_id / name / category (object)、lon / lat / radius (float64)
+    兼容两种格式: process_multi_city.py 输出的 Point (category)，
+    以及旧版深圳数据的缓冲圆 Polygon (type + buffer_radius_m，取顶点均值为中心)
+    """
+    with open(geojson_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    cols = {k: [] for k in ('poi_id', 'name', 'category', 'lon', 'lat', 'radius')}
+    for feat in data.get('features', []):
+        geom = feat.get('geometry') or {}
+        props = feat.get('properties', {})
+        category = props.get('category') or props.get('type') or 'unknown'
+        if geom.get('type') == 'Point':
+            lon, lat = geom['coordinates'][:2]
+        else:
+            rings = polygon_rings(geom)
+            if not rings:
+                continue
+            ring = np.asarray(rings[0], dtype=np.float64)[:-1, :2]
+            lon, lat = ring.mean(axis=0)
+        radius = props.get('buffer_radius_m') or radius_map.get(category, default_radius)
+        cols['poi_id'].append(str(props.get('osm_id', props.get('poi_id', ''))))
+        cols['name'].append(props.get('name', ''))
+        cols['category'].append(category)
+        cols['lon'].append(float(lon))
+        cols['lat'].append(float(lat))
+        cols['radius'].append(float(radius))
+
+    return {k: np.asarray(v, dtype=np.float64 if k in ('lon', 'lat', 'radius') else object)
+            for k, v in cols.items()}
+
+
+def load_demand_pois(geojson_path: Path) -> dict:
+    """读取 poi_demand.geojson (Point)，按文件中的顺序返回 name / category (object)、lon / lat (float64)"""
+    with open(geojson_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    cols = {k: [] for k in ('name', 'category', 'lon', 'lat')}
+    for feat in data.get('features', []):
+        coords = feat['geometry']['coordinates']
+        props = feat.get('properties', {})
+        cols['name'].append(props.get('name', ''))
+        cols['category'].append(props.get('category') or props.get('type') or 'unknown')
+        cols['lon'].append(float(coords[0]))
+        cols['lat'].append(float(coords[1]))
+    return {k: np.asarray(v, dtype=np.float64 if k in ('lon', 'lat') else object)
+            for k, v in cols.items()}
+
+
+def trajectory_segments(table: dict) -> np.ndarray:
+    """返回所有航班内相邻点构成的线段起点下标 i (线段为 i → i+1)"""
+    n = len(table['timestamp'])
+    mask = np.ones(max(n - 1, 0), dtype=bool)
+    inner_starts = table['flight_offsets'][1:-1]
+    mask[inner_starts[inner_starts > 0] - 1] = False
+    return np.flatnonzero(mask)
+
+
+def group_runs(flight, key, point):
+    """
+    把按 (航班, 目标, 点序号) 排序后的命中记录切成连续区段:
+    航班或目标变化、或点序号不连续时开始新区段。
+    返回 (排序下标, 区段起点, 区段终点)，起止均为排序后数组中的下标 (含)
+    """
+    order = np.lexsort((point, key, flight))
+    f, k, p = flight[order], key[order], point[order]
+    new_run = np.ones(len(p), dtype=bool)
+    new_run[1:] = (f[1:] != f[:-1]) | (k[1:] != k[:-1]) | (p[1:] != p[:-1] + 1)
+    starts = np.flatnonzero(new_run)
+    ends = np.concatenate([starts[1:], [len(p)]]) - 1
+    return order, starts, ends
+
+
+# ===========================================================================
+#  二进制索引文件 (可内存映射)
+# ===========================================================================
+INDEX_MAGIC = b'SIDX0001'
+INDEX_ALIGN = 64
+
+
+def save_arrays(path: Path, arrays: dict, meta: dict = None):
+    """
+    把若干 NumPy 数组写入单个二进制文件:
+      magic(8B) | header 长度(uint64 LE) | header JSON | 按 64 字节对齐的原始数组数据
+    header 记录每个数组的 dtype / shape / offset 以及任意 meta。
+    """
+    arrays = {k: np.ascontiguousarray(v) for k, v in arrays.items()}
+    entries, offset = {}, 0
+    for name, arr in arrays.items():
+        offset = -(-offset // INDEX_ALIGN) * INDEX_ALIGN
+        entries[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset += arr.nbytes
+    header = json.dumps({'arrays': entries, 'meta': meta or {}}, ensure_ascii=False).encode('utf-8')
+    data_start = -(-(len(INDEX_MAGIC) + 8 + len(header)) // INDEX_ALIGN) * INDEX_ALIGN
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + entries[name]['offset'])
+            f.write(arr.tobytes())
+        f.truncate(data_start + offset)
+    tmp.replace(path)
+
+
+def load_arrays(path: Path, mmap: bool = True):
+    """读取 save_arrays 写出的文件，返回 (数组字典, meta)；mmap=True 时数组为只读内存映射"""
+    with open(path, 'rb') as f:
+        if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError(f"不是有效的索引文件: {path}")
+        header_len = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    data_start = -(-(len(INDEX_MAGIC) + 8 + header_len) // INDEX_ALIGN) * INDEX_ALIGN
+
+    raw = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+    arrays = {}
+    for name, e in header['arrays'].items():
+        dtype = np.dtype(e['dtype'])
+        count = int(np.prod(e['shape'], dtype=np.int64))
+        start = data_start + e['offset']
+        arrays[name] = raw[start:start + count * dtype.itemsize].view(dtype).reshape(e['shape'])
+    return arrays, header['meta']
+
+
+def save_city_index(path: Path, proj: LocalProjection, buildings: BuildingIndex = None,
+                    nfz: PointGridIndex = None, pois: dict = None, demand: dict = None,
+                    extra_meta: dict = None):
+    """把一个城市的建筑索引、禁飞区索引 (共用同一投影 proj) 与需求 POI 写入同一个索引文件"""
+    arrays, meta = {}, {'proj': [proj.lon0, proj.lat0], **(extra_meta or {})}
+    if buildings is not None:
+        b_arrays, meta['buildings'] = buildings.to_arrays()
+        arrays.update(b_arrays)
+    if nfz is not None:
+        z_arrays, meta['nfz'] = nfz.to_arrays()
+        arrays.update(z_arrays)
+        arrays['z_lon'] = pois['lon']
+        arrays['z_lat'] = pois['lat']
+        meta['nfz']['pois'] = {k: [str(v) for v in pois[k]] for k in ('poi_id', 'name', 'category')}
+    if demand is not None:
+        arrays['d_lon'] = demand['lon']
+        arrays['d_lat'] = demand['lat']
+        meta['demand'] = {k: list(demand[k]) for k in ('name', 'category')}
+    save_arrays(path, arrays, meta)
+
+
+def load_city_index(path: Path, mmap: bool = True) -> dict:
+    """
+    读取城市索引文件，返回
+    {'proj': LocalProjection, 'buildings': BuildingIndex|None, 'nfz': PointGridIndex|None,
+     'pois': dict|None, 'demand': dict|None, 'meta': dict}
+    """
+    arrays, meta = load_arrays(path, mmap=mmap)
+    result = {'proj': LocalProjection(*meta['proj']), 'buildings': None, 'nfz': None,
+              'pois': None, 'demand': None, 'meta': meta}
+    if 'buildings' in meta:
+        result['buildings'] = BuildingIndex.from_arrays(arrays, meta['buildings'])
+    if 'nfz' in meta:
+        result['nfz'] = PointGridIndex.from_arrays(arrays, meta['nfz'])
+        pois = {k: np.asarray(v, dtype=object) for k, v in meta['nfz']['pois'].items()}
+        pois.update(lon=arrays['z_lon'], lat=arrays['z_lat'], radius=arrays['z_radii'])
+        result['pois'] = pois
+    if 'demand' in meta:
+        demand = {k: np.asarray(v, dtype=object) for k, v in meta['demand'].items()}
+        demand.update(lon=arrays['d_lon'], lat=arrays['d_lat'])
+        result['demand'] = demand
+    return result
+
+
+# 城市索引文件名，与 GeoJSON 位于同一目录 (process_multi_city.py 输出)
+CITY_INDEX_FILENAME = "spatial_index.sidx"
+CITY_INDEX_SOURCES = {
+    'buildings': "buildings_3d.geojson",
+    'pois': "poi_sensitive.geojson",
+    'demand': "poi_demand.geojson",
+}
+
+
+def build_city_index(city_dir: Path, output_path: Path = None, cell_size: float = DEFAULT_CELL_SIZE,
+                     radius_map: dict = None, default_radius: float = 50.0) -> Path:
+    """
+    由 city_dir 下已有的 GeoJSON 构建城市索引文件 (默认 city_dir/spatial_index.sidx)。
+    投影原点取建筑包围盒中心 (无建筑时取 POI)，三类数据共用；缺失的数据源跳过。
+    """
+    output_path = output_path or city_dir / CITY_INDEX_FILENAME
+    sources = {k: city_dir / name for k, name in CITY_INDEX_SOURCES.items()}
+    radius_map = radius_map or {}
+
+    buildings = pois = demand = nfz = None
+    if sources['buildings'].exists():
+        buildings = load_building_index(sources['buildings'], cell_size=cell_size)
+    if sources['pois'].exists():
+        pois = load_sensitive_pois(sources['pois'], radius_map, default_radius)
+    if sources['demand'].exists():
+        demand = load_demand_pois(sources['demand'])
+
+    if buildings is not None:
+        proj = buildings.proj
+    else:
+        lon = np.concatenate([d['lon'] for d in (pois, demand) if d is not None] or [np.zeros(1)])
+        lat = np.concatenate([d['lat'] for d in (pois, demand) if d is not None] or [np.zeros(1)])
+        proj = LocalProjection((lon.min() + lon.max()) / 2, (lat.min() + lat.max()) / 2)
+    if pois is not None:
+        x, y = proj.forward(pois['lon'], pois['lat'])
+        nfz = PointGridIndex(x, y, pois['radius'])
+
+    extra = {'nfz_radius': {'map': radius_map, 'default': default_radius}}
+    save_city_index(output_path, proj, buildings, nfz, pois, demand, extra_meta=extra)
+    return output_path
+
+
+def index_matches(index: dict, cell_size: float = None, radius_map: dict = None,
+                  default_radius: float = None) -> bool:
+    """
+    城市索引的配置是否与调用方一致 (参数为 None 的项不检查):
+    给出 cell_size 即表示需要该网格边长的建筑物部分；radius_map / default_radius 与 meta 中的禁飞半径比较
+    """
+    meta = index['meta']
+    if cell_size is not None and (index.get('buildings') is None
+                                  or meta['buildings']['cell_size'] != float(cell_size)):
+        return False
+    if radius_map is not None and meta.get('nfz_radius') != {'map': radius_map, 'default': default_radius}:
+        return False
+    return True
+
+
+def load_prebuilt_index(source_path: Path, require: str, cell_size: float = None,
+                        radius_map: dict = None, default_radius: float = None):
+    """
+    加载与 source_path 同目录的预构建城市索引 (内存映射)。
+    索引不存在、比该目录任一源 GeoJSON 旧、缺少 require 指定的部分 ('buildings'/'nfz'/'demand')、
+    给出 cell_size 时缺少建筑物部分，或网格边长 / 禁飞半径配置与调用方不一致时返回 None，
+    由调用方回退到解析 GeoJSON。
+    """
+    path = source_path.parent / CITY_INDEX_FILENAME
+    if not path.exists():
+        return None
+    mtime = path.stat().st_mtime
+    for name in CITY_INDEX_SOURCES.values():
+        src = source_path.parent / name
+        if src.exists() and src.stat().st_mtime > mtime:
+            logger.warning(f"城市索引已过期 (早于 {name})，改为解析 GeoJSON: {path}")
+            return None
+    try:
+        index = load_city_index(path)
+    except (ValueError, KeyError, OSError) as e:
+        logger.warning(f"城市索引读取失败 ({e})，改为解析 GeoJSON: {path}")
+        return None
+    if index.get(require) is None or not index_matches(index, cell_size, radius_map, default_radius):
+        return None
+    return index
+
+
+# ===========================================================================
+#  文件定位与轨迹读取
+# ===========================================================================
+def find_city_file(processed_dir: Path, city: str, filename: str) -> Path:
+    """深圳数据可能位于 processed 根目录 (process_multi_city.py 兼容输出) 或 shenzhen/ 子目录"""
+    candidates = [processed_dir / city / filename]
+    if city == "shenzhen":
+        candidates.insert(0, processed_dir / filename)
+    for c in candidates:
+        if c.exists():
+            return c
+    return candidates[-1]
+
+
+def load_trajectory_points(traj_csv: Path, columns=('lat', 'lon', 'alt_rel')) -> dict:
+    """
+    读取 uav_trajectories.csv，按 (flight_id, timestamp) 排序后返回:
+      flight_ids      object[F]  航班 id
+      flight_offsets  int64[F+1] 第 f 个航班的点位于 [offsets[f], offsets[f+1])
+      timestamp / 以及 columns 中的各列  float64[N]
+    """
+    import pandas as pd
+
+    usecols = ['flight_id', 'timestamp'] + [c for c in columns if c != 'timestamp']
+    df = pd.read_csv(traj_csv, usecols=usecols)
+    df = df.dropna().sort_values(['flight_id', 'timestamp'], kind='stable')
+
+    fid = df['flight_id'].to_numpy()
+    change = np.flatnonzero(fid[1:] != fid[:-1]) + 1
+    starts = np.concatenate([[0], change]).astype(np.int64) if len(fid) else np.zeros(0, dtype=np.int64)
+    table = {
+        'flight_ids': fid[starts],
+        'flight_offsets': np.concatenate([starts, [len(fid)]]).astype(np.int64),
+        'timestamp': df['timestamp'].to_numpy(dtype=np.float64),
+    }
+    for c in columns:
+        table[c] = df[c].to_numpy(dtype=np.float64)
+    return table
+
+
+# ===========================================================================
+#  航班时间区间索引
+# ===========================================================================
+class FlightIntervalIndex:
+    """
+    航班起止时刻 [start, end] 的区间索引:
+      starts_sorted / ends_sorted  两个有序数组，t 时刻活跃数 = #(start <= t) - #(end < t)，两次二分
+      bucket_offsets / bucket_ids  按 bucket_seconds 分桶的 CSR 表，每桶登记与该时间窗相交的航班；
+                                   活跃航班查询只需过滤 t 所在的一个桶
+    """
+
+    def __init__(self, starts, ends, bucket_seconds: float = 60.0, origin: float = None):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.bucket_seconds = float(bucket_seconds)
+        if origin is None:
+            origin = float(self.starts.min()) if len(self.starts) else 0.0
+        self.origin = float(origin)
+        self.starts_sorted = np.sort(self.starts)
+        self.ends_sorted = np.sort(self.ends)
+
+        first = self._bucket(self.starts)
+        last = np.maximum(self._bucket(self.ends), first)
+        n_buckets = int(last.max()) + 1 if len(last) else 0
+        owner, bucket = ragged_arange(first, last - first + 1)
+        order = np.lexsort((owner, bucket))
+        self.bucket_ids = owner[order]
+        self.bucket_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(bucket, minlength=n_buckets))]).astype(np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _bucket(self, t):
+        return np.floor((np.asarray(t, dtype=np.float64) - self.origin)
+                        / self.bucket_seconds).astype(np.int64)
+
+    def count(self, t: float) -> int:
+        """t 时刻活跃 (start <= t <= end) 的航班数"""
+        return int(np.searchsorted(self.starts_sorted, t, side='right')
+                   - np.searchsorted(self.ends_sorted, t, side='left'))
+
+    def active(self, t: float) -> np.ndarray:
+        """t 时刻活跃的航班下标 (升序)"""
+        k = int(self._bucket(t))
+        if k < 0 or k >= len(self.bucket_offsets) - 1:
+            return np.zeros(0, dtype=np.int64)
+        cand = self.bucket_ids[self.bucket_offsets[k]:self.bucket_offsets[k + 1]]
+        return cand[(self.starts[cand] <= t) & (self.ends[cand] >= t)]
+
+    def per_second(self, t_max: float):
+        """
+        每秒直方图 (秒 s 覆盖 [floor(start), ceil(end)] 的航班计入，与前端看板口径一致)。
+        返回 (active[S], cumulative[S])，cumulative 为截至第 s 秒已起飞的航班数
+        """
+        max_sec = max(int(np.ceil(t_max)), 0)
+        s0 = np.maximum(np.floor(self.starts), 0).astype(np.int64)
+        s1 = np.minimum(np.ceil(self.ends), max_sec).astype(np.int64)
+        valid = s0 <= max_sec
+        diff = np.zeros(max_sec + 2, dtype=np.int64)
+        np.add.at(diff, s0[valid & (s1 >= s0)], 1)
+        np.add.at(diff, s1[valid & (s1 >= s0)] + 1, -1)
+        active = np.cumsum(diff)[:max_sec + 1]
+        cumulative = np.cumsum(np.bincount(s0[valid], minlength=max_sec + 1))[:max_sec + 1]
+        return active, cumulative